@@ -0,0 +1,53 @@
+"""
+compares the listener dispatch index with a linear scan over all registered listeners.
+
+    python -m benchmark.dispatch
+"""
+from timeit import timeit
+
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerBuilderAware
+
+FRAMES = [
+    KeypathView({'success': {'connected': {'connectionId': 'c-1'}}}),
+    KeypathView({'success': {'spaceState': {'roomsTree': [{'id': 'r-1', 'name': 'lobby'}]}}}),
+    KeypathView({'success': {'room': {'id': 'r-1', 'response': {'spatial': {'update': {'chatMessage': {'id': 'm-1'}}}}}}}),
+    KeypathView({'pickedUp': {}}),
+]
+
+
+def build_socket(listener_count: int) -> ListenerBuilderAware:
+    socket = ListenerBuilderAware()
+    for message_type in ('success.connected', 'pickedUp', 'success.spaceState.roomsTree',
+                         'success.room.response.spatial.update.chatMessage',
+                         'success.room.response.stage.update.chatMessage',
+                         'success.room.response.spatial.state.chat',
+                         'success.room.response.stage.state.chat'):
+        socket.on(message_type).call(lambda s, m: None)
+    for i in range(listener_count):
+        socket.on(f'success.room.response.custom{i}.update').call(lambda s, m: None)
+    return socket
+
+
+def linear_scan(socket: ListenerBuilderAware):
+    for frame in FRAMES:
+        list(filter(lambda l: l.accepts(frame), socket.listener_index.listeners))
+
+
+def indexed(socket: ListenerBuilderAware):
+    for frame in FRAMES:
+        socket.listener_index.matching(frame)
+
+
+def main(rounds: int = 20):
+    print(f'{"listeners":>10} {"linear [us/frame]":>18} {"indexed [us/frame]":>19}')
+    for listener_count in (0, 10, 100, 500):
+        socket = build_socket(listener_count)
+        frames = rounds * len(FRAMES)
+        linear = timeit(lambda: linear_scan(socket), number=rounds) / frames * 1e6
+        index = timeit(lambda: indexed(socket), number=rounds) / frames * 1e6
+        print(f'{len(socket.listener_index):>10} {linear:>18.2f} {index:>19.2f}')
+
+
+if __name__ == '__main__':
+    main()
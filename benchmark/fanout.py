@@ -0,0 +1,80 @@
+"""
+fetching the history of many direct chats one by one compared to the concurrent fan-out, against a local stub of
+the spatial api with a fixed latency per request.
+
+    python -m benchmark.fanout [--chats 100] [--latency 50]
+"""
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from time import perf_counter, sleep
+
+from requests import Session
+
+from chat.entity.account import ChatAccount
+from chat.entity.chat import DirectChat, fetch_all_messages
+from chat.spatial.api import SpatialApiConnector, Endpoints
+from chat.spatial.codec import dumps, loads
+
+
+def page(account_id: str, count: int = 30):
+    return {'success': {'messages': [
+        {'id': f'{account_id}-{i}', 'created': {'account': {'account': {'name': account_id}},
+                                                'date': f'2022-01-25T14:{i % 60:02}:00.000Z'},
+         'state': {'active': {'content': f'message {i}'}}} for i in range(count)]}}
+
+
+def stub_server(latency: float) -> ThreadingHTTPServer:
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_PUT(self):
+            payload = loads(self.rfile.read(int(self.headers['Content-Length'])))
+            sleep(latency)
+            body = dumps(page(payload['accountId'])).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(chat_count: int, latency: float):
+    server = stub_server(latency)
+    api_url = f'http://127.0.0.1:{server.server_address[1]}/api'
+    # responses must not come from the cache
+    uncached = {Endpoints.GET_DIRECT_MESSAGE_CHAT_PAGE: None}
+    chats = [ChatAccount(f'account {i}', f'a-{i}') for i in range(chat_count)]
+
+    sap = SpatialApiConnector(Session(), api_url=api_url, cache_ttls=uncached)
+    start = perf_counter()
+    serial = sum(len(DirectChat(account, sap).get_all_message()) for account in chats)
+    serial_time = perf_counter() - start
+    print(f'serial:            {serial_time:.2f}s for {chat_count} chats ({serial} messages)')
+
+    for max_concurrency in (4, 8, 16):
+        sap = SpatialApiConnector(Session(), api_url=api_url, pool_size=max_concurrency, cache_ttls=uncached)
+        start = perf_counter()
+        fanned_out = sum(len(history.messages)
+                         for history in fetch_all_messages([DirectChat(account, sap) for account in chats],
+                                                           max_concurrency))
+        fanned_out_time = perf_counter() - start
+        print(f'concurrency {max_concurrency:>2}:    {fanned_out_time:.2f}s ({fanned_out} messages, '
+              f'{serial_time / fanned_out_time:.1f}x)')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='direct chat history fan-out benchmark')
+    parser.add_argument('--chats', type=int, default=100, help='direct chats to fetch the history of')
+    parser.add_argument('--latency', type=int, default=50, help='latency of the stub api per request in ms')
+    args = parser.parse_args()
+    main(args.chats, args.latency / 1000)
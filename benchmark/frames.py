@@ -0,0 +1,173 @@
+"""
+feeds onlineSpace frames through MessageHandlingWebSocketMixin._on_message and the full listener set of a space,
+reporting frames/s, p50/p99 latency per frame and the peak memory of every scenario.
+
+the frames are synthetic: a large rooms tree, the chat state of many rooms and bursts of new chat messages. recorded
+frames can be fed instead, either a frame capture or a text file holding one frame per line.
+
+results are compared with the saved baseline, a scenario which got slower or bigger than the tolerance is flagged
+as a regression and the benchmark exits with 1. timings only compare on the same machine, so the baseline is not
+committed (benchmark/frames_baseline.json is ignored by git): produce it with --save on the baseline commit, then
+run the benchmark again on the change to compare.
+
+    python -m benchmark.frames [--frames frames.capture.gz] [--archive] [--repeat 3] [--save]
+                               [--baseline benchmark/frames_baseline.json] [--tolerance 0.2]
+"""
+import gc
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from json import dump, load
+from os.path import exists
+from statistics import quantiles
+from time import perf_counter
+from typing import List, Dict, Callable, Any, Tuple
+
+from requests import Session
+from websocket import WebSocketApp
+
+from chat.entity.archive import MessageArchive
+from chat.entity.room import RoomJoiner, RoomOperations, RoomsTreeListener
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import dumps
+from chat.spatial.websocket.capture import read_capture
+from chat.spatial.websocket.engine import SocketEngine
+from chat.spatial.websocket.space import SpatialWebSocketAppWrapper
+
+START = datetime(2022, 1, 25, 14, 10, 11, 222000)
+
+
+def chat_json(room_id: str, i: int, authors: int = 50) -> Dict[str, Any]:
+    return {'id': f'{room_id}-message-{i:08d}',
+            'created': {'account': {'account': {'name': f'author name {i % authors}'}},
+                        'date': f'{(START + timedelta(seconds=7 * i)).isoformat(timespec="milliseconds")}Z'},
+            'state': {'active': {'content': f'chat message number {i} with some text'}}}
+
+
+def connected_frame() -> str:
+    return dumps({'success': {'connected': {'connectionId': 'connection-1'}}})
+
+
+def rooms_tree_frame(rooms: int) -> str:
+    return dumps({'success': {'spaceState': {'roomsTree': [{'id': f'room-{i}', 'name': f'room number {i}'}
+                                                           for i in range(rooms)]}}})
+
+
+def state_frame(room_id: str, messages: int) -> str:
+    return dumps({'success': {'room': {'id': room_id, 'response': {'spatial': {'state': {
+        'chat': [chat_json(room_id, i) for i in range(messages)]}}}}}})
+
+
+def update_frame(room_id: str, i: int) -> str:
+    return dumps({'success': {'room': {'id': room_id, 'response': {'spatial': {'update': {
+        'chatMessage': chat_json(room_id, i)}}}}}})
+
+
+def scenarios() -> Dict[str, List[str]]:
+    return {
+        'rooms tree': [connected_frame()] + [rooms_tree_frame(500) for _ in range(20)],
+        'chat state': [state_frame(f'room-{i}', 1000) for i in range(20)],
+        'message burst': [update_frame(f'room-{i % 10}', 1000 + i) for i in range(20_000)],
+    }
+
+
+def recorded(path: str) -> Dict[str, List[str]]:
+    if path.endswith('.gz'):
+        return {f'recorded {path}': [captured.frame for captured in read_capture(path) if captured.frame != 'ping']}
+    with open(path) as file:
+        return {f'recorded {path}': [line.rstrip('\n') for line in file if line.strip()]}
+
+
+def listening_socket(archive: bool) -> SpatialWebSocketAppWrapper:
+    """
+    space socket with the listeners of a joined space, frames are processed on the calling thread
+    """
+    socket = SpatialWebSocketAppWrapper('space-1', WebSocketApp('ws://127.0.0.1/'), SocketEngine(max_connecting=1))
+    socket.dispatch = None
+    sap = SpatialApiConnector(Session())
+    room_joiner = RoomJoiner(sap, socket.space_connection,
+                             RoomOperations.build(sap, socket, MessageArchive() if archive else None))
+    RoomsTreeListener(room_joiner, socket)
+    for i in range(10):
+        room_joiner.room_operations.chat_listener.register_on_new_message(f'room-{i}', lambda message: None)
+    return socket
+
+
+def run(frames: List[str], archive: bool) -> List[float]:
+    socket = listening_socket(archive)
+    latencies = list()
+    try:
+        for frame in frames:
+            started = perf_counter()
+            socket._on_message(socket.socket, frame)
+            latencies.append(perf_counter() - started)
+    finally:
+        socket.engine.shutdown()
+    return latencies
+
+
+def peak_memory(frames: List[str], archive: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    run(frames, archive)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def measure(frames: List[str], archive: bool, repeat: int) -> Dict[str, float]:
+    # the run with the median total time is reported, single runs are too noisy to compare with a baseline
+    runs = sorted((run(frames, archive) for _ in range(repeat)), key=sum)
+    latencies = runs[len(runs) // 2]
+    percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {'frames': len(frames),
+            'frames_per_second': len(frames) / sum(latencies),
+            'p50_ms': percentiles[49] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+            'peak_mib': peak_memory(frames, archive) / 2 ** 20}
+
+
+def regressions(result: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    checks: List[Tuple[str, Callable[[float, float], bool]]] = [
+        ('frames_per_second', lambda now, before: now < before * (1 - tolerance)),
+        ('p50_ms', lambda now, before: now > before * (1 + tolerance)),
+        ('p99_ms', lambda now, before: now > before * (1 + tolerance)),
+        ('peak_mib', lambda now, before: now > before * (1 + tolerance)),
+    ]
+    return [key for key, regressed in checks if key in baseline and regressed(result[key], baseline[key])]
+
+
+def main():
+    parser = ArgumentParser(description='frame processing benchmark')
+    parser.add_argument('--frames', help='frame capture (.gz) or recorded frames, one per line, instead of the '
+                                         'synthetic scenarios')
+    parser.add_argument('--archive', action='store_true', help='write through to an in-memory message archive')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, the median run is reported')
+    parser.add_argument('--baseline', default='benchmark/frames_baseline.json')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change regarded as regression')
+    args = parser.parse_args()
+
+    baseline = dict()
+    if exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = load(file)
+    results, regressed = dict(), False
+    for name, frames in (recorded(args.frames) if args.frames else scenarios()).items():
+        name = f'{name} (archive)' if args.archive else name
+        result = results[name] = measure(frames, args.archive, args.repeat)
+        flagged = regressions(result, baseline.get(name, dict()), args.tolerance)
+        regressed = regressed or bool(flagged)
+        print(f'{name:>20}: {result["frames"]:6d} frames {result["frames_per_second"]:10.0f} frames/s '
+              f'p50 {result["p50_ms"]:8.3f}ms p99 {result["p99_ms"]:8.3f}ms peak {result["peak_mib"]:7.1f}MiB'
+              f'{"  REGRESSION: " + ", ".join(flagged) if flagged else ""}')
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            dump({**baseline, **results}, file, indent=2)
+        print(f'saved baseline to {args.baseline}')
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
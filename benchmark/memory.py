@@ -0,0 +1,60 @@
+"""
+bytes per retained chat message, comparing a set of ChatMessage instances with the columnar RoomMessageStore.
+
+    python -m benchmark.memory
+"""
+import gc
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Any, List
+
+from chat.entity.messages import ChatMessage
+from chat.entity.store import RoomMessageStore
+from chat.spatial.codec import dumps, loads, KeypathView
+
+
+def chats_payload(count: int, authors: int = 50) -> str:
+    start = datetime(2022, 1, 25, 14, 10, 11, 222000)
+    chats = [{'id': f'message-{i:08d}',
+              'created': {'account': {'account': {'name': f'author name {i % authors}'}},
+                          'date': f'{(start + timedelta(seconds=7 * i)).isoformat(timespec="milliseconds")}Z'},
+              'state': {'active': {'content': f'chat message number {i} with some text'}}}
+             for i in range(count)]
+    return dumps(chats)
+
+
+def decode(payload: str) -> List[KeypathView]:
+    # every message holds its own copies of the strings, like after receiving a frame
+    return [KeypathView(chat) for chat in loads(payload)]
+
+
+def retained_bytes(build: Callable[[], Any]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    retained = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert retained is not None
+    return after - before
+
+
+def main(count: int = 50_000):
+    payload = chats_payload(count)
+
+    def message_set():
+        return set(ChatMessage.from_json_list(decode(payload)))
+
+    def room_store():
+        store = RoomMessageStore()
+        store.replace(ChatMessage.from_json_list(decode(payload)))
+        return store
+
+    print(f'{count} messages')
+    for name, build in (('set of ChatMessage', message_set), ('RoomMessageStore', room_store)):
+        print(f'{name:>20}: {retained_bytes(build) / count:8.1f} bytes/message')
+
+
+if __name__ == '__main__':
+    main()
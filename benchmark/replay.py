@@ -0,0 +1,38 @@
+"""
+replays a frame capture into the listeners of a joined space, at the original pace, n times faster or as fast as
+possible, and prints the metrics of the listener pipeline afterwards.
+
+capture the frames of the tui with SPATIAL_CHAT_CAPTURE=frames.capture.gz, then
+
+    python -m benchmark.replay frames.capture.gz [--speed 10 | --fast] [--source wss://...] [--archive]
+"""
+from argparse import ArgumentParser
+
+from benchmark.frames import listening_socket
+from chat.spatial.metrics import Metrics
+from chat.spatial.websocket.capture import FrameReplayer, read_capture
+
+
+def main():
+    parser = ArgumentParser(description='replays a frame capture')
+    parser.add_argument('capture')
+    parser.add_argument('--speed', type=float, default=1.0, help='factor of the original pace')
+    parser.add_argument('--fast', action='store_true', help='as fast as possible')
+    parser.add_argument('--source', help='only replay the frames of the socket with this url')
+    parser.add_argument('--archive', action='store_true', help='write through to an in-memory message archive')
+    args = parser.parse_args()
+
+    socket = listening_socket(args.archive)
+    socket.metrics = Metrics()
+    try:
+        stats = FrameReplayer(socket, None if args.fast else args.speed).replay(read_capture(args.capture),
+                                                                                 args.source)
+    finally:
+        socket.engine.shutdown()
+    print(f'replayed {stats.frames} frames in {stats.seconds:.2f}s, {stats.frames_per_second:.0f} frames/s')
+    for line in socket.metrics.summary():
+        print(f'  {line}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+lookup times of the chat search on a filled archive. with --history the messages are stored the way paged history
+arrives, newest page first and every page newest message first.
+
+    python -m benchmark.search [--messages 200000] [--rounds 200] [--history]
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from random import Random
+from statistics import median
+from time import perf_counter
+
+from chat.entity.archive import MessageArchive
+from chat.entity.messages import ChatMessage, get_timezone
+
+WORDS = ['hello', 'world', 'meeting', 'coffee', 'lunch', 'deploy', 'review', 'release', 'ticket', 'question',
+         'answer', 'tomorrow', 'today', 'weekend', 'bug', 'feature', 'design', 'call', 'later', 'thanks']
+AUTHORS = ['anna', 'bert', 'chris', 'dora', 'emil', 'fiona', 'gustav', 'hanna']
+
+
+def fill(archive: MessageArchive, count: int, history: bool = False, batch: int = 10000):
+    random = Random(1)
+    timezone = get_timezone()
+    start = timezone.localize(datetime(2021, 1, 1))
+    offsets = range(0, count, batch)
+    for offset in reversed(offsets) if history else offsets:
+        messages = [ChatMessage(random.choice(AUTHORS),
+                                ' '.join(random.choices(WORDS, k=8)) + f' token{number}',
+                                start + timedelta(seconds=number), timezone, f'm-{number}')
+                    for number in range(offset, min(count, offset + batch))]
+        archive.room('space', f'room-{offset // batch % 10}').save(reversed(messages) if history else messages)
+
+
+def measure(call, rounds: int = 200) -> float:
+    timings = list()
+    for _ in range(rounds):
+        start = perf_counter()
+        call()
+        timings.append(perf_counter() - start)
+    return median(timings) * 1000
+
+
+def main():
+    parser = ArgumentParser(description='chat search benchmark')
+    parser.add_argument('--messages', type=int, default=200000, help='messages in the archive')
+    parser.add_argument('--rounds', type=int, default=200, help='runs per query, the median is reported')
+    parser.add_argument('--history', action='store_true', help='store the messages in the order of paged history')
+    args = parser.parse_args()
+
+    count = args.messages
+    archive = MessageArchive()
+    start = perf_counter()
+    fill(archive, count, args.history)
+    print(f'indexed {count} messages in {perf_counter() - start:.1f}s')
+    since = get_timezone().localize(datetime(2021, 1, 1)) + timedelta(seconds=count - 3600)
+    queries = {
+        'rare word': lambda: archive.search(f'token{count // 2}'),
+        'rare prefix': lambda: archive.search(f'token{count // 20}'[:-1], limit=10),
+        'common word': lambda: archive.search('coffee'),
+        'author and word': lambda: archive.search('coffee', author='anna', limit=10),
+        'last hour': lambda: archive.search(since=since, limit=10),
+    }
+    for name, query in queries.items():
+        print(f'{name:>16}: {measure(query, args.rounds):.3f} ms (median)')
+
+
+if __name__ == '__main__':
+    main()
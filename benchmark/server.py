@@ -0,0 +1,357 @@
+"""
+local stand-in for spatial.chat: the api endpoints used by SpatialApiConnector and the onlineSpace and
+connectDirectMessageChat websockets, all served on one port.
+
+every space has the same number of rooms, each with a chat history. new chat messages are generated at a fixed
+rate across all rooms and pushed to the connections which joined the room, or to every connection of the space with
+--broadcast. api responses can be delayed to inject latency.
+
+    python -m benchmark.server [--port 8080] [--spaces 2] [--rooms 10] [--history 50] [--rate 5] [--latency 20]
+
+point the clients at it with SpatialApiConnector(Session(), api_url='http://127.0.0.1:8080/api'), the websockets
+are derived from the api url.
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from base64 import b64encode
+from datetime import datetime, timezone, timedelta
+from hashlib import sha1
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+from random import Random
+from socket import socket
+from threading import Thread, Lock, Event
+from time import sleep
+from typing import Dict, List, Optional, Any, Callable, BinaryIO, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from chat.spatial.codec import dumps, loads
+from support.mixin import LoggableMixin
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TEXT, CLOSE, PING, PONG = 0x1, 0x8, 0x9, 0xa
+
+
+def iso_millis(created: datetime) -> str:
+    return f'{created.astimezone(timezone.utc).replace(tzinfo=None).isoformat(timespec="milliseconds")}Z'
+
+
+def chat_json(message_id: str, author: str, content: str, created: datetime) -> Dict[str, Any]:
+    return {'id': message_id, 'created': {'account': {'account': {'name': author}}, 'date': iso_millis(created)},
+            'state': {'active': {'content': content}}}
+
+
+def room_frame(room_id: str, response: Dict[str, Any]) -> str:
+    return dumps({'success': {'room': {'id': room_id, 'response': {'spatial': response}}}})
+
+
+class WebSocketConnection:
+    """
+    server side of a websocket connection, just enough of rfc 6455 for text frames, pings and closing
+    """
+
+    def __init__(self, connection: socket, reader: BinaryIO, kind: str, key: str, connection_id: str):
+        self.connection = connection
+        # the reader of the http request, it may already hold the first frames
+        self.reader = reader
+        self.kind = kind
+        # space or account id the connection was opened for
+        self.key = key
+        self.connection_id = connection_id
+        self.room_id: Optional[str] = None
+        self.pongs = 0
+        self.open = True
+        self._send_lock = Lock()
+
+    def send(self, text: str):
+        self.send_frame(TEXT, text.encode())
+
+    def send_frame(self, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            header = bytes((0x80 | opcode, length))
+        elif length < 2 ** 16:
+            header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, 'big')
+        else:
+            header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, 'big')
+        with self._send_lock:
+            if not self.open:
+                return
+            try:
+                self.connection.sendall(header + payload)
+            except OSError:
+                self.open = False
+
+    def receive(self) -> Optional[Tuple[int, bytes]]:
+        """
+        the next frame as (opcode, payload), None once the connection is gone
+        """
+        header = self._read(2)
+        if header is None:
+            return None
+        length = header[1] & 0x7f
+        if length == 126:
+            length = int.from_bytes(self._read(2) or b'\0\0', 'big')
+        elif length == 127:
+            length = int.from_bytes(self._read(8) or bytes(8), 'big')
+        mask = self._read(4) if header[1] & 0x80 else bytes(4)
+        payload = self._read(length) if length else b''
+        if mask is None or payload is None:
+            return None
+        return header[0] & 0x0f, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def close(self):
+        self.send_frame(CLOSE, b'')
+        self.open = False
+
+    def _read(self, length: int) -> Optional[bytes]:
+        try:
+            data = self.reader.read(length)
+        except OSError:
+            return None
+        return data if len(data) == length else None
+
+
+class FakeSpatialServer(LoggableMixin):
+    def __init__(self, spaces: int = 2, rooms: int = 10, history: int = 50, rate: float = 0.0,
+                 latency: float = 0.0, ping_interval: float = 25, broadcast: bool = False, direct_chats: int = 5,
+                 host: str = '127.0.0.1', port: int = 0, seed: int = 0):
+        super().__init__()
+        self.latency = latency
+        self.rate = rate
+        self.ping_interval = ping_interval
+        self.broadcast = broadcast
+        self.random = Random(seed)
+        self._lock = Lock()
+        self._ids = count()
+        self._stopped = Event()
+        self.started = datetime.now(timezone.utc)
+        self.spaces = [{'id': f'space-{s}', 'name': f'space {s}', 'slug': f'space-{s}'} for s in range(spaces)]
+        self.rooms = {space['id']: [{'id': f'{space["id"]}-room-{r}', 'name': f'room {r}'} for r in range(rooms)]
+                      for space in self.spaces}
+        self.chats: Dict[str, List[Dict[str, Any]]] = {
+            room['id']: [chat_json(self._next_id(), f'author {i % 7}', f'history message {i}',
+                                   self.started - timedelta(minutes=history - i)) for i in range(history)]
+            for space_rooms in self.rooms.values() for room in space_rooms}
+        self.direct_accounts = [{'name': f'direct {d}', 'accountId': f'account-{d}'} for d in range(direct_chats)]
+        self.direct_history = history
+        self.connections: List[WebSocketConnection] = list()
+        self.http = ThreadingHTTPServer((host, port), self._handler())
+        self.http.daemon_threads = True
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.http.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def start(self) -> FakeSpatialServer:
+        Thread(target=self.http.serve_forever, args=(0.05,), name='FakeSpatialServer', daemon=True).start()
+        Thread(target=self._ping, name='FakeSpatialPing', daemon=True).start()
+        if self.rate > 0:
+            Thread(target=self._generate, name='FakeSpatialTraffic', daemon=True).start()
+        self.info(f'serving {self.api_url}')
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for connection in self.space_connections() + self.direct_connections():
+            connection.close()
+        self.http.shutdown()
+        self.http.server_close()
+
+    def space_connections(self, space_id: Optional[str] = None) -> List[WebSocketConnection]:
+        with self._lock:
+            return [c for c in self.connections if c.kind == 'space' and c.open and space_id in (None, c.key)]
+
+    def direct_connections(self) -> List[WebSocketConnection]:
+        with self._lock:
+            return [c for c in self.connections if c.kind == 'direct' and c.open]
+
+    def post(self, room_id: str, author: str, content: str) -> Dict[str, Any]:
+        chat = chat_json(self._next_id(), author, content, datetime.now(timezone.utc))
+        with self._lock:
+            self.chats[room_id].append(chat)
+        self._push(room_id, room_frame(room_id, {'update': {'chatMessage': chat}}))
+        return chat
+
+    def delete(self, room_id: str, message_id: str):
+        with self._lock:
+            chats = self.chats[room_id]
+            deleted = [chat for chat in chats if chat['id'] == message_id]
+            chats[:] = [chat for chat in chats if chat['id'] != message_id]
+        for chat in deleted:
+            self._push(room_id, room_frame(room_id, {'update': {'chatMessage': {**chat, 'state': {'deleted': {}}}}}))
+
+    def _next_id(self) -> str:
+        return f'message-{next(self._ids):08d}'
+
+    def _space_of(self, room_id: str) -> str:
+        return room_id.rsplit('-room-', 1)[0]
+
+    def _push(self, room_id: str, frame: str):
+        for connection in self.space_connections(self._space_of(room_id)):
+            if self.broadcast or connection.room_id == room_id:
+                connection.send(frame)
+
+    def _ping(self):
+        while not self._stopped.wait(self.ping_interval):
+            for connection in self.space_connections() + self.direct_connections():
+                connection.send('ping')
+
+    def _generate(self):
+        rooms = list(self.chats)
+        while not self._stopped.wait(1 / self.rate):
+            self.post(self.random.choice(rooms), f'author {self.random.randrange(7)}', 'generated message')
+
+    def _direct_page(self, account_id: str, before: Optional[str]) -> List[Dict[str, Any]]:
+        history = [chat_json(f'{account_id}-{i:06d}', account_id, f'direct message {i}',
+                             self.started - timedelta(minutes=self.direct_history - i))
+                   for i in range(self.direct_history)]
+        if before:
+            history = [chat for chat in history if chat['id'] < before]
+        return list(reversed(history[-30:]))
+
+    def _api(self, endpoint: str, payload: Dict[str, Any], account: str) -> Dict[str, Any]:
+        if endpoint == 'Account/registerAccount':
+            return {'authKey': f'auth-key-{payload["email"]}'}
+        if endpoint == 'Account/authAccountByMagicLink':
+            # the token is handed out as cookie
+            return {}
+        if endpoint == 'Account/getAccountProfile':
+            return {'name': account, 'email': f'{account}@localhost', 'accountId': f'account-of-{account}'}
+        if endpoint == 'SpaceVisited/listSpaceVisited':
+            return {'spaces': [{'space': space} for space in self.spaces]}
+        if endpoint == 'SpaceOnline/joinRoom':
+            connection = self._connection(payload['connectionId'])
+            connection.room_id = payload['roomId']
+            with self._lock:
+                chats = list(self.chats[payload['roomId']])
+            connection.send(room_frame(payload['roomId'], {'state': {'chat': chats}}))
+            return {}
+        if endpoint == 'SpaceOnlineRoomChat/postRoomChatMessage':
+            return {'chatMessage': self.post(payload['roomId'], account, payload['content'])}
+        if endpoint == 'SpaceOnlineRoomChat/deleteRoomChatMessage':
+            self.delete(payload['roomId'], payload['messageId'])
+            return {}
+        if endpoint == 'DirectChat/getDirectMessageChatPage':
+            return {'messages': self._direct_page(payload['accountId'], payload.get('before'))}
+        raise KeyError(endpoint)
+
+    def _connection(self, connection_id: str) -> WebSocketConnection:
+        with self._lock:
+            return next(c for c in self.connections if c.connection_id == connection_id)
+
+    def _open(self, handler: BaseHTTPRequestHandler, kind: str, key: str):
+        accept = b64encode(sha1(handler.headers['Sec-WebSocket-Key'].encode() + WEBSOCKET_GUID).digest()).decode()
+        handler.send_response(101, 'Switching Protocols')
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+        connection = WebSocketConnection(handler.connection, handler.rfile, kind, key, f'connection-{next(self._ids)}')
+        with self._lock:
+            self.connections.append(connection)
+        if kind == 'space':
+            connection.send(dumps({'success': {'connected': {'connectionId': connection.connection_id}}}))
+            connection.send(dumps({'success': {'spaceState': {'roomsTree': self.rooms[key]}}}))
+        else:
+            connection.send(dumps({'success': {'state': {'chats': [{'account': {'account': account}}
+                                                                   for account in self.direct_accounts]}}}))
+        self._serve(connection)
+        with self._lock:
+            self.connections.remove(connection)
+
+    def _serve(self, connection: WebSocketConnection):
+        while connection.open:
+            frame = connection.receive()
+            if frame is None:
+                connection.open = False
+                return
+            opcode, payload = frame
+            if opcode == CLOSE:
+                connection.close()
+            elif opcode == PING:
+                connection.send_frame(PONG, payload)
+            elif opcode == TEXT and payload == b'pong':
+                connection.pongs += 1
+            # the leave message is ignored, the client closes the connection after leaving
+
+    def _handler(self) -> Callable[..., BaseHTTPRequestHandler]:
+        server = self
+
+        class FakeSpatialHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def account(self) -> str:
+                for cookie in (self.headers.get('Cookie') or '').split(';'):
+                    name, _, value = cookie.strip().partition('=')
+                    if name == 'authorization':
+                        return value
+                return 'anonymous'
+
+            def do_PUT(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                endpoint = urlsplit(self.path).path[len('/api/'):]
+                if server.latency:
+                    sleep(server.latency)
+                try:
+                    result = server._api(endpoint, loads(body) if body else dict(), self.account())
+                    self.reply(200, {'success': result})
+                except (KeyError, StopIteration) as e:
+                    self.reply(404, {'error': f'unknown {e}'})
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                if self.headers.get('Upgrade', '').lower() != 'websocket':
+                    self.reply(400, {'error': 'websocket only'})
+                elif url.path == '/api/SpaceOnline/onlineSpace' and query.get('spaceId', [''])[0] in server.rooms:
+                    server._open(self, 'space', query['spaceId'][0])
+                elif url.path == '/api/ChatOnline/connectDirectMessageChat' and 'accountId' in query:
+                    server._open(self, 'direct', query['accountId'][0])
+                else:
+                    self.reply(404, {'error': f'unknown {url.path}'})
+
+            def reply(self, status: int, body: Dict[str, Any]):
+                content = dumps(body).encode()
+                self.send_response(status)
+                if self.path.endswith('authAccountByMagicLink'):
+                    self.send_header('Set-Cookie', f'authorization=token-{next(server._ids)}; Path=/')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return FakeSpatialHandler
+
+
+def main():
+    parser = ArgumentParser(description='local stand-in for spatial.chat')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--spaces', type=int, default=2)
+    parser.add_argument('--rooms', type=int, default=10, help='rooms per space')
+    parser.add_argument('--history', type=int, default=50, help='chat messages per room and direct chat')
+    parser.add_argument('--rate', type=float, default=0.0, help='generated chat messages per second')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every api response in ms')
+    parser.add_argument('--ping', type=float, default=25, help='seconds between pings')
+    parser.add_argument('--broadcast', action='store_true', help='push messages to every connection of the space')
+    args = parser.parse_args()
+    server = FakeSpatialServer(args.spaces, args.rooms, args.history, args.rate, args.latency / 1000, args.ping,
+                               args.broadcast, host=args.host, port=args.port).start()
+    print(f'serving {server.api_url}, ctrl+c to stop')
+    try:
+        Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
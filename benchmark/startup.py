@@ -0,0 +1,109 @@
+"""
+measures how fast the tui starts: the import time of chat.main and of the widget sets it defers, each in a fresh
+interpreter, and, against a local stand-in spatial server answering with the given latency, the time from starting
+the process until the first paint and until the spaces are listed.
+
+the tui runs in a pseudo terminal, so no real terminal is needed.
+
+    python -m benchmark.startup [--repeat 5] [--latency 100] [--spaces 5]
+"""
+import json
+import os
+import pty
+import subprocess
+import sys
+from argparse import ArgumentParser
+from fcntl import ioctl
+from os.path import join, dirname, abspath
+from select import select
+from statistics import median
+from struct import pack
+from tempfile import TemporaryDirectory
+from termios import TIOCSWINSZ
+from time import perf_counter
+from typing import Dict, Optional, List
+
+from benchmark.server import FakeSpatialServer
+
+ROOT = dirname(dirname(abspath(__file__)))
+TITLE = b'Spatial Omnichat'
+
+
+def import_seconds(module: str) -> float:
+    script = f'from time import perf_counter; started = perf_counter(); import {module}; ' \
+             f'print(perf_counter() - started)'
+    return float(subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout)
+
+
+def start_tui(account_file: str, api_url: str, directory: str, timeout: float, first_space: bytes
+              ) -> Dict[str, Optional[float]]:
+    """
+    seconds from starting the process until the title and the first space appeared on the terminal
+    """
+    main, child = pty.openpty()
+    ioctl(child, TIOCSWINSZ, pack('HHHH', 40, 120, 0, 0))
+    env = {**os.environ, 'TERM': 'xterm-256color', 'PYTHONPATH': ROOT, 'XDG_CACHE_HOME': directory}
+    started = perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'chat.main', '--account', account_file, '--api-url', api_url],
+                               cwd=directory, env=env, stdin=child, stdout=child, stderr=child)
+    os.close(child)
+    timings: Dict[str, Optional[float]] = {'first_paint': None, 'spaces': None}
+    screen = b''
+    try:
+        while timings['spaces'] is None and perf_counter() - started < timeout:
+            readable, _, _ = select([main], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                screen += os.read(main, 65536)
+            except OSError:
+                break
+            if timings['first_paint'] is None and TITLE in screen:
+                timings['first_paint'] = perf_counter() - started
+            if first_space in screen:
+                timings['spaces'] = perf_counter() - started
+    finally:
+        os.write(main, b'q')
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        os.close(main)
+    return timings
+
+
+def measure_tui(repeat: int, latency: float, spaces: int, timeout: float) -> Dict[str, List[float]]:
+    server = FakeSpatialServer(spaces=spaces, rooms=3, history=10, latency=latency).start()
+    try:
+        with TemporaryDirectory() as directory:
+            account_file = join(directory, 'account.secret')
+            with open(account_file, 'w') as file:
+                json.dump({'email': 'tester@localhost', 'auth_code': 'tester'}, file)
+            runs = [start_tui(account_file, server.api_url, directory, timeout, b'space 0') for _ in range(repeat)]
+    finally:
+        server.stop()
+    return {key: [run[key] for run in runs if run[key] is not None] for key in ('first_paint', 'spaces')}
+
+
+def main():
+    parser = ArgumentParser(description='tui startup benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the median is reported')
+    parser.add_argument('--latency', type=float, default=100, help='milliseconds every api call takes')
+    parser.add_argument('--spaces', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=20, help='seconds to wait for the tui to list the spaces')
+    args = parser.parse_args()
+
+    for module in ('chat.main', 'chat.tui.space', 'chat.daemon'):
+        seconds = median(import_seconds(module) for _ in range(args.repeat))
+        print(f'{"import " + module:>28}: {seconds * 1000:8.1f}ms')
+    timings = measure_tui(args.repeat, args.latency / 1000, args.spaces, args.timeout)
+    for key, label in (('first_paint', 'time to first paint'), ('spaces', 'time to spaces listed')):
+        values = timings[key]
+        result = f'{median(values) * 1000:8.1f}ms' if values else '     n/a'
+        print(f'{label:>28}: {result} ({len(values)}/{args.repeat} runs, api latency {args.latency:.0f}ms)')
+
+
+if __name__ == '__main__':
+    main()
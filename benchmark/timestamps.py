@@ -0,0 +1,48 @@
+"""
+compares the timestamp parsing of chat payloads with the previous per-call implementation.
+
+    python -m benchmark.timestamps
+"""
+from datetime import datetime, timedelta
+from timeit import timeit
+
+import pytz
+
+from chat.entity.messages import to_datetime, to_datetimes, to_epoch_millis_list, get_timezone
+
+
+def previous_to_datetime(datetime_str: str, local_tz) -> datetime:
+    utc_tz = pytz.timezone('UTC')
+    utc_time = datetime.fromisoformat(datetime_str[:-1])
+    utc_tz_localized = utc_tz.localize(utc_time)
+    return local_tz.normalize(utc_tz_localized)
+
+
+def timestamps(count: int, spacing: timedelta):
+    start = datetime(2022, 1, 25, 14, 10, 11, 222000)
+    return [f'{(start + spacing * i).isoformat(timespec="milliseconds")}Z' for i in range(count)]
+
+
+def main(count: int = 100_000, rounds: int = 3):
+    for spacing in (timedelta(seconds=1, milliseconds=7), timedelta(seconds=37)):
+        run(timestamps(count, spacing), spacing, rounds)
+
+
+def run(datetime_strs, spacing: timedelta, rounds: int):
+    local_tz = get_timezone()
+    assert [previous_to_datetime(s, local_tz) for s in datetime_strs[:1000]] == to_datetimes(datetime_strs[:1000],
+                                                                                              local_tz)
+    runs = {
+        'previous to_datetime': lambda: [previous_to_datetime(s, pytz.timezone('Europe/Berlin'))
+                                         for s in datetime_strs],
+        'to_datetime': lambda: [to_datetime(s, local_tz) for s in datetime_strs],
+        'to_datetimes (batch)': lambda: to_datetimes(datetime_strs, local_tz),
+        'to_epoch_millis_list': lambda: to_epoch_millis_list(datetime_strs),
+    }
+    print(f'{len(datetime_strs)} timestamps, {spacing.total_seconds()}s apart')
+    for name, run in runs.items():
+        print(f'{name:>22}: {timeit(run, number=rounds) / rounds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+headless chat stream: logs in from an account file, joins the selected spaces and rooms and writes every chat
+message as one json line to stdout or a file. py_cui is never imported, so no terminal is needed.
+
+    python -m chat.daemon [--account chat/account.secret] [--space NAME_OR_ID ...] [--room NAME_OR_ID ...]
+                          [--output chats.jsonl] [--max-messages 1000] [--max-pending 10000]
+"""
+from __future__ import annotations
+
+import sys
+from argparse import ArgumentParser
+from logging import basicConfig, DEBUG, INFO
+from queue import Queue, Full, Empty
+from signal import signal, SIGTERM
+from threading import Thread, Lock, Event
+from time import monotonic
+from typing import Optional, Dict, Any, List, Sequence, BinaryIO, Set
+
+from attr import define, field
+from requests import Session
+
+from chat.entity.messages import ChatMessage
+from chat.entity.room import JoinedRoom
+from chat.entity.session import SpaceSessions, SpaceSession
+from chat.entity.space import Space
+from chat.spatial.account import AuthenticatedAccount, FileAccount
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import dumps
+from chat.spatial.listener import ListenerTimeoutError, RoomStateTimeoutError
+from support.mixin import LoggableMixin
+
+
+@define
+class StreamStats:
+    written: int = field(default=0)
+    # records which had to wait for a free slot in the queue
+    blocked: int = field(default=0)
+    # records lost after the output failed
+    dropped: int = field(default=0)
+
+
+class JsonLinesWriter(LoggableMixin):
+    """
+    writes records as json lines from a background thread.
+
+    producers only put the record into a bounded queue and block once max_pending records are waiting, so memory
+    stays bounded when the output falls behind. records are serialized and written in batches, the output is flushed
+    at least every flush_interval seconds. once the output failed, e.g. a closed pipe, records are dropped.
+    """
+
+    def __init__(self, output: BinaryIO, max_pending: int = 10_000, flush_interval: float = 0.5,
+                 batch_size: int = 1000):
+        super().__init__()
+        self.output = output
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.stats = StreamStats()
+        self.error: Optional[OSError] = None
+        self._queue: Queue[Optional[Dict[str, Any]]] = Queue(max_pending)
+        self._writer = Thread(target=self._write, name='JsonLinesWriter', daemon=True)
+        self._writer.start()
+
+    def write(self, record: Dict[str, Any]):
+        if self.error:
+            self.stats.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            self.stats.blocked += 1
+            self._queue.put(record)
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _write(self):
+        flushed = monotonic()
+        while True:
+            try:
+                records = [self._queue.get(timeout=self.flush_interval)]
+            except Empty:
+                records = list()
+            while records and records[-1] is not None and len(records) < self.batch_size:
+                try:
+                    records.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            closing = bool(records) and records[-1] is None
+            if closing:
+                records.pop()
+            if records:
+                self._output(b''.join(f'{dumps(record)}\n'.encode() for record in records), len(records))
+            if closing:
+                break
+            if monotonic() - flushed >= self.flush_interval:
+                self._output(b'', 0)
+                flushed = monotonic()
+        self._output(b'', 0)
+        self.info(f'wrote {self.stats.written} records, blocked {self.stats.blocked}, dropped {self.stats.dropped}')
+
+    def _output(self, lines: bytes, count: int):
+        if self.error:
+            self.stats.dropped += count
+            return
+        try:
+            if lines:
+                self.output.write(lines)
+            else:
+                self.output.flush()
+            self.stats.written += count
+        except OSError as e:
+            self.error = e
+            self.stats.dropped += count
+            self._log.error(f'writing the chat stream failed, dropping all further chats: {e}')
+
+
+def chat_record(kind: str, space: Space, joined_room: JoinedRoom, chat: ChatMessage) -> Dict[str, Any]:
+    return {'kind': kind, 'space_id': space.space_id, 'space': space.name, 'room_id': joined_room.room.room_id,
+            'room': joined_room.room.name, 'message_id': chat.message_id, 'author': chat.author_name,
+            'created': chat.created.isoformat(), 'message': chat.message}
+
+
+def deleted_record(space: Space, joined_room: JoinedRoom, message_id: str) -> Dict[str, Any]:
+    return {'kind': 'deleted', 'space_id': space.space_id, 'space': space.name,
+            'room_id': joined_room.room.room_id, 'room': joined_room.room.name, 'message_id': message_id}
+
+
+class RoomStream(LoggableMixin):
+    """
+    streams the chats of a joined room: the initial chats once the room state arrived, afterwards every new one.
+
+    chats arriving before the initial chats were streamed are held back. afterwards only those not already part of
+    the initial chats are streamed, so no chat is streamed twice or lost.
+    """
+
+    def __init__(self, space: Space, joined_room: JoinedRoom, writer: JsonLinesWriter):
+        super().__init__()
+        self.space = space
+        self.joined_room = joined_room
+        self.writer = writer
+        self._lock = Lock()
+        self._streaming = False
+        self._held: List[Dict[str, Any]] = list()
+        self._initial_ids: Set[str] = set()
+        joined_room.on_new_message(self._on_new_message)
+        joined_room.on_deleted_message(self._on_deleted_message)
+
+    def stream_initial(self) -> int:
+        # waiting for the room state must not hold the lock, the state arrives on the thread of the callbacks
+        chats = self.joined_room.get_chat_messages()
+        with self._lock:
+            self._initial_ids = {chat.message_id for chat in chats}
+            for chat in chats:
+                self.writer.write(chat_record('initial', self.space, self.joined_room, chat))
+            self._streaming = True
+            held, self._held = self._held, list()
+            for record in held:
+                self._write(record)
+        self.info(f'streamed {len(chats)} initial chats of {self.joined_room.room}')
+        return len(chats)
+
+    def _on_new_message(self, chat: ChatMessage):
+        self._stream(chat_record('new', self.space, self.joined_room, chat))
+
+    def _on_deleted_message(self, message_id: str):
+        self._stream(deleted_record(self.space, self.joined_room, message_id))
+
+    def _stream(self, record: Dict[str, Any]):
+        with self._lock:
+            if self._streaming:
+                self._write(record)
+            else:
+                self._held.append(record)
+
+    def _write(self, record: Dict[str, Any]):
+        if record['kind'] == 'new' and record['message_id'] in self._initial_ids:
+            self.debug(f'dropping new chat [{record["message_id"]}], already streamed with the initial chats')
+            return
+        self.writer.write(record)
+
+
+def is_selected(selection: Sequence[str], *keys: str) -> bool:
+    return not selection or any(key in selection for key in keys)
+
+
+class ChatDaemon(LoggableMixin):
+    """
+    streams the chats of one room per selected space. spaces are selected by id, name or slug, all visited spaces
+    by default. rooms are selected by id or name, the first selected room of a space is joined, by default its
+    first room. disconnected spaces are reconnected by their session, chats missed meanwhile are streamed as new.
+    """
+
+    def __init__(self, account: AuthenticatedAccount, writer: JsonLinesWriter, spaces: Sequence[str] = (),
+                 rooms: Sequence[str] = (), max_messages: Optional[int] = 1000, timeout: float = 30):
+        super().__init__()
+        self.account = account
+        self.writer = writer
+        self.spaces = spaces
+        self.rooms = rooms
+        self.timeout = timeout
+        self.sessions = SpaceSessions(account, max_messages=max_messages)
+        self.streams: List[RoomStream] = list()
+
+    def start(self) -> List[RoomStream]:
+        spaces = [space for space in self.account.list_spaces()
+                  if is_selected(self.spaces, space.space_id, space.name, space.slug)]
+        # all spaces connect at the same time, the rooms are joined once their tree arrived
+        for session in self.sessions.connect_all(spaces):
+            stream = self._join(session)
+            if stream:
+                self.streams.append(stream)
+        for stream in self.streams:
+            try:
+                stream.stream_initial()
+            except RoomStateTimeoutError as e:
+                self._log.warning(f'no initial chats of {stream.joined_room.room}: {e}')
+        return self.streams
+
+    def stop(self):
+        self.sessions.leave_all()
+        # pending frames are still dispatched, so the writer has to be closed afterwards
+        self.sessions.engine.shutdown()
+
+    def _join(self, session: SpaceSession) -> Optional[RoomStream]:
+        try:
+            rooms = session.joined_space.list_rooms(self.timeout)
+        except ListenerTimeoutError as e:
+            self._log.warning(f'skipping space [{session.space.name}]: {e}')
+            return None
+        room = next((room for room in rooms if is_selected(self.rooms, room.room_id, room.name)), None)
+        if room is None:
+            self.info(f'no selected room in space [{session.space.name}]')
+            return None
+        try:
+            joined_room = room.join()
+        except ListenerTimeoutError as e:
+            self._log.warning(f'skipping room [{room.name}] of space [{session.space.name}]: {e}')
+            return None
+        return RoomStream(session.space, joined_room, self.writer)
+
+
+def main():
+    parser = ArgumentParser(description='stream chat messages as json lines')
+    parser.add_argument('--account', default='chat/account.secret', help='account file to log in with')
+    parser.add_argument('--api-url', default=SpatialApiConnector.default_api_url)
+    parser.add_argument('--space', action='append', default=list(), help='space id, name or slug, repeatable')
+    parser.add_argument('--room', action='append', default=list(), help='room id or name, repeatable')
+    parser.add_argument('--output', default='-', help='file the chats are appended to, - for stdout')
+    parser.add_argument('--max-messages', type=int, default=1000, help='chats kept per room for resyncing')
+    parser.add_argument('--max-pending', type=int, default=10_000, help='chats waiting to be written at most')
+    parser.add_argument('--flush-interval', type=float, default=0.5, help='seconds between flushes of the output')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    # the log goes to stderr, stdout may carry the chats
+    basicConfig(level=DEBUG if args.verbose else INFO, stream=sys.stderr)
+
+    stopped = Event()
+    signal(SIGTERM, lambda signum, frame: stopped.set())
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'ab', buffering=1 << 20)
+    file_account = FileAccount.from_file(args.account)
+    file_account.sap = SpatialApiConnector(Session(), api_url=args.api_url)
+    writer = JsonLinesWriter(output, args.max_pending, args.flush_interval)
+    try:
+        with file_account as account:
+            daemon = ChatDaemon(account, writer, args.space, args.room, args.max_messages)
+            try:
+                daemon.start()
+                while not stopped.wait(1):
+                    pass
+            except KeyboardInterrupt:
+                pass
+            finally:
+                daemon.stop()
+    finally:
+        writer.close()
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from datetime import datetime
+from heapq import heappush, heappop
+from threading import Lock
+from typing import Dict, List, Tuple, Optional
+
+from chat.entity.messages import ChatMessage, next_relative_duration_change
+
+
+class AgeLabelScheduler:
+    """
+    caches the age label of each message together with the time it changes next.
+
+    all labels of a render pass are computed against the same 'now' snapshot and a refresh only recomputes the
+    labels which are due. deadlines range from seconds to a year, so they are kept in a heap instead of a wheel.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.now = datetime.now()
+        self._messages: Dict[str, ChatMessage] = dict()
+        self._labels: Dict[str, str] = dict()
+        self._next_change: Dict[str, datetime] = dict()
+        self._due: List[Tuple[datetime, str]] = list()
+
+    def label(self, message: ChatMessage) -> str:
+        with self._lock:
+            if self._messages.get(message.message_id) is not message:
+                self._messages[message.message_id] = message
+                self._update(message)
+            return self._labels[message.message_id]
+
+    def refresh(self, now: Optional[datetime] = None) -> List[str]:
+        """
+        takes a new 'now' snapshot and returns the ids of the messages whose label changed
+        """
+        changed = list()
+        with self._lock:
+            self.now = now or datetime.now()
+            while self._due and self._due[0][0] <= self.now:
+                due, message_id = heappop(self._due)
+                if self._next_change.get(message_id) != due:
+                    # removed or rescheduled in the meantime
+                    continue
+                label = self._labels[message_id]
+                if label != self._update(self._messages[message_id]):
+                    changed.append(message_id)
+        return changed
+
+    def remove(self, message_id: str):
+        with self._lock:
+            self._messages.pop(message_id, None)
+            self._labels.pop(message_id, None)
+            self._next_change.pop(message_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self._labels.clear()
+            self._next_change.clear()
+            self._due.clear()
+
+    def _update(self, message: ChatMessage) -> str:
+        now = message.timezone.localize(self.now)
+        label = message.age_at(now)
+        self._labels[message.message_id] = label
+        until_change = next_relative_duration_change(now - message.created)
+        if until_change is None:
+            self._next_change.pop(message.message_id, None)
+        else:
+            next_change = self.now + until_change
+            self._next_change[message.message_id] = next_change
+            heappush(self._due, (next_change, message.message_id))
+        return label
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+from datetime import datetime
+from os import environ, makedirs
+from os.path import expanduser, join, dirname
+from threading import Lock
+from typing import List, Iterable, Optional, Tuple, Any
+
+from attr import define, field
+
+from chat.entity.messages import ChatMessage, get_timezone, from_epoch_millis, datetime_to_epoch_millis
+from support.mixin import LoggableMixin
+
+
+class MessageArchive(LoggableMixin):
+    """
+    on-disk copy of chat messages, so a chat can be shown before its state arrived from the network.
+
+    messages are kept per chat, which is either a room of a space or the direct chat with an account. the connection
+    is shared between the socket threads and the ui, so every access is serialized.
+
+    archived messages are full-text searchable. the fts5 index is kept up to date by triggers, if the sqlite build
+    lacks fts5 the search falls back to scanning with LIKE.
+    """
+    schema = '''
+        CREATE TABLE IF NOT EXISTS messages (
+            chat TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            author_name TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timezone TEXT NOT NULL,
+            UNIQUE (chat, message_id)
+        );
+        CREATE INDEX IF NOT EXISTS messages_by_created ON messages (chat, created);
+        CREATE INDEX IF NOT EXISTS messages_by_time ON messages (created);
+    '''
+    search_schema = '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_search USING fts5(
+            message, author_name, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_search_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_search(rowid, message, author_name) VALUES (new.rowid, new.message, new.author_name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_search_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_search(messages_search, rowid, message, author_name)
+                VALUES ('delete', old.rowid, old.message, old.author_name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_search_update AFTER UPDATE ON messages BEGIN
+            INSERT INTO messages_search(messages_search, rowid, message, author_name)
+                VALUES ('delete', old.rowid, old.message, old.author_name);
+            INSERT INTO messages_search(rowid, message, author_name) VALUES (new.rowid, new.message, new.author_name);
+        END;
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_search_terms USING fts5vocab(messages_search, 'row');
+    '''
+    columns = 'm.chat, m.message_id, m.created, m.author_name, m.message, m.timezone'
+    # messages created after the oldest of the last indexed hits, which are checked for newer hits at most
+    search_scan_limit = 1000
+    # terms a searched prefix is expanded to at most, broader prefixes are matched by the index as prefix
+    search_max_terms = 32
+
+    def __init__(self, path: str = ':memory:'):
+        super().__init__()
+        self.path = path
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.schema)
+        try:
+            self._connection.executescript(self.search_schema)
+            self.searchable = True
+        except sqlite3.OperationalError as e:
+            self.info(f'full-text search not available, falling back to scanning: {e}')
+            self.searchable = False
+
+    @classmethod
+    def default(cls) -> MessageArchive:
+        path = join(environ.get('XDG_CACHE_HOME', expanduser(join('~', '.cache'))), 'spatial_chat',
+                    'messages.sqlite3')
+        makedirs(dirname(path), exist_ok=True)
+        return cls(path)
+
+    def room(self, space_id: str, room_id: str) -> ArchivedChat:
+        return ArchivedChat(self, f'room/{space_id}/{room_id}')
+
+    def direct(self, account_id: str) -> ArchivedChat:
+        return ArchivedChat(self, f'direct/{account_id}')
+
+    @staticmethod
+    def space_chats(space_id: str) -> str:
+        """
+        common prefix of all room chats in the space
+        """
+        return f'room/{space_id}/'
+
+    def load(self, chat: str, limit: Optional[int] = None) -> List[ChatMessage]:
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT {self.columns} FROM messages m WHERE chat = ? '
+                'ORDER BY created DESC, message_id DESC LIMIT ?', (chat, -1 if limit is None else limit)).fetchall()
+        messages = [self._to_message(row) for row in reversed(rows)]
+        self.debug(f'loaded {len(messages)} messages of [{chat}]')
+        return messages
+
+    def message_ids(self, chat: str, since: Optional[datetime] = None) -> List[str]:
+        """
+        ids of the archived messages of the chat, all or the ones created since the given time
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT message_id FROM messages WHERE chat = ? AND created >= ?',
+                                            (chat, datetime_to_epoch_millis(since) if since else 0)).fetchall()
+        return [message_id for message_id, in rows]
+
+    def search(self, text: str = '', author: Optional[str] = None, since: Optional[datetime] = None,
+               until: Optional[datetime] = None, chats: str = '', limit: int = 50) -> List[SearchHit]:
+        """
+        newest messages containing all words of the text and written by an author matching all words of author.
+        words match as prefixes. the search can be narrowed to a time range and chats starting with the given prefix.
+        """
+        conditions, parameters = list(), list()
+        if chats:
+            # the prefix range can be served by the chat index
+            conditions.append('m.chat >= ? AND m.chat < ?')
+            parameters.extend((chats, chats + '\U0010ffff'))
+        if since:
+            conditions.append('m.created >= ?')
+            parameters.append(datetime_to_epoch_millis(since))
+        if until:
+            conditions.append('m.created < ?')
+            parameters.append(datetime_to_epoch_millis(until))
+        column_words = [(column, search_words(words or '')) for column, words in (('message', text),
+                                                                                  ('author_name', author))]
+        column_words = [(column, words) for column, words in column_words if words]
+        if self.searchable and column_words:
+            rows = self._search_indexed(column_words, conditions, parameters, limit)
+        else:
+            statement = f'SELECT {self.columns} FROM messages m WHERE 1'
+            for column, words in column_words:
+                for word in words:
+                    conditions.append(f"m.{column} LIKE ? ESCAPE '\\'")
+                    parameters.append(f'%{like_escape(word)}%')
+            statement = ' AND '.join([statement] + conditions) + ' ORDER BY m.created DESC LIMIT ?'
+            parameters.append(limit)
+            with self._lock:
+                rows = self._connection.execute(statement, parameters).fetchall()
+        return [SearchHit(row[0], self._to_message(row)) for row in rows]
+
+    def _search_indexed(self, column_words: List[Tuple[str, List[str]]], conditions: List[str],
+                        parameters: List[Any], limit: int) -> List[Tuple[Any, ...]]:
+        """
+        newest hits of the full-text query, without sorting all of them.
+
+        the index yields the hits by rowid, which mostly follows the creation of the messages: live chats are stored
+        oldest first, paged history newest first. so the last hits by rowid are taken, or else the first ones. newer
+        hits can only be messages created after the oldest of those, but stored outside of their rowid range. if
+        there are few messages created since, those are looked up by rowid. otherwise all hits are sorted.
+        """
+        statement = f'SELECT {self.columns}, messages_search.rowid FROM messages_search ' \
+                    f'JOIN messages m ON m.rowid = messages_search.rowid WHERE ' + \
+                    ' AND '.join(['messages_search MATCH ?'] + conditions)
+        with self._lock:
+            query = ' AND '.join(f'{{{column}}} : ({" AND ".join(self._word_query(word) for word in words)})'
+                                 for column, words in column_words)
+            rows = self._newest_hits(statement, [query, *parameters], limit, 'DESC')
+            if rows is None:
+                rows = self._newest_hits(statement, [query, *parameters], limit, 'ASC')
+            if rows is None:
+                rows = self._connection.execute(f'{statement} ORDER BY m.created DESC LIMIT ?',
+                                                [query, *parameters, limit]).fetchall()
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return [row[:-1] for row in rows[:limit]]
+
+    def _newest_hits(self, statement: str, parameters: List[Any], limit: int,
+                     order: str) -> Optional[List[Tuple[Any, ...]]]:
+        rows = self._connection.execute(f'{statement} ORDER BY messages_search.rowid {order} LIMIT ?',
+                                        [*parameters, limit]).fetchall()
+        if len(rows) < limit:
+            return rows
+        oldest, bound = min(row[2] for row in rows), rows[-1][-1]
+        beyond = '<' if order == 'DESC' else '>'
+        created_since, low, high = self._connection.execute(
+            f'SELECT count(*), min(CASE WHEN id {beyond} ? THEN id END), max(CASE WHEN id {beyond} ? THEN id END) '
+            'FROM (SELECT rowid AS id FROM messages INDEXED BY messages_by_time WHERE created > ? LIMIT ?)',
+            (bound, bound, oldest, self.search_scan_limit)).fetchone()
+        if created_since >= self.search_scan_limit:
+            return None
+        if low is not None:
+            rows += self._connection.execute(
+                f'{statement} AND messages_search.rowid BETWEEN ? AND ? AND m.created > ?',
+                [*parameters, low, high, oldest]).fetchall()
+        return rows
+
+    def _word_query(self, word: str) -> str:
+        """
+        the word and all longer terms starting with it. the index merges all hits of a prefix before yielding the
+        first one, while hits of terms are yielded newest first. the terms are only looked up for plain words, which
+        the index keeps as they are apart from the case.
+        """
+        if not (word.isascii() and word.isalnum()):
+            return f'"{word}"*'
+        word = word.lower()
+        # a lower bound right after the word itself, counting its hits would take as long as merging them
+        terms = [term for term, in self._connection.execute(
+            'SELECT term FROM messages_search_terms WHERE term >= ? AND term < ? LIMIT ?',
+            (word + '\x01', word + '\U0010ffff', self.search_max_terms + 1))]
+        if len(terms) > self.search_max_terms:
+            return f'"{word}"*'
+        # quoted, so they are never taken as operators
+        quoted = [f'"{term}"' for term in [word] + terms]
+        return f'({" OR ".join(quoted)})'
+
+    def save(self, chat: str, messages: Iterable[ChatMessage]):
+        rows = [(chat, m.message_id, datetime_to_epoch_millis(m.created), m.author_name, m.message, m.timezone.zone)
+                for m in messages]
+        if rows:
+            with self._lock, self._connection:
+                # unchanged messages are skipped, so they are not indexed again
+                self._connection.executemany(
+                    'INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (chat, message_id) DO UPDATE SET '
+                    'created = excluded.created, author_name = excluded.author_name, message = excluded.message, '
+                    'timezone = excluded.timezone WHERE created != excluded.created OR '
+                    'author_name != excluded.author_name OR message != excluded.message', rows)
+
+    def delete(self, chat: str, message_ids: Iterable[str]):
+        rows = [(chat, message_id) for message_id in message_ids]
+        if rows:
+            with self._lock, self._connection:
+                self._connection.executemany('DELETE FROM messages WHERE chat = ? AND message_id = ?', rows)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _to_message(row: Tuple[Any, ...]) -> ChatMessage:
+        _, message_id, created, author_name, message, timezone_name = row
+        timezone = get_timezone(timezone_name)
+        return ChatMessage(author_name, message, from_epoch_millis(created, timezone), timezone, message_id)
+
+
+def search_words(text: str) -> List[str]:
+    return re.findall(r'\w+', text)
+
+
+def like_escape(word: str) -> str:
+    return word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+@define
+class SearchHit:
+    chat: str = field()
+    message: ChatMessage = field()
+
+    @property
+    def chat_id(self) -> str:
+        """
+        room or account id of the chat
+        """
+        return self.chat.rsplit('/', 1)[-1]
+
+
+@define
+class ArchivedChat:
+    archive: MessageArchive = field(repr=False)
+    chat: str = field()
+
+    def load(self, limit: Optional[int] = None) -> List[ChatMessage]:
+        return self.archive.load(self.chat, limit)
+
+    def save(self, messages: Iterable[ChatMessage]):
+        self.archive.save(self.chat, messages)
+
+    def message_ids(self, since: Optional[datetime] = None) -> List[str]:
+        return self.archive.message_ids(self.chat, since)
+
+    def delete(self, message_ids: Iterable[str]):
+        self.archive.delete(self.chat, message_ids)
@@ -1,40 +1,103 @@
-from typing import Dict, Any, List
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from logging import getLogger
+from typing import Dict, Any, List, Optional, Iterator, Iterable
 
 from attr import define, field
-from benedict.dicts import benedict
 from websocket import WebSocketApp
 
 from chat.entity.account import ChatAccount
+from chat.entity.archive import MessageArchive
 from chat.entity.messages import ChatMessage
+from chat.entity.pager import DirectMessagePager
 from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import KeypathView
 from chat.spatial.listener import BlockingListener, ListenerBuilderAware
 
 
 class ExistingDirectChatsListener(BlockingListener):
-    def __init__(self, sap: SpatialApiConnector, socket: ListenerBuilderAware):
+    def __init__(self, sap: SpatialApiConnector, socket: ListenerBuilderAware,
+                 archive: Optional[MessageArchive] = None):
         BlockingListener.__init__(self, socket, 'success.state.chats')
         self.sap = sap
+        self.archive = archive
         self.chats: List[DirectChat] = list()
 
-    def _on_message(self, socket: WebSocketApp, message: benedict):
-        for chat in message['success.state.chats']:
-            self.chats.append(DirectChat.from_json(chat['account'], self.sap))
+    def _on_message(self, socket: WebSocketApp, message: KeypathView):
+        self.chats = [DirectChat.from_json(chat['account'], self.sap, self.archive)
+                      for chat in message['success.state.chats']]
+
+    def get_chats(self, timeout: Optional[float] = None) -> List[DirectChat]:
+        self.wait_ready(timeout)
+        return self.chats
 
-    def get_chats(self):
-        with self.lock:
-            return self.chats
+    def fetch_all_messages(self, max_concurrency: int = 8) -> Iterator[DirectChatHistory]:
+        return fetch_all_messages(self.get_chats(), max_concurrency)
 
 
 @define
 class DirectChat:
     chat_account: ChatAccount = field()
     sap: SpatialApiConnector = field(repr=False)
+    archive: Optional[MessageArchive] = field(repr=False, default=None)
+
+    def get_cached_messages(self) -> List[ChatMessage]:
+        if not self.archive:
+            return list()
+        return self.archive.direct(self.chat_account.account_id).load()
 
     def get_all_message(self) -> List[ChatMessage]:
         direct_message_chats = self.sap.get_direct_message_chat_page(self.chat_account.account_id)
+        messages = [ChatMessage.from_json(KeypathView(dm)) for dm in direct_message_chats]
+        if not self.archive:
+            return messages
 
-        return [ChatMessage.from_json(benedict(dm)) for dm in direct_message_chats]
+        # the page only holds the latest messages, older ones are kept from previous downloads
+        archived_chat = self.archive.direct(self.chat_account.account_id)
+        archived_chat.save(messages)
+        return archived_chat.load()
+
+    def iter_messages(self, cutoff: Optional[datetime] = None) -> Iterator[ChatMessage]:
+        """
+        the history newest first, fetched page by page until the cutoff
+        """
+        on_page = self.archive.direct(self.chat_account.account_id).save if self.archive else None
+        return iter(DirectMessagePager(self.sap, self.chat_account.account_id, cutoff, on_page=on_page))
 
     @classmethod
-    def from_json(cls, chat_json: Dict[Any, Any], sap: SpatialApiConnector):
-        return DirectChat(ChatAccount.from_json(chat_json['account']), sap)
+    def from_json(cls, chat_json: Dict[Any, Any], sap: SpatialApiConnector, archive: Optional[MessageArchive] = None):
+        return DirectChat(ChatAccount.from_json(chat_json['account']), sap, archive)
+
+
+@define
+class DirectChatHistory:
+    chat: DirectChat = field()
+    messages: List[ChatMessage] = field(repr=False, factory=list)
+    error: Optional[Exception] = field(default=None)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def fetch_all_messages(chats: Iterable[DirectChat], max_concurrency: int = 8) -> Iterator[DirectChatHistory]:
+    """
+    fetches the messages of all chats with at most max_concurrency requests at a time. histories are yielded as
+    soon as they are complete, a failing chat is yielded with its error and does not affect the others.
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='DirectChatFetch') as executor:
+        futures = {executor.submit(chat.get_all_message): chat for chat in chats}
+        try:
+            for future in as_completed(futures):
+                chat = futures[future]
+                try:
+                    yield DirectChatHistory(chat, future.result())
+                except Exception as e:
+                    getLogger(DirectChat.__name__).exception(f'failed fetching messages of {chat}')
+                    yield DirectChatHistory(chat, error=e)
+        finally:
+            # the caller stopped early
+            for future in futures:
+                future.cancel()
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date, timezone
+from functools import lru_cache
+from math import floor
+from typing import Mapping, Optional, List, Iterable, Tuple, Any, Dict
 
 import pytz as pytz
 from attr import define, field
-from benedict.dicts import benedict
 
 
 @define
@@ -25,12 +27,115 @@ def to_relative_duration(delta: timedelta):
         return 'now'
 
 
+RELATIVE_DURATION_UNITS = ((1, 60), (60, 60 * 60), (60 * 60, 60 * 60 * 24), (60 * 60 * 24, 60 * 60 * 24 * 356))
+
+
+def next_relative_duration_change(delta: timedelta) -> Optional[timedelta]:
+    """
+    time until the label of to_relative_duration(delta) might change next, None if it never changes again
+    """
+    seconds = delta.total_seconds()
+    for unit, upper in RELATIVE_DURATION_UNITS:
+        if seconds < upper:
+            if unit == 1:
+                return timedelta(seconds=upper - seconds)
+            # labels are rounded, so they switch at the half of a unit
+            boundary = (floor(seconds / unit + 0.5) + 0.5) * unit
+            if boundary <= seconds:
+                boundary += unit
+            return timedelta(seconds=min(boundary, upper) - seconds)
+    return None
+
+
+DEFAULT_TIMEZONE = 'Europe/Berlin'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_DATE = EPOCH.date()
+EPOCH_NAIVE = EPOCH.replace(tzinfo=None)
+# utc offsets only change at quarter hours, so the local tzinfo can be looked up once per quarter hour
+OFFSET_BUCKET_MILLIS = 15 * 60 * 1000
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name: str = DEFAULT_TIMEZONE):
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=4096)
+def _epoch_day_millis(date_str: str) -> int:
+    return (date.fromisoformat(date_str) - EPOCH_DATE).days * 86_400_000
+
+
+@lru_cache(maxsize=4096)
+def _local_offset(local_tz, offset_bucket: int) -> Tuple[timedelta, Any]:
+    local_time = (EPOCH + timedelta(milliseconds=offset_bucket * OFFSET_BUCKET_MILLIS)).astimezone(local_tz)
+    return local_time.utcoffset(), local_time.tzinfo
+
+
+def _is_millisecond_timestamp(datetime_str: str) -> bool:
+    return len(datetime_str) == 24 and datetime_str[10] == 'T' and datetime_str[23] == 'Z'
+
+
+def to_epoch_millis(datetime_str: str) -> int:
+    """
+    milliseconds since the epoch of an utc iso timestamp like '2022-01-25T14:10:11.222Z'
+    """
+    if _is_millisecond_timestamp(datetime_str):
+        return (_epoch_day_millis(datetime_str[:10]) + int(datetime_str[11:13]) * 3_600_000 +
+                int(datetime_str[14:16]) * 60_000 + int(datetime_str[17:19]) * 1000 + int(datetime_str[20:23]))
+    utc_time = datetime.fromisoformat(datetime_str[:-1]).replace(tzinfo=timezone.utc)
+    return (utc_time - EPOCH) // timedelta(milliseconds=1)
+
+
+def datetime_to_epoch_millis(aware_datetime: datetime) -> int:
+    return (aware_datetime - EPOCH) // timedelta(milliseconds=1)
+
+
+def to_epoch_millis_list(datetime_strs: Iterable[str]) -> List[int]:
+    return [to_epoch_millis(datetime_str) for datetime_str in datetime_strs]
+
+
+def _offset_bucket(datetime_str: str) -> int:
+    return (_epoch_day_millis(datetime_str[:10]) + int(datetime_str[11:13]) * 3_600_000 +
+            int(datetime_str[14:16]) * 60_000) // OFFSET_BUCKET_MILLIS
+
+
+def _localize_utc(utc_time: datetime, offset_bucket: int, local_tz) -> datetime:
+    offset, local_tzinfo = _local_offset(local_tz, offset_bucket)
+    local_time = utc_time + offset
+    # the constructor is considerably faster than datetime.replace(tzinfo=...)
+    return datetime(local_time.year, local_time.month, local_time.day, local_time.hour, local_time.minute,
+                    local_time.second, local_time.microsecond, local_tzinfo)
+
+
+def from_epoch_millis(epoch_millis: int, local_tz) -> datetime:
+    return _localize_utc(EPOCH_NAIVE + timedelta(milliseconds=epoch_millis), epoch_millis // OFFSET_BUCKET_MILLIS,
+                         local_tz)
+
+
 def to_datetime(datetime_str: str, local_tz) -> datetime:
-    utc_tz = pytz.timezone('UTC')
-    utc_time = datetime.fromisoformat(datetime_str[:-1])
-    utc_tz_localized = utc_tz.localize(utc_time)
-    normalized = local_tz.normalize(utc_tz_localized)
-    return normalized
+    if _is_millisecond_timestamp(datetime_str):
+        return _localize_utc(datetime.fromisoformat(datetime_str[:-1]), _offset_bucket(datetime_str), local_tz)
+    return datetime.fromisoformat(datetime_str[:-1]).replace(tzinfo=timezone.utc).astimezone(local_tz)
+
+
+def to_datetimes(datetime_strs: Iterable[str], local_tz) -> List[datetime]:
+    """
+    batch variant of to_datetime, which resolves the utc offset only once per minute of the batch
+    """
+    offsets: Dict[str, Tuple[timedelta, Any]] = dict()
+    datetimes = list()
+    for datetime_str in datetime_strs:
+        if not _is_millisecond_timestamp(datetime_str):
+            datetimes.append(to_datetime(datetime_str, local_tz))
+            continue
+        minute = datetime_str[:16]
+        if minute not in offsets:
+            offsets[minute] = _local_offset(local_tz, _offset_bucket(datetime_str))
+        offset, local_tzinfo = offsets[minute]
+        local_time = datetime.fromisoformat(datetime_str[:-1]) + offset
+        datetimes.append(datetime(local_time.year, local_time.month, local_time.day, local_time.hour,
+                                  local_time.minute, local_time.second, local_time.microsecond, local_tzinfo))
+    return datetimes
 
 
 @define(hash=True)
@@ -42,7 +147,8 @@ class ChatMessage:
     message_id = field()
 
     @classmethod
-    def from_json(cls, chat_json: benedict, local_tz=pytz.timezone('Europe/Berlin')) -> ChatMessage:
+    def from_json(cls, chat_json: Mapping, local_tz=None) -> ChatMessage:
+        local_tz = local_tz or get_timezone()
         return ChatMessage(chat_json['created.account.account.name'],
                            chat_json['state.active.content'],
                            to_datetime(chat_json['created.date'], local_tz),
@@ -50,7 +156,22 @@ class ChatMessage:
                            chat_json['id']
                            )
 
+    @classmethod
+    def from_json_list(cls, chats_json: List[Mapping], local_tz=None) -> List[ChatMessage]:
+        local_tz = local_tz or get_timezone()
+        created = to_datetimes([chat_json['created.date'] for chat_json in chats_json], local_tz)
+        return [ChatMessage(chat_json['created.account.account.name'],
+                            chat_json['state.active.content'],
+                            chat_created,
+                            local_tz,
+                            chat_json['id']
+                            ) for chat_json, chat_created in zip(chats_json, created)]
+
     @property
     def age(self):
-        now = self.timezone.localize(datetime.now())
+        return self.age_at(datetime.now())
+
+    def age_at(self, now: datetime) -> str:
+        if now.tzinfo is None:
+            now = self.timezone.localize(now)
         return to_relative_duration(now - self.created)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Callable
+
+from chat.entity.messages import ChatMessage
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import KeypathView
+from support.mixin import LoggableMixin
+
+
+class DirectMessagePager(LoggableMixin):
+    """
+    iterates the history of a direct chat page by page, newest messages first.
+
+    while a page is consumed, the next one is already fetched in the background. paging ends with an empty page, a
+    page which does not reach further back or the first message older than the cutoff. a page not advancing means the
+    server ignored the paging parameter, which is logged.
+
+    the paging parameter is not documented, unless the api connector opted into it only the latest page is fetched.
+    """
+
+    def __init__(self, sap: SpatialApiConnector, account_id: str, cutoff: Optional[datetime] = None,
+                 max_pages: Optional[int] = None, on_page: Optional[Callable[[List[ChatMessage]], None]] = None):
+        super().__init__()
+        self.sap = sap
+        self.account_id = account_id
+        self.cutoff = cutoff
+        self.max_pages = max_pages
+        self.on_page = on_page
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        for page in self.pages():
+            yield from page
+
+    def pages(self) -> Iterator[List[ChatMessage]]:
+        seen: Set[str] = set()
+        oldest: Optional[datetime] = None
+        before: Optional[str] = None
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='DirectMessagePager') as prefetch:
+            next_page: Optional[Future] = prefetch.submit(self.fetch_page, before)
+            page_count = 0
+            try:
+                while next_page:
+                    received = next_page.result()
+                    # only older messages are history, newer ones arrived since the paging started
+                    fetched = [message for message in received if message.message_id not in seen
+                               and (oldest is None or message.created <= oldest)]
+                    next_page = None
+                    page_count += 1
+                    if received and not fetched and before:
+                        self._log.warning(f'direct messages of [{self.account_id}] before [{before}] did not advance, '
+                                          f'the server seems to ignore paging, stopping')
+                    page = [message for message in fetched if not self.cutoff or message.created >= self.cutoff]
+                    if fetched and len(page) == len(fetched) and self.sap.direct_message_paging \
+                            and (not self.max_pages or page_count < self.max_pages):
+                        before = fetched[-1].message_id
+                        next_page = prefetch.submit(self.fetch_page, before)
+                    seen.update(message.message_id for message in fetched)
+                    if fetched:
+                        oldest = fetched[-1].created
+                    if page:
+                        if self.on_page:
+                            self.on_page(page)
+                        yield page
+            finally:
+                if next_page:
+                    next_page.cancel()
+
+    def fetch_page(self, before: Optional[str]) -> List[ChatMessage]:
+        self.debug(f'fetching direct messages of [{self.account_id}] before [{before}]')
+        page_json = self.sap.get_direct_message_chat_page(self.account_id, before)
+        page = [ChatMessage.from_json(KeypathView(message_json)) for message_json in page_json]
+        page.sort(key=lambda message: message.created, reverse=True)
+        return page
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from itertools import chain
+from threading import Lock, Event, Thread
+from time import monotonic, sleep
+from typing import Optional
+
+from attr import define, field
+from requests import RequestException
+
+from chat.entity.space import JoinableSpace
+from chat.spatial.api import RetryPolicy
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerTimeoutError
+from support.mixin import LoggableMixin
+
+
+@define
+class ReconnectStats:
+    reconnects: int = field(default=0)
+    failed_attempts: int = field(default=0)
+    recovery_seconds: float = field(default=0.0)
+    last_recovery_seconds: Optional[float] = field(default=None)
+    # recoveries which gave up after all attempts or were abandoned by stopping the supervisor
+    failed_recoveries: int = field(default=0)
+    abandoned_recoveries: int = field(default=0)
+    failed_recovery_seconds: float = field(default=0.0)
+
+
+class ReconnectSupervisor(LoggableMixin):
+    """
+    reconnects a space after its socket was closed or its connection was picked up.
+
+    the first attempt is immediate, the following ones are delayed by jittered exponential backoff. once connected
+    again, the active room is joined again and its fresh chat state is merged into the existing message store.
+    """
+
+    def __init__(self, joinable_space: JoinableSpace, retry: Optional[RetryPolicy] = None,
+                 connect_timeout: float = 10):
+        super().__init__()
+        self.joinable_space = joinable_space
+        self.retry = retry or RetryPolicy(attempts=10, backoff=0.5, max_backoff=30)
+        self.connect_timeout = connect_timeout
+        self.stats = ReconnectStats()
+        self.active = True
+        self._lock = Lock()
+        self._recovering = False
+        self._connected = Event()
+        socket = joinable_space.socket
+        socket.on('success.connected').call(self._on_connected)
+        socket.on_closed(self.disconnected)
+        socket.connection.disconnected.register(self.disconnected)
+
+    @property
+    def recovering(self) -> bool:
+        return self._recovering
+
+    def disconnected(self, error: Optional[Exception] = None):
+        with self._lock:
+            if not self.active or self._recovering:
+                return
+            self._recovering = True
+        self.info(f'space [{self.joinable_space.space_id}] disconnected: {error}')
+        Thread(target=self._recover, name=f'Reconnect-{self.joinable_space.space_id}', daemon=True).start()
+
+    def stop(self):
+        self.active = False
+
+    def _on_connected(self, socket, message: KeypathView):
+        self._connected.set()
+
+    def _recover(self):
+        started = monotonic()
+        self.joinable_space.socket.space_connection.connection.reset()
+        try:
+            for delay in chain((0.0,), self.retry.delays()):
+                sleep(delay)
+                if not self.active:
+                    self.stats.abandoned_recoveries += 1
+                    self.stats.failed_recovery_seconds += monotonic() - started
+                    self.info(f'abandoned reconnecting space [{self.joinable_space.space_id}]')
+                    return
+                if self._attempt():
+                    self.stats.reconnects += 1
+                    self.stats.last_recovery_seconds = monotonic() - started
+                    self.stats.recovery_seconds += self.stats.last_recovery_seconds
+                    self.info(f'space [{self.joinable_space.space_id}] recovered after '
+                              f'{self.stats.last_recovery_seconds:.2f}s')
+                    return
+                self.stats.failed_attempts += 1
+            self.stats.failed_recoveries += 1
+            self.stats.failed_recovery_seconds += monotonic() - started
+            self.info(f'giving up reconnecting space [{self.joinable_space.space_id}]')
+        finally:
+            self._recovering = False
+
+    def _attempt(self) -> bool:
+        socket = self.joinable_space.socket
+        self._connected.clear()
+        # a picked up connection may still be open
+        socket.end()
+        if socket.start().result() or not self._connected.wait(self.connect_timeout):
+            self.debug(f'reconnecting space [{self.joinable_space.space_id}] failed')
+            socket.end()
+            return False
+        if self.joinable_space.room_joiner:
+            try:
+                room = self.joinable_space.room_joiner.rejoin()
+                self.debug(f'joined {room} again')
+            except (RequestException, ListenerTimeoutError) as e:
+                self.info(f'joining the active room again failed: {e}')
+                socket.end()
+                return False
+        return True
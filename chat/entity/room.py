@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-from typing import List, Callable, Any, Dict
+from typing import List, Callable, Any, Dict, Optional
 
 from attr import define, field
-from benedict.dicts import benedict
 
+from chat.entity.archive import MessageArchive
 from chat.entity.messages import ChatMessage
+from chat.entity.store import MessageStore
 from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import KeypathView
 from chat.spatial.listener import BlockingListener, ChatListener
 from chat.spatial.param import SpaceConnection
 from chat.spatial.sender import ChatSender, ChatDeleter
@@ -24,16 +26,15 @@ class RoomsTreeListener(BlockingListener, LoggableMixin):
         BlockingListener.__init__(self, self.socket, 'success.spaceState.roomsTree')
         LoggableMixin.__init__(self)
 
-    def _on_message(self, socket: SpatialWebSocketAppWrapper, message: benedict):
-        self.rooms.clear()
+    def _on_message(self, socket: SpatialWebSocketAppWrapper, message: KeypathView):
         rooms = [Room.from_json(room_json, self.room_joiner) for room_json in message['success.spaceState.roomsTree']]
-        self.rooms.extend(rooms)
+        self.rooms = rooms
         self.info(f'available rooms: {rooms}')
         [cb(rooms) for cb in self.callbacks]
 
-    def get_rooms(self) -> List[Room]:
-        with self.lock:
-            return self.rooms
+    def get_rooms(self, timeout: Optional[float] = None) -> List[Room]:
+        self.wait_ready(timeout)
+        return self.rooms
 
     def register(self, callback: Callable[[List[Room]], Any]):
         self.callbacks.append(callback)
@@ -46,9 +47,11 @@ class RoomOperations:
     chat_deleter: ChatDeleter = field(repr=False)
 
     @classmethod
-    def build(cls, sap: SpatialApiConnector, socket: SpatialWebSocketAppWrapper) -> RoomOperations:
-        return RoomOperations(ChatListener(socket), ChatSender(sap, socket.space_connection),
-                              ChatDeleter(sap, socket.space_connection))
+    def build(cls, sap: SpatialApiConnector, socket: SpatialWebSocketAppWrapper,
+              archive: Optional[MessageArchive] = None, message_store: Optional[MessageStore] = None) -> RoomOperations:
+        return RoomOperations(ChatListener(socket, message_store=message_store, archive=archive,
+                                           space_id=socket.space_connection.space_id),
+                              ChatSender(sap, socket.space_connection), ChatDeleter(sap, socket.space_connection))
 
 
 @define
@@ -56,11 +59,21 @@ class RoomJoiner:
     sap: SpatialApiConnector = field(repr=False)
     space_connection: SpaceConnection = field()
     room_operations: RoomOperations = field(repr=False)
+    active_room: Optional[Room] = field(default=None)
 
     def join_room(self, room: Room):
         self.sap.join_room(self.space_connection, room.room_id)
+        self.active_room = room
         return JoinedRoom(room, self.room_operations)
 
+    def rejoin(self) -> Optional[Room]:
+        """
+        joins the active room again on a new connection
+        """
+        if self.active_room:
+            self.sap.join_room(self.space_connection, self.active_room.room_id)
+        return self.active_room
+
 
 @define
 class Room(LoggableMixin):
@@ -82,13 +95,23 @@ class JoinedRoom(LoggableMixin):
     room: Room = field()
     room_operations: RoomOperations = field(repr=False)
 
+    def get_cached_chat_messages(self) -> List[ChatMessage]:
+        return self.room_operations.chat_listener.cached_room_chats(self.room.room_id)
+
     def get_chat_messages(self) -> List[ChatMessage]:
         self.info(f'retrieved chats in {self}')
         return self.room_operations.chat_listener.room_chats(self.room.room_id)
 
+    async def get_chat_messages_async(self) -> List[ChatMessage]:
+        self.info(f'retrieved chats in {self}')
+        return await self.room_operations.chat_listener.room_chats_async(self.room.room_id)
+
     def on_new_message(self, callback: Callable[[ChatMessage], Any]):
         self.room_operations.chat_listener.register_on_new_message(self.room.room_id, callback)
 
+    def on_deleted_message(self, callback: Callable[[str], Any]):
+        self.room_operations.chat_listener.register_on_deleted_message(self.room.room_id, callback)
+
     def send_chat(self, message_text: str):
         self.info(f'sending [{message_text}] to {self}')
         self.room_operations.chat_sender.send(self.room.room_id, message_text)
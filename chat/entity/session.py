@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+from enum import Enum, auto
+from threading import Event
+from time import monotonic
+from typing import Dict, List, Optional, Callable, Any
+
+from websocket import WebSocketConnectionClosedException
+
+from chat.entity.archive import MessageArchive
+from chat.entity.reconnect import ReconnectSupervisor
+from chat.entity.space import Space, JoinableSpace, JoinedSpace
+from chat.entity.store import MessageStore
+from chat.spatial.account import AuthenticatedAccount
+from chat.spatial.api import RetryPolicy
+from chat.spatial.codec import KeypathView
+from chat.spatial.websocket.capture import FrameCapture
+from chat.spatial.websocket.engine import SocketEngine
+from support.mixin import LoggableMixin
+
+
+class SpaceState(Enum):
+    CONNECTING = auto()
+    CONNECTED = auto()
+    DISCONNECTED = auto()
+    LEFT = auto()
+
+
+class SpaceSession(LoggableMixin):
+    """
+    connection to a single space, tracking its state from the messages and the close of its socket
+    """
+
+    def __init__(self, space: Space, joinable_space: JoinableSpace, retry: Optional[RetryPolicy] = None):
+        super().__init__()
+        self.space = space
+        self.joinable_space = joinable_space
+        self.supervisor = ReconnectSupervisor(joinable_space, retry)
+        self.joined_space: Optional[JoinedSpace] = None
+        self.state = SpaceState.CONNECTING
+        self.error: Optional[Exception] = None
+        self.started: Optional[float] = None
+        self.connected_after: Optional[float] = None
+        self.state_callbacks: List[Callable[[SpaceSession], Any]] = list()
+        self._settled = Event()
+        socket = joinable_space.socket
+        socket.on('success.connected').call(self._on_connected)
+        socket.on('pickedUp').call(self._on_picked_up)
+        socket.on_closed(self._on_closed)
+
+    @property
+    def space_id(self) -> str:
+        return self.space.space_id
+
+    def join(self) -> SpaceSession:
+        self.started = monotonic()
+        self.joined_space = self.joinable_space.join()
+        return self
+
+    def leave(self):
+        if self.state != SpaceState.LEFT:
+            self.supervisor.stop()
+            self._set_state(SpaceState.LEFT)
+            self.joinable_space.leave()
+
+    def wait_settled(self, timeout: Optional[float] = None) -> bool:
+        """
+        waits until the space is connected or the connection failed
+        """
+        return self._settled.wait(timeout)
+
+    def on_state_changed(self, callback: Callable[[SpaceSession], Any]):
+        self.state_callbacks.append(callback)
+
+    def _on_connected(self, socket, message: KeypathView):
+        self.connected_after = monotonic() - self.started if self.started else None
+        self._set_state(SpaceState.CONNECTED)
+
+    def _on_picked_up(self, socket, message: KeypathView):
+        self.error = None
+        self._set_state(SpaceState.DISCONNECTED)
+
+    def _on_closed(self, error: Optional[Exception]):
+        if self.state != SpaceState.LEFT:
+            self.error = error
+            self._set_state(SpaceState.DISCONNECTED)
+
+    def _set_state(self, state: SpaceState):
+        self.info(f'space [{self.space.name}] {self.state.name} -> {state.name}')
+        self.state = state
+        if state != SpaceState.CONNECTING:
+            self._settled.set()
+        for callback in self.state_callbacks:
+            callback(self)
+
+
+class SpaceSessions(LoggableMixin):
+    """
+    stays connected to many spaces of an account at once.
+
+    all spaces share the api connector of the account and one socket engine, whose connect pool bounds how many
+    spaces handshake concurrently. joining only starts connecting, so all spaces connect at the same time.
+    """
+
+    def __init__(self, account: AuthenticatedAccount, archive: Optional[MessageArchive] = None,
+                 engine: Optional[SocketEngine] = None, max_connecting: int = 8, retry: Optional[RetryPolicy] = None,
+                 max_messages: Optional[int] = None):
+        super().__init__()
+        self.account = account
+        self.archive = archive
+        self.retry = retry
+        # chats kept per room, unbounded by default
+        self.max_messages = max_messages
+        # frames are captured for later replay, if SPATIAL_CHAT_CAPTURE names a file
+        self.capture = None if engine else FrameCapture.from_environment()
+        self.engine = engine or SocketEngine(max_connecting, capture=self.capture)
+        self.sessions: Dict[str, SpaceSession] = dict()
+
+    def connect_all(self, spaces: Optional[List[Space]] = None) -> List[SpaceSession]:
+        spaces = self.account.list_spaces() if spaces is None else spaces
+        self.info(f'connecting to {len(spaces)} spaces')
+        return [self.connect(space) for space in spaces]
+
+    def connect(self, space: Space) -> SpaceSession:
+        """
+        the session of the space, a new one if it is not connected
+        """
+        session = self.sessions.get(space.space_id)
+        if session and (session.state in (SpaceState.CONNECTING, SpaceState.CONNECTED) or
+                        session.supervisor.recovering):
+            return session
+        if session:
+            # reconnecting gave up
+            session.supervisor.stop()
+        message_store = MessageStore(self.max_messages) if self.max_messages else None
+        session = SpaceSession(space, space.connect(self.account.account_secret, self.archive, self.engine,
+                                                    message_store), self.retry)
+        self.sessions[space.space_id] = session
+        return session.join()
+
+    def session(self, space_id: str) -> Optional[SpaceSession]:
+        return self.sessions.get(space_id)
+
+    def states(self) -> Dict[str, SpaceState]:
+        return {space_id: session.state for space_id, session in self.sessions.items()}
+
+    def wait_settled(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else monotonic() + timeout
+        return all(session.wait_settled(None if deadline is None else max(0.0, deadline - monotonic()))
+                   for session in list(self.sessions.values()))
+
+    def leave_all(self):
+        for session in self.sessions.values():
+            try:
+                session.leave()
+            except WebSocketConnectionClosedException:
+                self.debug(f'connection to {session.space} already closed')
+        if self.capture:
+            self.capture.close()
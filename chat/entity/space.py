@@ -1,13 +1,17 @@
 from __future__ import annotations
 
-from typing import List, Callable, Any, Dict
+from datetime import datetime
+from typing import List, Callable, Any, Dict, Optional
 
 from attr import define, field
 
 from chat.entity.account import AccountSecret
+from chat.entity.archive import MessageArchive, SearchHit
 from chat.entity.messages import LeaveMessage
 from chat.entity.room import RoomsTreeListener, Room, RoomJoiner, RoomOperations
+from chat.entity.store import MessageStore
 from chat.spatial.api import SpatialApiConnector
+from chat.spatial.websocket.engine import SocketEngine
 from chat.spatial.websocket.space import SpatialWebSocketAppWrapper
 from support.mixin import LoggableMixin
 
@@ -17,25 +21,40 @@ class JoinedSpace:
     space_id: str = field()
     rooms_tree: RoomsTreeListener = field(repr=False)
 
-    def list_rooms(self) -> List[Room]:
-        return self.rooms_tree.get_rooms()
+    def list_rooms(self, timeout: Optional[float] = None) -> List[Room]:
+        return self.rooms_tree.get_rooms(timeout)
 
     def on_rooms_updated(self, callback: Callable[[List[Room]], Any]):
         self.rooms_tree.register(callback)
 
 
 class JoinableSpace(LoggableMixin):
-    def __init__(self, space_id: str, secret: AccountSecret, sap: SpatialApiConnector):
+    def __init__(self, space_id: str, secret: AccountSecret, sap: SpatialApiConnector,
+                 archive: Optional[MessageArchive] = None, engine: Optional[SocketEngine] = None,
+                 message_store: Optional[MessageStore] = None):
         super().__init__()
         self.space_id = space_id
-        self.socket = SpatialWebSocketAppWrapper.from_account(space_id, secret)
+        self.socket = SpatialWebSocketAppWrapper.from_account(space_id, secret, engine, sap.socket_url)
         self.sap = sap
+        self.archive = archive
+        self.message_store = message_store
+        self.room_joiner: Optional[RoomJoiner] = None
 
     def join(self) -> JoinedSpace:
         self.info(f'joining space [{self.space_id}]')
+        self.room_joiner = RoomJoiner(self.sap, self.socket.space_connection,
+                                      RoomOperations.build(self.sap, self.socket, self.archive,
+                                                           self.message_store))
+        # the rooms tree is sent right after connecting, its listener has to be registered before
+        joined_space = JoinedSpace(self.space_id, RoomsTreeListener(self.room_joiner, self.socket))
         self.socket.start()
-        room_joiner = RoomJoiner(self.sap, self.socket.space_connection, RoomOperations.build(self.sap, self.socket))
-        return JoinedSpace(self.space_id, RoomsTreeListener(room_joiner, self.socket))
+        return joined_space
+
+    def search_chats(self, text: str = '', author: Optional[str] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None, limit: int = 50) -> List[SearchHit]:
+        if not self.archive:
+            return list()
+        return self.archive.search(text, author, since, until, MessageArchive.space_chats(self.space_id), limit)
 
     def leave(self):
         self.socket.send_message(LeaveMessage())
@@ -62,5 +81,6 @@ class Space:
         self.name = name
         self.slug = slug
 
-    def connect(self, secret: AccountSecret) -> JoinableSpace:
-        return JoinableSpace(self.space_id, secret, self.sap)
\ No newline at end of file
+    def connect(self, secret: AccountSecret, archive: Optional[MessageArchive] = None,
+                engine: Optional[SocketEngine] = None, message_store: Optional[MessageStore] = None) -> JoinableSpace:
+        return JoinableSpace(self.space_id, secret, self.sap, archive, engine, message_store)
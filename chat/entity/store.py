@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import List, Dict, Optional, Iterable
+
+from chat.entity.messages import ChatMessage, get_timezone, from_epoch_millis, datetime_to_epoch_millis
+
+
+class AuthorTable:
+    """
+    interned author names, so every message only references its author by index
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.names: List[str] = list()
+        self._index: Dict[str, int] = dict()
+
+    def index(self, name: str) -> int:
+        index = self._index.get(name)
+        if index is None:
+            with self._lock:
+                index = self._index.get(name)
+                if index is None:
+                    index = len(self.names)
+                    self.names.append(name)
+                    self._index[name] = index
+        return index
+
+
+class RoomMessageStore:
+    """
+    messages of a single room, kept in timestamp order and unique by message id.
+
+    messages are stored column wise (epoch millis, author index, text, id) and ChatMessage instances are only
+    created for the messages which are queried. retention is bounded by the number of messages and / or their age,
+    the oldest messages are dropped first.
+    """
+
+    def __init__(self, max_messages: Optional[int] = None, max_age: Optional[timedelta] = None,
+                 authors: Optional[AuthorTable] = None):
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.authors = authors or AuthorTable()
+        self.timezone = get_timezone()
+        self._lock = Lock()
+        self._created = array('q')
+        self._author_ids = array('I')
+        self._texts: List[str] = list()
+        self._message_ids: List[str] = list()
+        self._by_id: Dict[str, int] = dict()
+
+    def add(self, message: ChatMessage) -> bool:
+        with self._lock:
+            added = self._add(message)
+            self._trim()
+            return added and message.message_id in self._by_id
+
+    def extend(self, messages: Iterable[ChatMessage]):
+        with self._lock:
+            for message in messages:
+                self._add(message)
+            self._trim()
+
+    def replace(self, messages: Iterable[ChatMessage]):
+        with self._lock:
+            self._replace(messages)
+            self._trim()
+
+    def merge(self, messages: Iterable[ChatMessage]) -> List[str]:
+        """
+        merges a state snapshot by message id. stored messages within the time span of the snapshot, which are
+        missing from it, have been deleted in the meantime. they are dropped and their ids returned.
+        """
+        messages = list(messages)
+        with self._lock:
+            if not self._created:
+                self._replace(messages)
+                self._trim()
+                return list()
+            stale = list()
+            if messages:
+                snapshot_ids = {message.message_id for message in messages}
+                oldest = min(datetime_to_epoch_millis(message.created) for message in messages)
+                start = bisect_left(self._created, oldest)
+                stale = [message_id for message_id in self._message_ids[start:] if message_id not in snapshot_ids]
+                for message_id in stale:
+                    self._delete(self._index_of(message_id))
+            for message in messages:
+                self._add(message)
+            self._trim()
+            return stale
+
+    def remove(self, message_id: str) -> Optional[ChatMessage]:
+        with self._lock:
+            if message_id not in self._by_id:
+                return None
+            index = self._index_of(message_id)
+            message = self._materialize(index)
+            self._delete(index)
+            return message
+
+    def messages(self) -> List[ChatMessage]:
+        with self._lock:
+            return self._materialize_range(0, len(self._created))
+
+    def last(self, count: int) -> List[ChatMessage]:
+        with self._lock:
+            if count <= 0:
+                return list()
+            return self._materialize_range(max(0, len(self._created) - count), len(self._created))
+
+    def since(self, created: datetime) -> List[ChatMessage]:
+        with self._lock:
+            return self._materialize_range(bisect_left(self._created, datetime_to_epoch_millis(created)),
+                                           len(self._created))
+
+    def get(self, message_id: str) -> Optional[ChatMessage]:
+        with self._lock:
+            if message_id not in self._by_id:
+                return None
+            return self._materialize(self._index_of(message_id))
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._by_id
+
+    def __len__(self) -> int:
+        return len(self._created)
+
+    def _materialize(self, index: int) -> ChatMessage:
+        return ChatMessage(self.authors.names[self._author_ids[index]], self._texts[index],
+                           from_epoch_millis(self._created[index], self.timezone), self.timezone,
+                           self._message_ids[index])
+
+    def _materialize_range(self, start: int, end: int) -> List[ChatMessage]:
+        return [self._materialize(index) for index in range(start, end)]
+
+    def _index_of(self, message_id: str) -> int:
+        index = bisect_left(self._created, self._by_id[message_id])
+        while self._message_ids[index] != message_id:
+            index += 1
+        return index
+
+    def _add(self, message: ChatMessage) -> bool:
+        created = datetime_to_epoch_millis(message.created)
+        author_id = self.authors.index(message.author_name)
+        if message.message_id in self._by_id:
+            index = self._index_of(message.message_id)
+            if (self._created[index], self._author_ids[index], self._texts[index]) == \
+                    (created, author_id, message.message):
+                return False
+            self._delete(index)
+        self.timezone = message.timezone
+        # new messages usually arrive in order, so appending is the common case
+        if not self._created or self._created[-1] <= created:
+            index = len(self._created)
+        else:
+            index = bisect_right(self._created, created)
+        self._created.insert(index, created)
+        self._author_ids.insert(index, author_id)
+        self._texts.insert(index, message.message)
+        self._message_ids.insert(index, message.message_id)
+        self._by_id[message.message_id] = created
+        return True
+
+    def _replace(self, messages: Iterable[ChatMessage]):
+        unique = {message.message_id: message for message in messages}
+        ordered = sorted(((datetime_to_epoch_millis(m.created), m.message_id, m) for m in unique.values()),
+                         key=lambda entry: entry[:2])
+        if ordered:
+            self.timezone = ordered[-1][2].timezone
+        self._created = array('q', (created for created, _, _ in ordered))
+        self._author_ids = array('I', (self.authors.index(m.author_name) for _, _, m in ordered))
+        self._texts = [m.message for _, _, m in ordered]
+        self._message_ids = [message_id for _, message_id, _ in ordered]
+        self._by_id = {message_id: created for created, message_id, _ in ordered}
+
+    def _delete(self, index: int):
+        del self._by_id[self._message_ids[index]]
+        del self._created[index]
+        del self._author_ids[index]
+        del self._texts[index]
+        del self._message_ids[index]
+
+    def _trim(self):
+        drop = 0
+        if self.max_age is not None:
+            drop = bisect_left(self._created, datetime_to_epoch_millis(datetime.now(timezone.utc) - self.max_age))
+        if self.max_messages is not None:
+            drop = max(drop, len(self._created) - self.max_messages)
+        if drop > 0:
+            for message_id in self._message_ids[:drop]:
+                del self._by_id[message_id]
+            del self._created[:drop]
+            del self._author_ids[:drop]
+            del self._texts[:drop]
+            del self._message_ids[:drop]
+
+
+class MessageStore:
+    """
+    per-room message stores, all sharing the same retention settings and author table
+    """
+
+    def __init__(self, max_messages: Optional[int] = None, max_age: Optional[timedelta] = None):
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.authors = AuthorTable()
+        self._lock = Lock()
+        self._rooms: Dict[str, RoomMessageStore] = dict()
+
+    def room(self, room_id: str) -> RoomMessageStore:
+        with self._lock:
+            if room_id not in self._rooms:
+                self._rooms[room_id] = RoomMessageStore(self.max_messages, self.max_age, self.authors)
+            return self._rooms[room_id]
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._rooms
@@ -1,45 +1,36 @@
 from __future__ import annotations
 
+from argparse import ArgumentParser
 from logging import ERROR, basicConfig, DEBUG
+from typing import Optional
 
 from py_cui import PyCUI
 
-from chat.spatial.account import FileAccount
-from chat.spatial.websocket.direct import DirectChatSocketAppWrapper
-from chat.tui.space import SpaceSelectWidgetSet
+from chat.tui.startup import StartupWidgetSet
 
 
 class SpatialChatTui:
-    def __init__(self):
+    def __init__(self, account_file: str = 'chat/account.secret', api_url: Optional[str] = None):
         self.cui = PyCUI(4, 3)
         self.cui.set_title('Spatial Omnichat')
         self.cui.enable_logging(logging_level=ERROR)
-        self.cui.set_refresh_timeout(1)  # in order to update async events (like room refresh)
+        # in order to update async events (like room refresh), prefetched spaces are shown on the next refresh
+        self.cui.set_refresh_timeout(0.1)
 
         # self.cui.add_label('Login to Account', 0, 0, column_span=3)
         # self.cui.add_button('login via email', 1, 1, command=EmailLoginFlow(self.cui).show_login_popup)
         # self.cui.add_button('re-login via file', 2, 1, command=FileLoginFlow(self.cui).show_file_selector)
-        with FileAccount.from_file('chat/account.secret') as account:
-            SpaceSelectWidgetSet(self.cui, account).activate()
+        # drawn right away, logging in and listing the spaces happen in the background
+        StartupWidgetSet(self.cui, account_file, api_url).activate()
 
     def start(self):
         self.cui.start()
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser(description='spatial chat terminal ui')
+    parser.add_argument('--account', default='chat/account.secret', help='account file to log in with')
+    parser.add_argument('--api-url', help='api to connect to instead of spatial.chat')
+    args = parser.parse_args()
     basicConfig(filename='cui.log', filemode='w', level=DEBUG)
-    SpatialChatTui().start()
-
-if __name__ == '_1_main__':
-    basicConfig(level=DEBUG)
-    with FileAccount.from_file('chat/account.secret') as account:
-        account_profile = account.sap.get_account_profile()
-
-        direct_chat = DirectChatSocketAppWrapper.from_account(account_profile, account)
-        direct_chat.start()
-        chats = direct_chat.existing_direct_chats.get_chats()
-        for chat in chats:
-            print(f'*** {chat} ***')
-            for m in chat.get_all_message():
-                print(f'> {m}')
-        direct_chat.end()
+    SpatialChatTui(args.account, args.api_url).start()
@@ -1,42 +1,109 @@
 from __future__ import annotations
 
-import json
-from functools import lru_cache
-from typing import List, Dict, Any, Optional
+from functools import partial
+from random import uniform
+from time import sleep, perf_counter
+from typing import List, Dict, Any, Optional, Iterator
 
-from requests import Session
+from attr import define, field
+from requests import Session, ConnectionError, Timeout, HTTPError
+from requests.adapters import HTTPAdapter
 
 from chat.entity.account import AccountSecret, AccountProfile
+from chat.spatial.cache import TtlCache, CacheStats
+from chat.spatial.codec import dumps, loads
+from chat.spatial.metrics import Metrics
 from chat.spatial.param import SpaceConnection
 from support.mixin import LoggableMixin
 
 
+@define(frozen=True)
+class Endpoint:
+    path: str = field()
+    timeout: float = field(default=3)
+    # only idempotent calls are retried, a retried post might end up twice in the chat
+    idempotent: bool = field(default=True)
+    # responses of read endpoints are cached for that many seconds
+    cache_ttl: Optional[float] = field(default=None)
+
+
+class Endpoints:
+    LIST_SPACE_VISITED = Endpoint('SpaceVisited/listSpaceVisited', cache_ttl=300)
+    REGISTER_ACCOUNT = Endpoint('Account/registerAccount', idempotent=False)
+    GET_ACCOUNT_PROFILE = Endpoint('Account/getAccountProfile', cache_ttl=300)
+    AUTH_ACCOUNT_BY_MAGIC_LINK = Endpoint('Account/authAccountByMagicLink', idempotent=False)
+    JOIN_ROOM = Endpoint('SpaceOnline/joinRoom')
+    POST_ROOM_CHAT_MESSAGE = Endpoint('SpaceOnlineRoomChat/postRoomChatMessage', idempotent=False)
+    DELETE_ROOM_CHAT_MESSAGE = Endpoint('SpaceOnlineRoomChat/deleteRoomChatMessage')
+    GET_DIRECT_MESSAGE_CHAT_PAGE = Endpoint('DirectChat/getDirectMessageChatPage', timeout=10, cache_ttl=30)
+
+
+@define
+class RetryPolicy:
+    attempts: int = field(default=3)
+    backoff: float = field(default=0.2)
+    max_backoff: float = field(default=2.0)
+    retry_status = (502, 503, 504)
+
+    def delays(self) -> Iterator[float]:
+        # exponential backoff with full jitter
+        for attempt in range(self.attempts - 1):
+            yield uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def websocket_url(http_url: str) -> str:
+    if http_url.startswith('https://'):
+        return 'wss://' + http_url[len('https://'):]
+    if http_url.startswith('http://'):
+        return 'ws://' + http_url[len('http://'):]
+    return http_url
+
+
 class SpatialApiConnector(LoggableMixin):
     headers = {'x-client-version': '1', 'content-type': 'application/json'}
-
-    def __init__(self, session: Session):
+    default_api_url = 'https://spatial.chat/api'
+    default_socket_url = websocket_url(default_api_url)
+
+    def __init__(self, session: Session, api_url: str = default_api_url, pool_size: int = 10,
+                 retry: Optional[RetryPolicy] = None, timeouts: Optional[Dict[Endpoint, float]] = None,
+                 cache_ttls: Optional[Dict[Endpoint, Optional[float]]] = None, cache_size: int = 256,
+                 metrics: Optional[Metrics] = None, socket_url: Optional[str] = None,
+                 direct_message_paging: bool = False):
         super().__init__()
         self._session = session
+        self.api_url = api_url.rstrip('/')
+        # the websockets are served next to the api, unless told otherwise
+        self.socket_url = (socket_url or websocket_url(self.api_url)).rstrip('/')
+        self.retry = retry or RetryPolicy()
+        self.timeouts = timeouts or dict()
+        self.cache_ttls = cache_ttls or dict()
+        self.cache = TtlCache(cache_size)
+        # the paging parameter of the direct message pages is not documented, it is only sent when opted in
+        self.direct_message_paging = direct_message_paging
+        self.metrics = metrics or Metrics.shared()
+        # keep-alive connections are reused between calls, one per concurrent caller
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
 
-    @lru_cache
     def list_space_visited(self) -> List[Dict[Any, Any]]:
-        spaces_json = self._validated_put('https://spatial.chat/api/SpaceVisited/listSpaceVisited')
+        spaces_json = self._cached_put(Endpoints.LIST_SPACE_VISITED)
         assert 'spaces' in spaces_json, spaces_json
         return spaces_json['spaces']
 
     def register_account(self, email: str) -> str:
-        account_json = self._validated_put('https://spatial.chat/api/Account/registerAccount',
+        account_json = self._validated_put(Endpoints.REGISTER_ACCOUNT,
                                            json_payload={'email': email})
         assert 'authKey' in account_json
         return account_json['authKey']
 
     def get_account_profile(self) -> AccountProfile:
-        account_json = self._validated_put('https://spatial.chat/api/Account/getAccountProfile')
+        account_json = self._cached_put(Endpoints.GET_ACCOUNT_PROFILE)
         assert 'accountId' in account_json
         return AccountProfile.from_json(account_json)
 
     def auth_account_by_magic_link(self, auth_key: str, magic_code: str) -> str:
-        self._validated_put('https://spatial.chat/api/Account/authAccountByMagicLink', json_payload={
+        self._validated_put(Endpoints.AUTH_ACCOUNT_BY_MAGIC_LINK, json_payload={
             'code': magic_code,
             'authKey': auth_key
         })
@@ -44,42 +111,100 @@ class SpatialApiConnector(LoggableMixin):
         return self._session.cookies.get(AccountSecret.COOKIE_FIELD)
 
     def join_room(self, space_connection: SpaceConnection, room_id: str):
-        self._validated_put('https://spatial.chat/api/SpaceOnline/joinRoom',
+        self._validated_put(Endpoints.JOIN_ROOM,
                             json_payload={'connectionId': space_connection.connection_id,
                                           'spaceId': space_connection.space_id, 'roomId': room_id})
 
     def send_room_chat(self, space_connection: SpaceConnection, room_id: str, message_text: str):
-        self._validated_put('https://spatial.chat/api/SpaceOnlineRoomChat/postRoomChatMessage',
+        self._validated_put(Endpoints.POST_ROOM_CHAT_MESSAGE,
                             json_payload={'connectionId': space_connection.connection_id,
                                           'spaceId': space_connection.space_id, 'roomId': room_id,
                                           'content': message_text})
 
     def delete_chat_message(self, space_connection: SpaceConnection, room_id: str, message_id: str):
-        self._validated_put('https://spatial.chat/api/SpaceOnlineRoomChat/deleteRoomChatMessage',
+        self._validated_put(Endpoints.DELETE_ROOM_CHAT_MESSAGE,
                             json_payload={'connectionId': space_connection.connection_id,
                                           'spaceId': space_connection.space_id, 'roomId': room_id,
                                           'messageId': message_id})
 
-    def get_direct_message_chat_page(self, account_id: str):
-        chats_json = self._validated_put('https://spatial.chat/api/DirectChat/getDirectMessageChatPage',
-                                         json_payload={'accountId': account_id})
+    def get_direct_message_chat_page(self, account_id: str, before: Optional[str] = None):
+        json_payload = {'accountId': account_id}
+        if before:
+            # id of the oldest message already known. a server ignoring it answers with the latest page again
+            assert self.direct_message_paging, 'paging direct messages is not enabled'
+            json_payload['before'] = before
+        chats_json = self._cached_put(Endpoints.GET_DIRECT_MESSAGE_CHAT_PAGE, json_payload=json_payload)
         assert 'messages' in chats_json
         return chats_json['messages']
 
-    def _validated_put(self, uri: str, json_payload: Optional[Dict[Any, Any]] = None) -> Dict[Any, Any]:
+    def timeout(self, endpoint: Endpoint) -> float:
+        return self.timeouts.get(endpoint, endpoint.timeout)
+
+    def cache_ttl(self, endpoint: Endpoint) -> Optional[float]:
+        return self.cache_ttls.get(endpoint, endpoint.cache_ttl)
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        return self.cache.stats
+
+    def invalidate(self, endpoint: Optional[Endpoint] = None):
+        """
+        drops the cached responses of the given endpoint, or of all endpoints
+        """
+        self.cache.invalidate(None if endpoint is None else lambda key: key[1] == endpoint)
+
+    def invalidate_direct_messages(self, account_id: Optional[str] = None):
+        """
+        drops the cached pages of the direct chat with the account, or of all direct chats
+        """
+        endpoint = Endpoints.GET_DIRECT_MESSAGE_CHAT_PAGE
+        self.cache.invalidate(lambda key: key[1] == endpoint
+                              and (account_id is None or loads(key[2]).get('accountId') == account_id))
+
+    def _cached_put(self, endpoint: Endpoint, json_payload: Optional[Dict[Any, Any]] = None) -> Dict[Any, Any]:
+        ttl = self.cache_ttl(endpoint)
+        if not ttl:
+            return self._validated_put(endpoint, json_payload)
+        # responses depend on the authenticated account
+        key = (self._session.cookies.get(AccountSecret.COOKIE_FIELD), endpoint, dumps(json_payload or {}))
+        return self.cache.get_or_load(key, ttl, partial(self._validated_put, endpoint, json_payload))
+
+    def _validated_put(self, endpoint: Endpoint, json_payload: Optional[Dict[Any, Any]] = None) -> Dict[Any, Any]:
+        uri = f'{self.api_url}/{endpoint.path}'
         if json_payload:
-            # XXX: that bug cost me hours of lifetime - the api hangs if there are whitespaces in the json string. what the f*ck
-            put_data = json.dumps(json_payload).replace(', "', ',"').replace(': "', ':"')
+            # the api hangs on whitespace in the json body, codec.dumps must stay compact
+            put_data = dumps(json_payload)
         else:
             put_data = ''
         self.debug(f'-X PUT {uri} -d\'{put_data}\'')
-        json_response = self._session.put(uri, data=put_data, headers=self.headers, timeout=3).json()
+        delays = self.retry.delays() if endpoint.idempotent else iter(())
+        while True:
+            started = perf_counter()
+            try:
+                response = self._session.put(uri, data=put_data, headers=self.headers, timeout=self.timeout(endpoint))
+                if response.status_code in self.retry.retry_status:
+                    response.raise_for_status()
+                self._observe(endpoint, started)
+                break
+            except (ConnectionError, Timeout, HTTPError) as e:
+                self._observe(endpoint, started, failed=True)
+                delay = next(delays, None)
+                if delay is None:
+                    raise
+                self.info(f'retrying {uri} in {delay:.2f}s after [{e}]')
+                sleep(delay)
+        json_response = loads(response.content)
         self.debug(json_response)
         assert 'success' in json_response, json_response
         return json_response['success']
 
+    def _observe(self, endpoint: Endpoint, started: float, failed: bool = False):
+        if self.metrics.enabled:
+            self.metrics.observe_request(endpoint.path, perf_counter() - started, failed)
+
     def authenticate(self, secret: AccountSecret):
         secret.inject_cookies(self._session.cookies)
 
     def terminate(self):
+        self.cache.invalidate()
         self._session.close()
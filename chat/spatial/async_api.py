@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Any, Callable, TypeVar, Iterable, Optional
+
+from chat.entity.account import AccountProfile
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.param import SpaceConnection
+from support.mixin import LoggableMixin
+
+T = TypeVar('T')
+
+
+class AsyncSpatialApiConnector(LoggableMixin):
+    """
+    awaitable endpoints of a SpatialApiConnector.
+
+    the calls run on a bounded pool of worker threads which share the keep-alive connection pool, timeouts and
+    retries of the wrapped connector, so many calls can be in flight at once without blocking the event loop.
+    """
+
+    def __init__(self, sap: SpatialApiConnector, max_concurrency: int = 10):
+        super().__init__()
+        self.sap = sap
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix='spatial-api')
+
+    async def _call(self, call: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(call, *args))
+
+    async def list_space_visited(self) -> List[Dict[Any, Any]]:
+        return await self._call(self.sap.list_space_visited)
+
+    async def register_account(self, email: str) -> str:
+        return await self._call(self.sap.register_account, email)
+
+    async def get_account_profile(self) -> AccountProfile:
+        return await self._call(self.sap.get_account_profile)
+
+    async def auth_account_by_magic_link(self, auth_key: str, magic_code: str) -> str:
+        return await self._call(self.sap.auth_account_by_magic_link, auth_key, magic_code)
+
+    async def join_room(self, space_connection: SpaceConnection, room_id: str):
+        return await self._call(self.sap.join_room, space_connection, room_id)
+
+    async def send_room_chat(self, space_connection: SpaceConnection, room_id: str, message_text: str):
+        return await self._call(self.sap.send_room_chat, space_connection, room_id, message_text)
+
+    async def delete_chat_message(self, space_connection: SpaceConnection, room_id: str, message_id: str):
+        return await self._call(self.sap.delete_chat_message, space_connection, room_id, message_id)
+
+    async def get_direct_message_chat_page(self, account_id: str, before: Optional[str] = None):
+        return await self._call(self.sap.get_direct_message_chat_page, account_id, before)
+
+    async def join_rooms(self, space_connection: SpaceConnection, room_ids: Iterable[str]):
+        return await asyncio.gather(*(self.join_room(space_connection, room_id) for room_id in room_ids))
+
+    async def get_direct_message_chat_pages(self, account_ids: Iterable[str]) -> List[List[Dict[Any, Any]]]:
+        return await asyncio.gather(*(self.get_direct_message_chat_page(account_id) for account_id in account_ids))
+
+    def terminate(self):
+        self._executor.shutdown(wait=False)
+        self.sap.terminate()
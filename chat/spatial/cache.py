@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable, Tuple, Optional, Dict
+
+from attr import define, field
+
+
+@define
+class CacheStats:
+    hits: int = field(default=0)
+    misses: int = field(default=0)
+    evictions: int = field(default=0)
+    # misses which waited for the load of another caller instead of loading themselves
+    collapsed: int = field(default=0)
+
+
+class TtlCache:
+    """
+    size bounded cache, where every entry expires after its own time to live. the least recently used entry is
+    evicted first once the cache is full.
+
+    concurrent misses of the same key are collapsed into a single load, the other callers wait for its value. a value
+    whose key got invalidated while it was loaded is handed to the waiting callers, but not cached.
+    """
+
+    def __init__(self, max_size: int = 256, clock: Callable[[], float] = monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.stats = CacheStats()
+        self._lock = Lock()
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._loading: Dict[Hashable, Future] = dict()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.stats.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return True, entry[1]
+
+    def put(self, key: Hashable, value: Any, ttl: float):
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def get_or_load(self, key: Hashable, ttl: float, load: Callable[[], Any]) -> Any:
+        found, value = self.get(key)
+        if found:
+            return value
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                # loaded meanwhile by another caller
+                return entry[1]
+            loading = self._loading.get(key)
+            waiting = loading is not None
+            if waiting:
+                self.stats.collapsed += 1
+            else:
+                loading = self._loading[key] = Future()
+        if waiting:
+            return loading.result()
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                if self._loading.get(key) is loading:
+                    del self._loading[key]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            if self._loading.get(key) is loading:
+                del self._loading[key]
+                self._put(key, value, ttl)
+        loading.set_result(value)
+        return value
+
+    def invalidate(self, matches: Optional[Callable[[Hashable], bool]] = None):
+        with self._lock:
+            if matches is None:
+                self._entries.clear()
+                self._loading.clear()
+            else:
+                for key in [key for key in self._entries if matches(key)]:
+                    del self._entries[key]
+                for key in [key for key in self._loading if matches(key)]:
+                    del self._loading[key]
+
+    def _put(self, key: Hashable, value: Any, ttl: float):
+        self._entries[key] = (self.clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Union, Mapping, Iterator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    # compact separators, see SpatialApiConnector._validated_put
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(',', ':'))
+
+
+class KeypathView(Mapping):
+    """
+    read-only view on decoded json, which resolves keypaths like 'success.room.id' only when asked for.
+
+    nested dicts are returned as views again, everything else is returned as is.
+    """
+    __slots__ = ('_data',)
+    separator = '.'
+
+    def __init__(self, data: Mapping):
+        self._data = data
+
+    def _resolve(self, keypath: str) -> Any:
+        if self.separator not in keypath:
+            return self._data[keypath]
+        value = self._data
+        for segment in keypath.split(self.separator):
+            if not isinstance(value, Mapping):
+                raise KeyError(keypath)
+            value = value[segment]
+        return value
+
+    def __getitem__(self, keypath: str) -> Any:
+        value = self._resolve(keypath)
+        if isinstance(value, dict):
+            return KeypathView(value)
+        return value
+
+    def __contains__(self, keypath: object) -> bool:
+        try:
+            self._resolve(keypath)
+            return True
+        except (KeyError, TypeError):
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._data!r})'
+
+    def dict(self) -> Mapping:
+        return self._data
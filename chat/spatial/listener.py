@@ -1,95 +1,195 @@
 from __future__ import annotations
 
+import asyncio
 from abc import ABC, abstractmethod
-from threading import Lock
-from time import sleep
-from typing import Callable, final, Set, Any, List, Dict, Tuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from threading import Lock, Event
+from datetime import datetime
+from functools import partial
+from time import perf_counter
+from typing import Callable, final, Any, List, Dict, Tuple, Mapping, Optional
 
 from attr import define, field
-from benedict.dicts import benedict
 from websocket import WebSocketApp
 
+from chat.entity.archive import MessageArchive, ArchivedChat
 from chat.entity.messages import ChatMessage
+from chat.entity.store import MessageStore
+from chat.spatial.codec import KeypathView
+from chat.spatial.metrics import Metrics, FrameReceipt
 from support.mixin import LoggableMixin
 
 
 class ListenerBuilderAware(LoggableMixin):
     def __init__(self):
         LoggableMixin.__init__(self)
-        self.on_message_listener: List[OnMessageListener] = []
+        self.listener_index = ListenerIndex()
+        self.metrics = Metrics.shared()
 
     def on(self, message_type: str) -> ListenerBuilder:
-        return ListenerBuilder(self.on_message_listener, message_type)
-
-    def process_listener(self, socket: WebSocketApp, message_json: benedict):
-        for accepting_listener in filter(lambda l: l.accepts(message_json), self.on_message_listener):
+        return ListenerBuilder(self.listener_index, message_type)
+
+    def process_listener(self, socket: WebSocketApp, message_json: KeypathView, receipt: Optional[FrameReceipt] = None):
+        accepting_listeners = self.listener_index.matching(message_json)
+        # only frames received from a socket are measured
+        metrics = self.metrics if receipt and self.metrics.enabled else None
+        if metrics:
+            metrics.observe_frame((listener.message_type for listener in accepting_listeners), receipt)
+        for accepting_listener in accepting_listeners:
+            started = perf_counter()
             try:
                 accepting_listener.process(socket, message_json)
             except:
                 self._log.exception(f'failed to execute [{accepting_listener}]')
+            if metrics:
+                metrics.observe_callback(accepting_listener.message_type, started, receipt)
 
 
 @define
 class OnMessageListener(LoggableMixin):
     message_type: str = field()
-    callback: Callable[[WebSocketApp, benedict], None] = field()
+    callback: Callable[[WebSocketApp, KeypathView], None] = field()
 
-    def accepts(self, message: benedict):
+    def accepts(self, message: KeypathView):
         return self.message_type in message
 
-    def process(self, socket: WebSocketApp, message: benedict):
+    def process(self, socket: WebSocketApp, message: KeypathView):
         self.debug(f'processing {self.message_type}: {message}')
         self.callback(socket, message)
 
 
+class ListenerIndexNode:
+    __slots__ = ('children', 'listeners')
+
+    def __init__(self):
+        self.children: Dict[str, ListenerIndexNode] = dict()
+        self.listeners: List[Tuple[int, OnMessageListener]] = list()
+
+
+class ListenerIndex:
+    """
+    prefix trie over the keypath segments of the registered message types.
+
+    a frame only descends into the branches it actually contains, so resolving the accepting listeners
+    depends on the depth of the registered keypaths and not on the number of registered listeners.
+    """
+
+    def __init__(self):
+        self.root = ListenerIndexNode()
+        self.listeners: List[OnMessageListener] = list()
+
+    def add(self, listener: OnMessageListener):
+        node = self.root
+        for segment in listener.message_type.split('.'):
+            node = node.children.setdefault(segment, ListenerIndexNode())
+        node.listeners.append((len(self.listeners), listener))
+        self.listeners.append(listener)
+
+    def matching(self, message: Mapping) -> List[OnMessageListener]:
+        matches: List[Tuple[int, OnMessageListener]] = list()
+        pending = [(self.root, message)]
+        while pending:
+            node, value = pending.pop()
+            # walk whichever side is smaller: the registered segments or the keys of the frame
+            if len(node.children) <= len(value):
+                present = [(segment, child) for segment, child in node.children.items() if segment in value]
+            else:
+                present = [(segment, node.children[segment]) for segment in value.keys() if segment in node.children]
+            for segment, child in present:
+                matches.extend(child.listeners)
+                if child.children:
+                    child_value = value[segment]
+                    if isinstance(child_value, Mapping):
+                        pending.append((child, child_value))
+        if len(matches) > 1:
+            # keep the registration order, as the callbacks might depend on each other
+            matches.sort(key=lambda match: match[0])
+        return [listener for _, listener in matches]
+
+    def __len__(self):
+        return len(self.listeners)
+
+
 @define
 class ListenerBuilder(LoggableMixin):
-    listener_list: List[OnMessageListener] = field()
+    listener_index: ListenerIndex = field()
     message_type: str = field()
 
-    def call(self, callback=Callable[[WebSocketApp, benedict], None]):
+    def call(self, callback=Callable[[WebSocketApp, KeypathView], None]):
         listener = OnMessageListener(self.message_type, callback)
         self.debug(f'registering {listener}')
-        self.listener_list.append(listener)
+        self.listener_index.add(listener)
+
+
+class ListenerTimeoutError(Exception):
+    pass
 
 
 class BlockingListener(ABC):
-    def __init__(self, socket: ListenerBuilderAware, trigger_message: str, lock=Lock()):
-        self.lock = lock
-        if not self.lock.locked():
-            self.lock.acquire()
+    """
+    listener whose state can be waited for until it processed its first message.
+
+    every listener has an event of its own. once the first message was processed the event stays set, so reading the
+    state afterwards does not lock at all. the state has to be replaced as a whole instead of being modified in place.
+    """
+
+    def __init__(self, socket: ListenerBuilderAware, trigger_message: str, timeout: Optional[float] = None):
+        self.trigger_message = trigger_message
+        self.timeout = timeout
+        self.ready = Event()
         socket.on(trigger_message).call(self.on_message)
 
     @final
-    def on_message(self, socket: WebSocketApp, message: benedict):
-        if self.lock.locked():
-            self.lock.release()
-        with self.lock:
+    def on_message(self, socket: WebSocketApp, message: KeypathView):
+        try:
             self._on_message(socket, message)
+        finally:
+            self.ready.set()
+
+    def wait_ready(self, timeout: Optional[float] = None):
+        """
+        waits for the first message, by default as long as the timeout of the listener
+        """
+        if self.ready.is_set():
+            return
+        timeout = self.timeout if timeout is None else timeout
+        if not self.ready.wait(timeout):
+            raise ListenerTimeoutError(f'no [{self.trigger_message}] within {timeout}s')
 
     @abstractmethod
-    def _on_message(self, socket: WebSocketApp, message: benedict):
+    def _on_message(self, socket: WebSocketApp, message: KeypathView):
         raise NotImplementedError
 
 
 class ConnectionListener:
-    def __init__(self, socket: ListenerBuilderAware):
-        self.connected = ConnectedListener(socket)
+    def __init__(self, socket: ListenerBuilderAware, connect_timeout: Optional[float] = 30):
+        self.connected = ConnectedListener(socket, connect_timeout)
         self.disconnected = DisconnectedListener(socket)
 
 
 class ConnectedListener(BlockingListener):
-    def __init__(self, socket: ListenerBuilderAware):
-        super(ConnectedListener, self).__init__(socket, 'success.connected')
+    """
+    id of the current connection. while reconnecting, callers wait at most the timeout for the next one.
+    """
+
+    def __init__(self, socket: ListenerBuilderAware, timeout: Optional[float] = 30):
+        super(ConnectedListener, self).__init__(socket, 'success.connected', timeout)
         self._connection_id = None
 
-    def _on_message(self, socket: WebSocketApp, message: benedict):
+    def _on_message(self, socket: WebSocketApp, message: KeypathView):
         self._connection_id = message['success.connected.connectionId']
 
     @property
     def connection_id(self):
-        with self.lock:
-            return self._connection_id
+        self.wait_ready()
+        return self._connection_id
+
+    def reset(self):
+        """
+        the connection is gone, the id of the next one has to be waited for
+        """
+        self.ready.clear()
+        self._connection_id = None
 
 
 class DisconnectedError(Exception):
@@ -98,82 +198,226 @@ class DisconnectedError(Exception):
 
 class DisconnectedListener(BlockingListener):
     def __init__(self, socket: ListenerBuilderAware):
+        self.callbacks: List[Callable[[DisconnectedError], Any]] = list()
         super(DisconnectedListener, self).__init__(socket, 'pickedUp')
 
-    def _on_message(self, socket: WebSocketApp, message: benedict):
-        raise DisconnectedError
+    def register(self, callback: Callable[[DisconnectedError], Any]):
+        self.callbacks.append(callback)
+
+    def _on_message(self, socket: WebSocketApp, message: KeypathView):
+        error = DisconnectedError(f'connection picked up: {message}')
+        if not self.callbacks:
+            raise error
+        for callback in self.callbacks:
+            callback(error)
+
+
+class RoomStateTimeoutError(Exception):
+    pass
+
+
+class RoomStateReadiness:
+    """
+    one future per room, resolved as soon as the initial chat state of the room has been stored
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._rooms: Dict[str, Future] = dict()
+
+    def future(self, room_id: str) -> Future:
+        with self._lock:
+            if room_id not in self._rooms:
+                self._rooms[room_id] = Future()
+            return self._rooms[room_id]
+
+    def set_ready(self, room_id: str):
+        future = self.future(room_id)
+        with self._lock:
+            if not future.done():
+                future.set_result(room_id)
+
+    def is_ready(self, room_id: str) -> bool:
+        return self.future(room_id).done()
+
+    def wait(self, room_id: str, timeout: Optional[float]):
+        try:
+            self.future(room_id).result(timeout)
+        except FutureTimeoutError:
+            raise RoomStateTimeoutError(f'no chat state for room [{room_id}] within {timeout}s')
+
+    async def wait_async(self, room_id: str, timeout: Optional[float]):
+        # shield the shared future, a timeout of one waiter must not cancel it for all the others
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future(room_id))), timeout)
+        except asyncio.TimeoutError:
+            raise RoomStateTimeoutError(f'no chat state for room [{room_id}] within {timeout}s')
 
 
 class ChatListener(LoggableMixin):
-    def __init__(self, socket: ListenerBuilderAware):
+    def __init__(self, socket: ListenerBuilderAware, state_timeout: Optional[float] = 30,
+                 message_store: Optional[MessageStore] = None, archive: Optional[MessageArchive] = None,
+                 space_id: str = ''):
         LoggableMixin.__init__(self)
-        self.chats: Dict[str, Set[ChatMessage]] = dict()
-        self.lock = Lock()
-        self.new_message_chat_listener = NewMessageChatListener(socket, self.chats)
-        self.initial_state_chat_listener = InitialStateChatListener(socket, self.chats)
+        self.chats = message_store or MessageStore()
+        self.state_timeout = state_timeout
+        self.readiness = RoomStateReadiness()
+        # every room of the space is written through to its archived chat
+        self.archived_room: Optional[Callable[[str], ArchivedChat]] = partial(archive.room, space_id) \
+            if archive else None
+        self.restored_rooms = set()
+        self._restore_lock = Lock()
+        self.new_message_chat_listener = NewMessageChatListener(socket, self.chats, self.archived_room)
+        self.initial_state_chat_listener = InitialStateChatListener(socket, self.chats, self.readiness,
+                                                                    self.archived_room,
+                                                                    self.new_message_chat_listener.notify,
+                                                                    self.restore)
 
     def register_on_new_message(self, room_id: str, callback: Callable[[ChatMessage], Any]):
         self.new_message_chat_listener.listener[room_id] = callback
 
-    def room_chats(self, room_id: str):
-        while room_id not in self.chats:
-            sleep(0.1)
-        with self.lock:
-            return sorted(self.chats[room_id], key=lambda c: c.created)
-
-
-def is_active_message(chat: benedict):
+    def register_on_deleted_message(self, room_id: str, callback: Callable[[str], Any]):
+        self.new_message_chat_listener.deleted_listener[room_id] = callback
+
+    def cached_room_chats(self, room_id: str) -> List[ChatMessage]:
+        """
+        the chats known so far, without waiting for the room state. restores the archived chats on first access.
+        """
+        self.restore(room_id)
+        return self.chats.room(room_id).messages()
+
+    def restore(self, room_id: str):
+        """
+        restores the archived chats of the room once, before the room state is merged or the chats are shown
+        """
+        if not self.archived_room:
+            return
+        with self._restore_lock:
+            if room_id in self.restored_rooms:
+                return
+            self.restored_rooms.add(room_id)
+            archived = self.archived_room(room_id).load(self.chats.max_messages)
+            self.info(f'restored {len(archived)} archived chats of {room_id}')
+            self.chats.room(room_id).extend(archived)
+
+    def room_chats(self, room_id: str, timeout: Optional[float] = None) -> List[ChatMessage]:
+        self.readiness.wait(room_id, self.state_timeout if timeout is None else timeout)
+        return self.chats.room(room_id).messages()
+
+    async def room_chats_async(self, room_id: str, timeout: Optional[float] = None) -> List[ChatMessage]:
+        await self.readiness.wait_async(room_id, self.state_timeout if timeout is None else timeout)
+        return self.chats.room(room_id).messages()
+
+    def last_room_chats(self, room_id: str, count: int, timeout: Optional[float] = None) -> List[ChatMessage]:
+        self.readiness.wait(room_id, self.state_timeout if timeout is None else timeout)
+        return self.chats.room(room_id).last(count)
+
+    def room_chats_since(self, room_id: str, created: datetime, timeout: Optional[float] = None) -> List[ChatMessage]:
+        self.readiness.wait(room_id, self.state_timeout if timeout is None else timeout)
+        return self.chats.room(room_id).since(created)
+
+
+def is_active_message(chat: KeypathView):
     return 'state.active.content' in chat
 
 
 class NewMessageChatListener(LoggableMixin):
-    def __init__(self, socket: ListenerBuilderAware, chats: Dict[str, Set[ChatMessage]]):
+    def __init__(self, socket: ListenerBuilderAware, chats: MessageStore,
+                 archived_room: Optional[Callable[[str], ArchivedChat]] = None):
         LoggableMixin.__init__(self)
         self.chats = chats
+        self.archived_room = archived_room
         self.listener: Dict[str, Callable[[ChatMessage], Any]] = dict()
+        self.deleted_listener: Dict[str, Callable[[str], Any]] = dict()
         socket.on('success.room.response.spatial.update.chatMessage').call(self.on_spatial_message)
         socket.on('success.room.response.stage.update.chatMessage').call(self.on_stage_message)
 
-    def on_spatial_message(self, socket: ListenerBuilderAware, message: benedict):
+    def on_spatial_message(self, socket: ListenerBuilderAware, message: KeypathView):
         return self.update_chats(message, 'success.room.response.spatial.update.chatMessage')
 
-    def on_stage_message(self, socket: ListenerBuilderAware, message: benedict):
+    def on_stage_message(self, socket: ListenerBuilderAware, message: KeypathView):
         return self.update_chats(message, 'success.room.response.stage.update.chatMessage')
 
-    def update_chats(self, message: benedict, chats_key: str):
+    def notify(self, room_id: str, added: List[ChatMessage], removed: List[str]):
+        for message_id in removed:
+            if room_id in self.deleted_listener:
+                self.deleted_listener[room_id](message_id)
+        for chat_message in added:
+            if room_id in self.listener:
+                self.listener[room_id](chat_message)
+
+    def update_chats(self, message: KeypathView, chats_key: str):
         room_id = message['success.room.id']
         if is_active_message(message[chats_key]):
             chat_message = ChatMessage.from_json(message[chats_key])
-            self.chats[room_id].add(chat_message)
-            self.listener[room_id](chat_message)
+            if self.chats.room(room_id).add(chat_message):
+                if self.archived_room:
+                    self.archived_room(room_id).save((chat_message,))
+                if room_id in self.listener:
+                    self.listener[room_id](chat_message)
         else:
             self.debug(f'omitting inactive message [{message[chats_key]}]')
+            message_id = message[chats_key]['id']
+            if self.archived_room:
+                self.archived_room(room_id).delete((message_id,))
+            if self.chats.room(room_id).remove(message_id) and room_id in self.deleted_listener:
+                self.deleted_listener[room_id](message_id)
 
 
 class InitialStateChatListener(LoggableMixin):
-    def __init__(self, socket: ListenerBuilderAware, chats: Dict[str, Set[ChatMessage]]):
+    def __init__(self, socket: ListenerBuilderAware, chats: MessageStore, readiness: RoomStateReadiness,
+                 archived_room: Optional[Callable[[str], ArchivedChat]] = None,
+                 resynced: Optional[Callable[[str, List[ChatMessage], List[str]], Any]] = None,
+                 restore: Optional[Callable[[str], Any]] = None):
         LoggableMixin.__init__(self)
         self.chats = chats
+        self.readiness = readiness
+        self.archived_room = archived_room
+        self.resynced = resynced
+        self.restore = restore
         socket.on('success.room.response.spatial.state.chat', ).call(self.on_spatial_message)
         socket.on('success.room.response.stage.state.chat', ).call(self.on_stage_message)
 
-    def on_spatial_message(self, socket: ListenerBuilderAware, message: benedict):
+    def on_spatial_message(self, socket: ListenerBuilderAware, message: KeypathView):
         room_id, chats = self.extract_chats(message, 'success.room.response.spatial.state.chat')
-        self.chats[room_id] = chats
+        self.store_chats(room_id, chats)
 
-    def on_stage_message(self, socket: ListenerBuilderAware, message: benedict):
+    def on_stage_message(self, socket: ListenerBuilderAware, message: KeypathView):
         room_id, chats = self.extract_chats(message, 'success.room.response.stage.state.chat')
-        self.chats[room_id] = chats
+        self.store_chats(room_id, chats)
+
+    def store_chats(self, room_id: str, chats: List[ChatMessage]):
+        if self.restore:
+            # merged into the archived chats, so the ones deleted meanwhile are dropped instead of restored later
+            self.restore(room_id)
+        room = self.chats.room(room_id)
+        added = [chat for chat in chats if chat.message_id not in room]
+        stale = room.merge(chats)
+        if self.archived_room:
+            archived_room = self.archived_room(room_id)
+            # the archive may hold more than the store, so its stale chats are looked up in the archive itself
+            if chats:
+                snapshot_ids = {chat.message_id for chat in chats}
+                stale_archived = set(stale) | {message_id for message_id in
+                                               archived_room.message_ids(min(chat.created for chat in chats))
+                                               if message_id not in snapshot_ids}
+                archived_room.delete(stale_archived)
+            archived_room.save(chats)
+        if self.readiness.is_ready(room_id):
+            # the state of a room joined again after a reconnect, only the difference is passed on
+            self.debug(f'resynced {room_id}: {len(added)} added, {len(stale)} removed')
+            if self.resynced:
+                self.resynced(room_id, added, stale)
+        else:
+            self.readiness.set_ready(room_id)
 
-    def extract_chats(self, message: benedict, chats_key: str) -> Tuple[Any, Set[Any]]:
+    def extract_chats(self, message: KeypathView, chats_key: str) -> Tuple[Any, List[ChatMessage]]:
         room_id = message['success.room.id']
         self.debug(f'receiving chats for {room_id}')
-        room_chats = set()
-        for chat in map(lambda c: benedict(c), message[chats_key]):
+        active_chats = list()
+        for chat in map(KeypathView, message[chats_key]):
             if is_active_message(chat):
-                chat_message = ChatMessage.from_json(chat)
-                self.debug(chat_message)
-                room_chats.add(chat_message)
+                active_chats.append(chat)
             else:
                 self.debug(f'omitting inactive message [{chat}]')
-        return room_id, room_chats
+        return room_id, ChatMessage.from_json_list(active_chats)
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from os import replace
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from attr import define, field
+
+from support.mixin import LoggableMixin
+
+# 50µs up to 13s, every bucket doubles the previous one
+LATENCY_BUCKETS = tuple(0.00005 * 2 ** exponent for exponent in range(19))
+
+
+class Histogram:
+    """
+    fixed bucket histogram. observing a value is a bisect and two additions, quantiles are the upper bound of the
+    bucket they fall into.
+    """
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # the last bucket takes everything above the highest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        counts = list(self.counts)
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0.0
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        (upper bound, observations up to it) pairs, ending with +inf
+        """
+        result, seen = list(), 0
+        for bound, count in zip(self.bounds + (float('inf'),), list(self.counts)):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+
+@define(slots=True)
+class FrameReceipt:
+    """
+    taken when a frame was received, before it is handed over to the listeners
+    """
+    size: int = field()
+    decode_seconds: float = field()
+    received: float = field(factory=perf_counter)
+
+
+@define
+class MessageTypeMetrics:
+    frames: int = field(default=0)
+    bytes: int = field(default=0)
+    decode: Histogram = field(factory=Histogram)
+    callback: Histogram = field(factory=Histogram)
+    # from receiving the frame until the listener finished, including the time it waited for dispatch
+    latency: Histogram = field(factory=Histogram)
+
+
+@define
+class EndpointMetrics:
+    requests: int = field(default=0)
+    errors: int = field(default=0)
+    latency: Histogram = field(factory=Histogram)
+
+
+class Metrics(LoggableMixin):
+    """
+    counters and latency histograms of the listener pipeline per message type keypath and of the api per endpoint.
+
+    a frame is counted for every message type it was dispatched to. frames without any listener are counted as
+    unmatched.
+    """
+    unmatched = 'unmatched'
+    _shared: Optional[Metrics] = None
+    _shared_lock = Lock()
+
+    def __init__(self, enabled: bool = True):
+        super().__init__()
+        self.enabled = enabled
+        self._lock = Lock()
+        self.message_types: Dict[str, MessageTypeMetrics] = dict()
+        self.endpoints: Dict[str, EndpointMetrics] = dict()
+
+    @classmethod
+    def shared(cls) -> Metrics:
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = Metrics()
+            return cls._shared
+
+    def message_type(self, message_type: str) -> MessageTypeMetrics:
+        metrics = self.message_types.get(message_type)
+        if metrics is None:
+            with self._lock:
+                metrics = self.message_types.setdefault(message_type, MessageTypeMetrics())
+        return metrics
+
+    def endpoint(self, path: str) -> EndpointMetrics:
+        metrics = self.endpoints.get(path)
+        if metrics is None:
+            with self._lock:
+                metrics = self.endpoints.setdefault(path, EndpointMetrics())
+        return metrics
+
+    def observe_frame(self, message_types: Iterable[str], receipt: FrameReceipt):
+        for message_type in set(message_types) or (self.unmatched,):
+            metrics = self.message_type(message_type)
+            with self._lock:
+                metrics.frames += 1
+                metrics.bytes += receipt.size
+            metrics.decode.observe(receipt.decode_seconds)
+
+    def observe_callback(self, message_type: str, started: float, receipt: FrameReceipt):
+        finished = perf_counter()
+        metrics = self.message_type(message_type)
+        metrics.callback.observe(finished - started)
+        metrics.latency.observe(finished - receipt.received)
+
+    def observe_request(self, path: str, seconds: float, failed: bool = False):
+        metrics = self.endpoint(path)
+        with self._lock:
+            metrics.requests += 1
+            metrics.errors += failed
+        metrics.latency.observe(seconds)
+
+    def prometheus(self) -> str:
+        lines: List[str] = list()
+        message_types = sorted(self.message_types.items())
+        endpoints = sorted(self.endpoints.items())
+        counter(lines, 'spatial_frames_total', 'frames received per message type',
+                [({'message_type': name}, metrics.frames) for name, metrics in message_types])
+        counter(lines, 'spatial_frame_bytes_total', 'bytes of the frames received per message type',
+                [({'message_type': name}, metrics.bytes) for name, metrics in message_types])
+        histogram(lines, 'spatial_frame_decode_seconds', 'time to decode a frame',
+                  [({'message_type': name}, metrics.decode) for name, metrics in message_types])
+        histogram(lines, 'spatial_listener_callback_seconds', 'time spent in the listener callback',
+                  [({'message_type': name}, metrics.callback) for name, metrics in message_types])
+        histogram(lines, 'spatial_frame_latency_seconds', 'time from receiving a frame until its listener finished',
+                  [({'message_type': name}, metrics.latency) for name, metrics in message_types])
+        counter(lines, 'spatial_http_requests_total', 'api requests per endpoint, every retry counts',
+                [({'endpoint': path}, metrics.requests) for path, metrics in endpoints])
+        counter(lines, 'spatial_http_errors_total', 'failed api requests per endpoint',
+                [({'endpoint': path}, metrics.errors) for path, metrics in endpoints])
+        histogram(lines, 'spatial_http_request_seconds', 'latency of the api requests',
+                  [({'endpoint': path}, metrics.latency) for path, metrics in endpoints])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """
+        replaces the file at once, so a collector never reads a partially written file
+        """
+        with open(f'{path}.tmp', 'w') as file:
+            file.write(self.prometheus())
+        replace(f'{path}.tmp', path)
+        self.info(f'metrics written to {path}')
+
+    def summary(self) -> List[str]:
+        lines = list()
+        for name, metrics in sorted(self.message_types.items()):
+            lines.append(f'{name}: {metrics.frames} frames, {metrics.bytes} bytes, '
+                         f'decode p50 {millis(metrics.decode.quantile(0.5))}, '
+                         f'callback p50/p99 {millis(metrics.callback.quantile(0.5))}/'
+                         f'{millis(metrics.callback.quantile(0.99))}, '
+                         f'latency p99 {millis(metrics.latency.quantile(0.99))}')
+        for path, metrics in sorted(self.endpoints.items()):
+            lines.append(f'{path}: {metrics.requests} requests, {metrics.errors} errors, '
+                         f'p50/p99 {millis(metrics.latency.quantile(0.5))}/{millis(metrics.latency.quantile(0.99))}')
+        return lines
+
+
+def millis(seconds: float) -> str:
+    return f'{seconds * 1000:.2f}ms'
+
+
+def labels(values: Dict[str, str]) -> str:
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values.values())
+    return ','.join(f'{name}="{value}"' for name, value in zip(values, escaped))
+
+
+def bound_label(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def counter(lines: List[str], name: str, description: str, samples: List[Tuple[Dict[str, str], int]]):
+    lines.extend((f'# HELP {name} {description}', f'# TYPE {name} counter'))
+    lines.extend(f'{name}{{{labels(sample_labels)}}} {value}' for sample_labels, value in samples)
+
+
+def histogram(lines: List[str], name: str, description: str, samples: List[Tuple[Dict[str, str], Histogram]]):
+    lines.extend((f'# HELP {name} {description}', f'# TYPE {name} histogram'))
+    for sample_labels, sample in samples:
+        buckets = sample.cumulative()
+        for bound, count in buckets:
+            lines.append(f'{name}_bucket{{{labels({**sample_labels, "le": bound_label(bound)})}}} {count}')
+        lines.append(f'{name}_sum{{{labels(sample_labels)}}} {sample.sum}')
+        lines.append(f'{name}_count{{{labels(sample_labels)}}} {buckets[-1][1]}')
@@ -1,53 +1,90 @@
 from __future__ import annotations
 
-import json
-from json import loads
-from threading import Thread
+from concurrent.futures import Future
+from time import perf_counter
+from typing import Optional, List, Callable, Any
 
-from benedict.dicts import benedict
 from cattr import unstructure
 from websocket import WebSocketApp
 
+from chat.spatial.codec import loads, dumps, KeypathView
 from chat.spatial.listener import ListenerBuilderAware
+from chat.spatial.metrics import FrameReceipt
+from chat.spatial.websocket.capture import FrameCapture
+from chat.spatial.websocket.dispatch import DispatchQueue
+from chat.spatial.websocket.engine import SocketEngine
 from support.mixin import LoggableMixin
 
 
-class ThreadedWebSocketAppMixin(LoggableMixin):
+class EngineWebSocketAppMixin(LoggableMixin):
+    """
+    runs the socket on a shared SocketEngine instead of a thread of its own
+    """
 
-    def __init__(self, socket: WebSocketApp):
+    def __init__(self, socket: WebSocketApp, engine: Optional[SocketEngine] = None):
         LoggableMixin.__init__(self)
         self.socket = socket
-        self.socket_thread = Thread(target=self._run_socket)
+        self.engine = engine or SocketEngine.shared()
 
-    def start(self):
-        self.debug(f'starting socket thread [{self.socket_thread.name}]')
-        self.socket_thread.start()
+    def start(self) -> Future:
+        self.debug('starting socket on engine')
+        return self.engine.start(self.socket)
 
     def end(self):
-        self.socket.close()
-        self.socket_thread.join(timeout=1)
-
-    def _run_socket(self):
-        self.debug(f'running forever in thread {self.socket.url}')
-        self.socket.run_forever()
+        self.engine.end(self.socket)
 
 
 class MessageHandlingWebSocketMixin(ListenerBuilderAware):
-    def __init__(self, socket: WebSocketApp):
+    """
+    passes the received frames to the listeners, through the dispatch queue if there is one. with a capture, every
+    raw frame is recorded as well.
+    """
+
+    def __init__(self, socket: WebSocketApp, dispatch: Optional[DispatchQueue] = None,
+                 capture: Optional[FrameCapture] = None):
         ListenerBuilderAware.__init__(self)
         self.socket = socket
+        self.dispatch = dispatch
+        self.capture = capture
+        self.last_error: Optional[Exception] = None
+        self.closed_callbacks: List[Callable[[Optional[Exception]], Any]] = list()
         socket.on_open = self._on_open
         socket.on_message = self._on_message
+        socket.on_error = self._on_error
+        socket.on_close = self._on_close
+
+    def on_closed(self, callback: Callable[[Optional[Exception]], Any]):
+        """
+        called with the last error, when the connection failed or was closed by the server
+        """
+        self.closed_callbacks.append(callback)
 
     def _on_open(self, socket: WebSocketApp):
         self.debug(f'opened socket {socket.url}')
 
+    def _on_error(self, socket: WebSocketApp, error: Exception):
+        self.debug(f'error on socket {socket.url}: {error}')
+        self.last_error = error
+
+    def _on_close(self, socket: WebSocketApp, status_code: Optional[int], reason: Optional[str]):
+        self.info(f'closed socket {socket.url} [{status_code}]: {reason}')
+        for callback in self.closed_callbacks:
+            callback(self.last_error)
+
     def _on_message(self, socket: WebSocketApp, message: str):
         self.debug(f'triggered by message {message}')
+        if self.capture:
+            self.capture.record(socket.url, message)
         if 'ping' == message:
             socket.send('pong')
+            return
+        received = perf_counter()
+        frame = KeypathView(loads(message))
+        receipt = FrameReceipt(len(message), perf_counter() - received, received)
+        if self.dispatch:
+            self.dispatch.submit(self, socket, frame, receipt)
         else:
-            self.process_listener(socket, benedict(loads(message)))
+            self.process_listener(socket, frame, receipt)
 
 
 class MessageSendingWebSocketMixin:
@@ -55,4 +92,4 @@ class MessageSendingWebSocketMixin:
         self.socket = socket
 
     def send_message(self, message: object):
-        self.socket.send(json.dumps(unstructure(message)))
+        self.socket.send(dumps(unstructure(message)))
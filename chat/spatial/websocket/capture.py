@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import gzip
+from os import environ
+from queue import Queue, Full, Empty
+from struct import Struct
+from threading import Thread
+from time import time, monotonic, perf_counter, sleep
+from typing import Iterator, Optional, BinaryIO
+
+from attr import define, field
+
+from chat.spatial.codec import KeypathView, loads
+from chat.spatial.listener import ListenerBuilderAware
+from chat.spatial.metrics import FrameReceipt
+from support.mixin import LoggableMixin
+
+MAGIC = b'SPATIAL-CAPTURE-1\n'
+# receive time as epoch seconds, length of the source and of the frame
+RECORD = Struct('>dHI')
+
+
+@define(slots=True)
+class CapturedFrame:
+    timestamp: float = field()
+    source: str = field()
+    frame: str = field()
+
+
+@define
+class CaptureStats:
+    captured: int = field(default=0)
+    dropped: int = field(default=0)
+
+
+class FrameCapture(LoggableMixin):
+    """
+    appends raw frames with their receive time to a gzip compressed, length prefixed log.
+
+    the receiving thread only puts the frame into a queue, compressing and writing is done by a background writer.
+    frames are dropped rather than blocking the receiving thread once max_pending frames are waiting. the file is
+    flushed every flush_interval seconds, so a crash loses at most the frames of that interval.
+    """
+    environment_variable = 'SPATIAL_CHAT_CAPTURE'
+
+    def __init__(self, path: str, max_pending: int = 10_000, flush_interval: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stats = CaptureStats()
+        self._queue: Queue[Optional[CapturedFrame]] = Queue(max_pending)
+        self._file = gzip.open(path, 'wb')
+        self._file.write(MAGIC)
+        self._writer = Thread(target=self._write, name='FrameCapture', daemon=True)
+        self._writer.start()
+        self.info(f'capturing frames to {path}')
+
+    @classmethod
+    def from_environment(cls) -> Optional[FrameCapture]:
+        """
+        capture to the file named by SPATIAL_CHAT_CAPTURE, if it is set
+        """
+        path = environ.get(cls.environment_variable)
+        return cls(path) if path else None
+
+    def record(self, source: str, frame: str):
+        try:
+            self._queue.put_nowait(CapturedFrame(time(), source, frame))
+        except Full:
+            self.stats.dropped += 1
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _write(self):
+        flushed = monotonic()
+        while True:
+            try:
+                captured = self._queue.get(timeout=self.flush_interval)
+            except Empty:
+                captured = False
+            if captured is None:
+                break
+            if captured:
+                source, frame = captured.source.encode(), captured.frame.encode()
+                self._file.write(RECORD.pack(captured.timestamp, len(source), len(frame)) + source + frame)
+                self.stats.captured += 1
+            if monotonic() - flushed >= self.flush_interval:
+                self._file.flush()
+                flushed = monotonic()
+        self._file.close()
+        self.info(f'captured {self.stats.captured} frames to {self.path}, dropped {self.stats.dropped}')
+
+
+def read_capture(path: str) -> Iterator[CapturedFrame]:
+    """
+    the frames of a capture in the order they were received. a capture cut off by a crash ends with its last
+    complete frame.
+    """
+    with gzip.open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is no frame capture')
+        while True:
+            try:
+                header = read_exactly(file, RECORD.size)
+                if header is None:
+                    return
+                timestamp, source_length, frame_length = RECORD.unpack(header)
+                source = read_exactly(file, source_length)
+                frame = read_exactly(file, frame_length)
+            except EOFError:
+                return
+            if source is None or frame is None:
+                return
+            yield CapturedFrame(timestamp, source.decode(), frame.decode())
+
+
+def read_exactly(file: BinaryIO, length: int) -> Optional[bytes]:
+    data = file.read(length)
+    return data if len(data) == length else None
+
+
+@define
+class ReplayStats:
+    frames: int = field(default=0)
+    seconds: float = field(default=0.0)
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+
+class FrameReplayer(LoggableMixin):
+    """
+    pushes captured frames into the listeners, at the original pace stretched by speed or, without speed, as fast
+    as possible. pings are skipped, they only matter to the socket.
+    """
+
+    def __init__(self, target: ListenerBuilderAware, speed: Optional[float] = 1.0):
+        super().__init__()
+        self.target = target
+        self.speed = speed
+
+    def replay(self, frames: Iterator[CapturedFrame], source: Optional[str] = None) -> ReplayStats:
+        """
+        replays all frames, or only the ones received from the given source
+        """
+        stats = ReplayStats()
+        started = perf_counter()
+        first: Optional[float] = None
+        for captured in frames:
+            if captured.frame == 'ping' or (source is not None and captured.source != source):
+                continue
+            if self.speed:
+                first = captured.timestamp if first is None else first
+                delay = (captured.timestamp - first) / self.speed - (perf_counter() - started)
+                if delay > 0:
+                    sleep(delay)
+            received = perf_counter()
+            frame = KeypathView(loads(captured.frame))
+            self.target.process_listener(None, frame, FrameReceipt(len(captured.frame), perf_counter() - received,
+                                                                   received))
+            stats.frames += 1
+        stats.seconds = perf_counter() - started
+        self.debug(f'replayed {stats.frames} frames in {stats.seconds:.2f}s')
+        return stats
@@ -1,24 +1,56 @@
 from __future__ import annotations
 
+from typing import Optional, Any, Iterator, Mapping
+
 from websocket import WebSocketApp
 
 from chat.entity.account import AccountProfile
+from chat.entity.archive import MessageArchive
 from chat.entity.chat import ExistingDirectChatsListener
 from chat.spatial.account import AuthenticatedAccount
 from chat.spatial.api import SpatialApiConnector
-from chat.spatial.websocket.base import ThreadedWebSocketAppMixin, MessageHandlingWebSocketMixin
+from chat.spatial.codec import KeypathView
+from chat.spatial.websocket.base import EngineWebSocketAppMixin, MessageHandlingWebSocketMixin
+from chat.spatial.websocket.engine import SocketEngine
+
 
+class DirectChatSocketAppWrapper(EngineWebSocketAppMixin, MessageHandlingWebSocketMixin):
+    socket_endpoint = 'ChatOnline/connectDirectMessageChat'
 
-class DirectChatSocketAppWrapper(ThreadedWebSocketAppMixin, MessageHandlingWebSocketMixin):
-    socket_endpoint = 'wss://spatial.chat/api/ChatOnline/connectDirectMessageChat'
+    def __init__(self, sap: SpatialApiConnector, socket: WebSocketApp, archive: Optional[MessageArchive] = None,
+                 engine: Optional[SocketEngine] = None):
+        EngineWebSocketAppMixin.__init__(self, socket, engine)
+        MessageHandlingWebSocketMixin.__init__(self, socket, self.engine.dispatch, self.engine.capture)
+        self.sap = sap
+        self.existing_direct_chats = ExistingDirectChatsListener(sap, self, archive)
+        # every frame after the initial state may carry a new direct message, the cached pages of its chat are
+        # outdated then
+        self.on('success').call(self._on_update)
 
-    def __init__(self, sap: SpatialApiConnector, socket: WebSocketApp):
-        ThreadedWebSocketAppMixin.__init__(self, socket)
-        MessageHandlingWebSocketMixin.__init__(self, socket)
-        self.existing_direct_chats = ExistingDirectChatsListener(sap, self)
+    def _on_update(self, socket: WebSocketApp, message: KeypathView):
+        if 'success.state' in message:
+            return
+        for account_id in set(account_ids(message['success'])):
+            self.sap.invalidate_direct_messages(account_id)
 
     @classmethod
-    def from_account(cls, account_profile: AccountProfile, account: AuthenticatedAccount):
-        socket = WebSocketApp(f'{cls.socket_endpoint}?accountId={account_profile.account_id}',
+    def from_account(cls, account_profile: AccountProfile, account: AuthenticatedAccount,
+                     archive: Optional[MessageArchive] = None, engine: Optional[SocketEngine] = None):
+        socket = WebSocketApp(f'{account.sap.socket_url}/{cls.socket_endpoint}?accountId={account_profile.account_id}',
                               cookie=f'authorization={account.account_secret.auth_code}')
-        return DirectChatSocketAppWrapper(account.sap, socket)
+        return DirectChatSocketAppWrapper(account.sap, socket, archive, engine)
+
+
+def account_ids(value: Any) -> Iterator[str]:
+    """
+    all account ids anywhere in the decoded json
+    """
+    if isinstance(value, Mapping):
+        for key, child in value.items():
+            if key == 'accountId' and isinstance(child, str):
+                yield child
+            else:
+                yield from account_ids(child)
+    elif isinstance(value, list):
+        for child in value:
+            yield from account_ids(child)
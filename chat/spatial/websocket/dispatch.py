@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+from collections import deque
+from enum import Enum
+from itertools import chain
+from threading import Lock, Condition, Thread
+from typing import Deque, List, Optional, Tuple, Any, Dict, Callable
+
+from attr import define, field
+from websocket import WebSocketApp
+
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerBuilderAware
+from chat.spatial.metrics import FrameReceipt
+from support.mixin import LoggableMixin
+
+
+class Backpressure(Enum):
+    PAUSE = 'pause'
+    COALESCE = 'coalesce'
+
+
+@define
+class DispatchStats:
+    enqueued: int = field(default=0)
+    processed: int = field(default=0)
+    coalesced: int = field(default=0)
+    paused: int = field(default=0)
+    max_depth: int = field(default=0)
+
+
+@define
+class PendingFrame:
+    state_key: Optional[Tuple[Any, ...]] = field()
+    source: ListenerBuilderAware = field(repr=False)
+    socket: WebSocketApp = field(repr=False)
+    frame: KeypathView = field()
+    receipt: Optional[FrameReceipt] = field(default=None, repr=False)
+    lane: int = field(default=0, repr=False)
+    # frames without a room are processed after all earlier frames of their socket and before all later ones
+    barrier: bool = field(default=False)
+
+
+@define
+class SourceState:
+    socket: WebSocketApp = field(repr=False)
+    # waiting frames, in the lanes or held back
+    queued: int = field(default=0)
+    # frames in the lanes or being processed
+    unfinished: int = field(default=0)
+    barrier_active: bool = field(default=False)
+    held: Deque[PendingFrame] = field(factory=deque, repr=False)
+    paused: bool = field(default=False)
+
+
+def state_kind(frame: KeypathView) -> Optional[str]:
+    """
+    keypath of the state snapshot contained in the frame. a newer snapshot makes an older one obsolete
+    """
+    if 'success.spaceState' in frame:
+        return 'success.spaceState'
+    if 'success.room.id' in frame:
+        for area in ('spatial', 'stage'):
+            if f'success.room.response.{area}.state' in frame:
+                return f'success.room.response.{area}.state'
+    return None
+
+
+class DispatchQueue(LoggableMixin):
+    """
+    bounded hand-off between the socket receiving frames and the listener callbacks.
+
+    frames are processed by a pool of workers. all frames of a room are processed by the same worker in the order they
+    arrived. a frame without a room is a barrier for its socket, it is processed once all earlier frames of the socket
+    are done and the later ones wait for it.
+
+    submitting never blocks, the receiving loop serves all sockets. once max_pending frames of a socket are waiting,
+    reading that socket is paused until its frames are down to the half. with the coalesce policy a state frame rather
+    replaces a pending state frame of the same room, which it makes obsolete anyway.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 1024, policy: Backpressure = Backpressure.COALESCE,
+                 pause: Optional[Callable[[WebSocketApp], Any]] = None,
+                 resume: Optional[Callable[[WebSocketApp], Any]] = None):
+        super().__init__()
+        self.max_pending = max_pending
+        self.policy = policy
+        self.pause = pause
+        self.resume = resume
+        self.stats = DispatchStats()
+        self._lock = Lock()
+        self._lanes: List[Deque[PendingFrame]] = [deque() for _ in range(workers)]
+        self._not_empty = [Condition(self._lock) for _ in range(workers)]
+        self._sources: Dict[int, SourceState] = dict()
+        self._pending = 0
+        self._closed = False
+        self._workers = [Thread(target=self._work, args=(lane,), name=f'Dispatch-{lane}', daemon=True)
+                         for lane in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    def on_backpressure(self, pause: Callable[[WebSocketApp], Any], resume: Callable[[WebSocketApp], Any]):
+        """
+        pauses and resumes reading a socket, both are called without waiting for the workers
+        """
+        self.pause = pause
+        self.resume = resume
+
+    def submit(self, source: ListenerBuilderAware, socket: WebSocketApp, frame: KeypathView,
+               receipt: Optional[FrameReceipt] = None):
+        room_id = frame['success.room.id'] if 'success.room.id' in frame else None
+        kind = state_kind(frame)
+        pending = PendingFrame((id(source), room_id, kind) if kind else None, source, socket, frame, receipt,
+                               hash((id(source), room_id)) % len(self._lanes), room_id is None)
+        with self._lock:
+            if self._closed:
+                self.debug(f'dispatch queue closed, dropping {pending}')
+                return
+            state = self._sources.get(id(source))
+            if state is None:
+                state = self._sources[id(source)] = SourceState(socket)
+            pause = False
+            if state.queued >= self.max_pending:
+                if self.policy is Backpressure.COALESCE and self._coalesce(state, pending):
+                    return
+                pause = not state.paused and self.pause is not None
+                if pause:
+                    state.paused = True
+                    self.stats.paused += 1
+            state.queued += 1
+            self._pending += 1
+            self.stats.enqueued += 1
+            self.stats.max_depth = max(self.stats.max_depth, self._pending)
+            if state.barrier_active or state.held or (pending.barrier and state.unfinished):
+                state.held.append(pending)
+            else:
+                self._enqueue(state, pending)
+        if pause:
+            self.debug(f'dispatch queue of {socket} full, pausing it')
+            self.pause(socket)
+
+    def close(self, timeout: Optional[float] = 1):
+        """
+        stops accepting frames, the workers finish the pending ones
+        """
+        with self._lock:
+            self._closed = True
+            for not_empty in self._not_empty:
+                not_empty.notify()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _enqueue(self, state: SourceState, pending: PendingFrame):
+        state.unfinished += 1
+        state.barrier_active = pending.barrier
+        self._lanes[pending.lane].append(pending)
+        self._not_empty[pending.lane].notify()
+
+    def _release(self, state: SourceState):
+        """
+        moves the held frames into the lanes, up to the next barrier which still has to wait
+        """
+        while state.held and not state.barrier_active:
+            if state.held[0].barrier and state.unfinished:
+                return
+            self._enqueue(state, state.held.popleft())
+
+    def _coalesce(self, state: SourceState, pending: PendingFrame) -> bool:
+        if pending.state_key is None:
+            return False
+        for queued in chain(reversed(state.held), reversed(self._lanes[pending.lane])):
+            if queued.state_key == pending.state_key:
+                # taking over the position keeps the order to the updates queued after the obsolete state
+                queued.socket = pending.socket
+                queued.frame = pending.frame
+                queued.receipt = pending.receipt
+                self.stats.coalesced += 1
+                return True
+        return False
+
+    def _work(self, lane: int):
+        frames = self._lanes[lane]
+        while True:
+            with self._lock:
+                # held frames may still be released into this lane, until all pending frames are done
+                self._not_empty[lane].wait_for(lambda: frames or (self._closed and not self._pending))
+                if not frames:
+                    for not_empty in self._not_empty:
+                        not_empty.notify()
+                    return
+                pending = frames.popleft()
+                state = self._sources[id(pending.source)]
+                state.queued -= 1
+                self._pending -= 1
+            # failing listeners are already logged by the source
+            pending.source.process_listener(pending.socket, pending.frame, pending.receipt)
+            with self._lock:
+                self.stats.processed += 1
+                state.unfinished -= 1
+                if pending.barrier:
+                    state.barrier_active = False
+                self._release(state)
+                resume = state.paused and state.queued <= self.max_pending // 2
+                if resume:
+                    state.paused = False
+                if not (state.queued or state.unfinished or state.paused):
+                    del self._sources[id(pending.source)]
+                if self._closed and not self._pending:
+                    for not_empty in self._not_empty:
+                        not_empty.notify()
+            if resume and self.resume:
+                self.debug(f'dispatch queue of {state.socket} drained, resuming it')
+                self.resume(state.socket)
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future
+from ssl import SSLSocket
+from threading import Thread, Lock, get_ident
+from typing import Callable, Any, Dict, Optional, Tuple, Set
+
+from websocket import WebSocketApp
+
+from chat.spatial.websocket.capture import FrameCapture
+from chat.spatial.websocket.dispatch import DispatchQueue
+from support.mixin import LoggableMixin
+
+
+class SocketEngine(LoggableMixin):
+    """
+    runs any number of websocket apps on a single asyncio loop.
+
+    the loop waits for all sockets to become readable and lets the app read the frame, so every listener callback
+    runs on the loop thread. only the blocking handshake of a connection is done on a small pool of connect threads.
+
+    sockets may hand their frames over to the dispatch queue of the engine, so slow listener callbacks do not hold up
+    reading the frames of all the other sockets. a socket whose frames pile up in the dispatch queue is paused, the
+    loop stops reading it until its frames are processed. with a capture, the sockets record all the frames they
+    receive.
+    """
+    _shared: Optional[SocketEngine] = None
+    _shared_lock = Lock()
+
+    def __init__(self, max_connecting: int = 4, dispatch: Optional[DispatchQueue] = None,
+                 capture: Optional[FrameCapture] = None):
+        super().__init__()
+        self.dispatch = dispatch or DispatchQueue()
+        self.dispatch.on_backpressure(self.pause, self.resume)
+        self.capture = capture
+        self.loop = asyncio.new_event_loop()
+        self._connect_executor = ThreadPoolExecutor(max_workers=max_connecting,
+                                                    thread_name_prefix='SocketEngineConnect')
+        self._readers: Dict[WebSocketApp, Tuple[int, Any, Callable[[], bool]]] = dict()
+        self._paused: Set[WebSocketApp] = set()
+        self._thread = Thread(target=self._run_loop, name='SocketEngine', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls) -> SocketEngine:
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = SocketEngine()
+            return cls._shared
+
+    @property
+    def connections(self) -> int:
+        return len(self._readers)
+
+    def start(self, socket: WebSocketApp) -> Future:
+        """
+        connects the socket in the background, its frames are dispatched on the loop afterwards
+        """
+        self.debug(f'connecting {socket.url}')
+        return self._connect_executor.submit(socket.run_forever, dispatcher=LoopDispatcher(self, socket))
+
+    def end(self, socket: WebSocketApp):
+        # stop reading first, closing waits for the close frame of the server itself
+        self.call(self._remove_reader, socket)
+        socket.close()
+
+    def pause(self, socket: WebSocketApp):
+        """
+        stops reading the socket, without waiting for it
+        """
+        if get_ident() == self._thread.ident:
+            self._pause_reader(socket)
+        else:
+            self.loop.call_soon_threadsafe(self._pause_reader, socket)
+
+    def resume(self, socket: WebSocketApp):
+        self.loop.call_soon_threadsafe(self._resume_reader, socket)
+
+    def call(self, function: Callable[..., Any], *args) -> Any:
+        """
+        runs the function on the loop thread and waits for its result
+        """
+        if get_ident() == self._thread.ident:
+            return function(*args)
+        result = Future()
+
+        def run():
+            try:
+                result.set_result(function(*args))
+            except Exception as e:
+                result.set_exception(e)
+
+        self.loop.call_soon_threadsafe(run)
+        return result.result()
+
+    def shutdown(self):
+        for socket in list(self._readers):
+            self.end(socket)
+        self._connect_executor.shutdown(wait=False)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1)
+        self.dispatch.close()
+        if self.capture:
+            self.capture.close()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _add_reader(self, socket: WebSocketApp, sock, read: Callable[[], bool]):
+        fd = sock.fileno()
+        if fd < 0 or not socket.keep_running:
+            # closed while connecting
+            return
+        self._readers[socket] = (fd, sock, read)
+        self.loop.add_reader(fd, self._on_readable, socket, sock, read)
+
+    def _remove_reader(self, socket: WebSocketApp):
+        reader = self._readers.pop(socket, None)
+        if reader is not None and socket not in self._paused:
+            self.loop.remove_reader(reader[0])
+        self._paused.discard(socket)
+
+    def _pause_reader(self, socket: WebSocketApp):
+        reader = self._readers.get(socket)
+        if reader is not None and socket not in self._paused:
+            self._paused.add(socket)
+            self.loop.remove_reader(reader[0])
+
+    def _resume_reader(self, socket: WebSocketApp):
+        reader = self._readers.get(socket)
+        if reader is not None and socket in self._paused:
+            self._paused.discard(socket)
+            fd, sock, read = reader
+            self.loop.add_reader(fd, self._on_readable, socket, sock, read)
+            if isinstance(sock, SSLSocket) and sock.pending():
+                # frames decrypted before pausing do not make the socket readable again
+                self._on_readable(socket, sock, read)
+
+    def _on_readable(self, socket: WebSocketApp, sock, read: Callable[[], bool]):
+        keep_reading = read()
+        # tls may already hold decrypted frames, the socket itself does not become readable for those
+        while keep_reading and socket not in self._paused and isinstance(sock, SSLSocket) and sock.pending():
+            keep_reading = read()
+        if not keep_reading:
+            self._remove_reader(socket)
+
+
+class LoopDispatcher:
+    """
+    custom dispatcher for WebSocketApp.run_forever, handing the socket over to the engine
+    """
+
+    def __init__(self, engine: SocketEngine, socket: WebSocketApp):
+        self.engine = engine
+        self.socket = socket
+
+    def read(self, sock, read: Callable[[], bool]):
+        self.engine.loop.call_soon_threadsafe(self.engine._add_reader, self.socket, sock, read)
+
+    def timeout(self, seconds: float, callback: Callable[..., Any], *args):
+        self.engine.loop.call_soon_threadsafe(self.engine.loop.call_later, seconds, callback, *args)
+
+    def buffwrite(self, sock, data, send: Callable[[Any, Any], int], disconnect: Callable[[Exception], Any]):
+        try:
+            send(sock, data)
+        except Exception as e:
+            disconnect(e)
+
+    def signal(self, signal_number: int, handler: Callable[..., Any]):
+        # signals are left to the main thread
+        pass
+
+    def abort(self):
+        self.engine.end(self.socket)
@@ -1,27 +1,33 @@
 from __future__ import annotations
 
+from typing import Optional
+
 from websocket import WebSocketApp
 
 from chat.entity.account import AccountSecret
+from chat.spatial.api import SpatialApiConnector
 from chat.spatial.listener import ConnectionListener
 from chat.spatial.param import SpaceConnection
-from chat.spatial.websocket.base import ThreadedWebSocketAppMixin, MessageHandlingWebSocketMixin, \
+from chat.spatial.websocket.base import EngineWebSocketAppMixin, MessageHandlingWebSocketMixin, \
     MessageSendingWebSocketMixin
+from chat.spatial.websocket.engine import SocketEngine
 
 
-class SpatialWebSocketAppWrapper(ThreadedWebSocketAppMixin, MessageHandlingWebSocketMixin,
+class SpatialWebSocketAppWrapper(EngineWebSocketAppMixin, MessageHandlingWebSocketMixin,
                                  MessageSendingWebSocketMixin):
-    socket_endpoint = 'wss://spatial.chat/api/SpaceOnline/onlineSpace'
+    socket_endpoint = 'SpaceOnline/onlineSpace'
 
-    def __init__(self, space_id: str, socket: WebSocketApp):
-        ThreadedWebSocketAppMixin.__init__(self, socket)
-        MessageHandlingWebSocketMixin.__init__(self, socket)
+    def __init__(self, space_id: str, socket: WebSocketApp, engine: Optional[SocketEngine] = None):
+        EngineWebSocketAppMixin.__init__(self, socket, engine)
+        MessageHandlingWebSocketMixin.__init__(self, socket, self.engine.dispatch, self.engine.capture)
         MessageSendingWebSocketMixin.__init__(self, socket)
 
         self.connection = ConnectionListener(self)
         self.space_connection = SpaceConnection(space_id, self.connection.connected)
 
     @classmethod
-    def from_account(cls, space_id: str, secret: AccountSecret):
-        socket = WebSocketApp(f'{cls.socket_endpoint}?spaceId={space_id}', cookie=f'authorization={secret.auth_code}')
-        return SpatialWebSocketAppWrapper(space_id, socket)
+    def from_account(cls, space_id: str, secret: AccountSecret, engine: Optional[SocketEngine] = None,
+                     socket_url: str = SpatialApiConnector.default_socket_url):
+        socket = WebSocketApp(f'{socket_url}/{cls.socket_endpoint}?spaceId={space_id}',
+                              cookie=f'authorization={secret.auth_code}')
+        return SpatialWebSocketAppWrapper(space_id, socket, engine)
@@ -1,34 +1,63 @@
 from __future__ import annotations
 
-from typing import List
+from functools import partial
+from threading import Lock
+from typing import List, Dict, Optional, Callable
 
 from py_cui import PyCUI
 from py_cui.keys import KEY_DELETE, KEY_ENTER
 from py_cui.widgets import ScrollMenu, TextBox
 from requests import RequestException
 
+from chat.entity.age import AgeLabelScheduler
 from chat.entity.messages import ChatMessage
 from chat.entity.room import JoinedRoom, Room
+from chat.spatial.listener import RoomStateTimeoutError, ListenerTimeoutError
+
+
+class ChatLine:
+    """
+    menu item of a single chat message. py_cui stringifies every item from the first one down to the bottom of
+    the view on each draw, so the formatted text is cached until it gets invalidated.
+    """
+    __slots__ = ('chat', '_formatter', '_text')
+
+    def __init__(self, chat: ChatMessage, formatter: Callable[[ChatMessage], str]):
+        self.chat = chat
+        self._formatter = formatter
+        self._text: Optional[str] = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self._formatter(self.chat)
+        return self._text
+
+    def invalidate(self):
+        self._text = None
 
 
 class ChatsListMenu:
     def __init__(self, chats_list: ScrollMenu, cui: PyCUI):
         self.cui = cui
-        self.joined_room: JoinedRoom = JoinedRoom(None, None)
+        self.joined_room: Optional[JoinedRoom] = None
         self.chats_list = chats_list
         self.title = chats_list.get_title()
 
-        self.chat_messages: List[ChatMessage] = list()
+        # the menu lists the newest message first
+        self.chat_lines: Dict[str, ChatLine] = dict()
+        self.ages = AgeLabelScheduler()
+        self.lock = Lock()
 
         self.chats_list.add_key_command(KEY_DELETE, self.command_delete_chat_message)
         self.chats_list.add_key_command(KEY_ENTER, self.command_show_message_details)
 
-    def command_show_message_details(self):
-        selected_index = self.chats_list.get_selected_item_index()
-        chat_index = len(self.chat_messages) - selected_index - 1
+    def selected_chat(self) -> Optional[ChatMessage]:
+        selected = self.chats_list.get()
+        return selected.chat if isinstance(selected, ChatLine) else None
 
-        if 0 <= chat_index < len(self.chat_messages):
-            chat = self.chat_messages[chat_index]
+    def command_show_message_details(self):
+        chat = self.selected_chat()
+        if chat:
             ascii_author = chat.author_name.encode("ascii", "ignore").decode().strip()
             _, root_width = self.cui.get_absolute_size()
             total_width = (int(3 * root_width / 4)) - int(root_width / 4) - 7
@@ -45,36 +74,95 @@ class ChatsListMenu:
                                      display_lines, lambda x: x)
 
     def command_delete_chat_message(self):
-        selected_index = self.chats_list.get_selected_item_index()
-        chat_index = len(self.chat_messages) - selected_index - 1
-        if 0 <= chat_index < len(self.chat_messages):
-            chat = self.chat_messages[chat_index]
-            self.joined_room.delete_chat(chat)
-            self.chat_messages.remove(chat)
-            self.display_chats()
-            self.chats_list.set_selected_item_index(min(selected_index, len(self.chats_list.get_item_list()) - 1))
+        chat = self.selected_chat()
+        if chat and self.joined_room:
+            try:
+                self.joined_room.delete_chat(chat)
+            except (RequestException, ListenerTimeoutError) as e:
+                self.cui.show_error_popup('Error while deleting chat', f'{e}')
+                return
+            self.on_deleted_chat_message(chat.message_id)
 
     def pre_room_join(self, selected_room: Room):
-        self.chats_list.clear()
-        self.chats_list.add_item(f'*** loading chats ***')
+        with self.lock:
+            # chats of the room left are ignored until the next room is joined
+            self.joined_room = None
+            self.chat_lines = dict()
+            self.ages.clear()
+            self.chats_list.clear()
+            self.chats_list.add_item(f'*** loading chats ***')
         self.chats_list.set_title(f'{self.title} - [{selected_room.name}]')
 
     def on_room_join(self, joined_room: JoinedRoom):
         self.joined_room = joined_room
-        self.chat_messages = joined_room.get_chat_messages()
-        self.display_chats()
-        joined_room.on_new_message(self.on_new_chat_message)
+        # show the archived chats right away, the room state replaces them once it arrived
+        cached_messages = joined_room.get_cached_chat_messages()
+        if cached_messages:
+            self.display_chats(cached_messages)
+        try:
+            chat_messages = joined_room.get_chat_messages()
+        except RoomStateTimeoutError as te:
+            self.cui.show_error_popup(f'Error loading chats of {joined_room.room.name}', f'{te}')
+            return
+        self.display_chats(chat_messages)
+        joined_room.on_new_message(partial(self.on_new_room_chat_message, joined_room))
+        joined_room.on_deleted_message(partial(self.on_deleted_room_chat_message, joined_room))
+
+    def on_new_room_chat_message(self, joined_room: JoinedRoom, chat_message: ChatMessage):
+        # callbacks of previously joined rooms stay registered
+        if joined_room is self.joined_room:
+            self.on_new_chat_message(chat_message)
+
+    def on_deleted_room_chat_message(self, joined_room: JoinedRoom, message_id: str):
+        if joined_room is self.joined_room:
+            self.on_deleted_chat_message(message_id)
 
     def on_new_chat_message(self, chat_message: ChatMessage):
-        self.chat_messages.append(chat_message)
-        self.display_chats()
-
-    def display_chats(self):
-        self.chats_list.clear()
-        self.chats_list.add_item_list(list(map(self.chat_message_format, reversed(self.chat_messages))))
+        with self.lock:
+            items = self.chats_list.get_item_list()
+            if chat_message.message_id in self.chat_lines:
+                items.remove(self.chat_lines.pop(chat_message.message_id))
+            line = ChatLine(chat_message, self.chat_message_format)
+            index = 0
+            # the loading placeholder is no chat line, it stays on top until the chats are displayed
+            while index < len(items) and (not isinstance(items[index], ChatLine) or
+                                          items[index].chat.created > chat_message.created):
+                index += 1
+            items.insert(index, line)
+            self.chat_lines[chat_message.message_id] = line
+            selected_index = self.chats_list.get_selected_item_index()
+            if 0 < selected_index and index <= selected_index:
+                self.chats_list.set_selected_item_index(selected_index + 1)
+
+    def on_deleted_chat_message(self, message_id: str):
+        with self.lock:
+            line = self.chat_lines.pop(message_id, None)
+            if line is None:
+                return
+            self.ages.remove(message_id)
+            items = self.chats_list.get_item_list()
+            index = items.index(line)
+            del items[index]
+            selected_index = self.chats_list.get_selected_item_index()
+            if index < selected_index or selected_index >= len(items):
+                self.chats_list.set_selected_item_index(max(0, selected_index - 1))
+
+    def display_chats(self, chat_messages: List[ChatMessage]):
+        with self.lock:
+            self.chats_list.clear()
+            self.ages.clear()
+            self.chat_lines = {chat.message_id: ChatLine(chat, self.chat_message_format) for chat in chat_messages}
+            # add to the item list directly, add_item_list formats every item for its debug log
+            self.chats_list.get_item_list().extend(reversed(list(self.chat_lines.values())))
+
+    def refresh_ages(self):
+        with self.lock:
+            for message_id in self.ages.refresh():
+                if message_id in self.chat_lines:
+                    self.chat_lines[message_id].invalidate()
 
     def chat_message_format(self, chat: ChatMessage):
-        return f'[{chat.age}]-[{chat.author_name}] {chat.message}'
+        return f'[{self.ages.label(chat)}]-[{chat.author_name}] {chat.message}'
 
 
 class ChatSendBox:
@@ -92,8 +180,8 @@ class ChatSendBox:
         try:
             self.joined_room.send_chat(message)
             self.box.clear()
-        except RequestException as re:
-            self.cui.show_error_popup('Error while sending chat', f'{re}')
+        except (RequestException, ListenerTimeoutError) as e:
+            self.cui.show_error_popup('Error while sending chat', f'{e}')
 
     def pre_room_join(self, selected_room: Room):
         self.box.set_selectable(False)
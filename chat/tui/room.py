@@ -3,7 +3,7 @@ from __future__ import annotations
 from enum import Enum, auto
 from functools import partial
 from threading import Thread
-from typing import Callable, Any, List
+from typing import Callable, Any, List, Optional
 
 from attr import define, field
 from more_itertools import one
@@ -12,8 +12,9 @@ from py_cui.keys import KEY_ENTER
 from py_cui.widgets import ScrollMenu
 from requests import RequestException
 
-from chat.entity.room import Room
+from chat.entity.room import Room, JoinedRoom
 from chat.entity.space import JoinedSpace
+from chat.spatial.listener import ListenerTimeoutError
 
 
 @define
@@ -73,11 +74,22 @@ class RoomsListMenu:
         try:
             selected_room = one(filter(lambda r: r.name == self.rooms_list.get(), self.joined_space.list_rooms()))
             self.inform_listener(RoomEvent.PRE_JOIN, selected_room)
-            AsyncWithCallbackBuilder.do_async(selected_room.join).then_with_result(
-                partial(self.inform_listener, RoomEvent.POST_JOIN))
+            AsyncWithCallbackBuilder.do_async(partial(self.join_room, selected_room)).then_with_result(
+                self.on_room_joined)
         except RequestException as re:
             self.cui.show_error_popup(f'Error joining room {self.rooms_list.get()}', f'{re}')
 
+    def join_room(self, room: Room) -> Optional[JoinedRoom]:
+        try:
+            return room.join()
+        except (RequestException, ListenerTimeoutError) as e:
+            self.cui.show_error_popup(f'Error joining room {room.name}', f'{e}')
+            return None
+
+    def on_room_joined(self, joined_room: Optional[JoinedRoom]):
+        if joined_room:
+            self.inform_listener(RoomEvent.POST_JOIN, joined_room)
+
     def inform_listener(self, event: RoomEvent, *args, **kwargs):
         for listener in self.event_listener[event]:
             listener(*args, **kwargs)
@@ -1,39 +1,105 @@
 from __future__ import annotations
 
-from typing import Optional
+from datetime import datetime
+from typing import Optional, List, Tuple, Dict
 
-from more_itertools import one
 from py_cui import PyCUI
-from py_cui.keys import KEY_ENTER, KEY_ESCAPE
+from py_cui.keys import KEY_ENTER, KEY_ESCAPE, KEY_CTRL_F, KEY_CTRL_T, KEY_CTRL_E
 from py_cui.widgets import ScrollMenu
-from websocket import WebSocketConnectionClosedException
 
-from chat.entity.space import JoinableSpace
+from chat.entity.archive import MessageArchive, SearchHit
+from chat.entity.messages import get_timezone
+from chat.entity.session import SpaceSessions, SpaceSession
+from chat.entity.space import Space
 from chat.spatial.account import AuthenticatedAccount
 from chat.tui.chat import ChatsListMenu, ChatSendBox
-from chat.tui.room import RoomsListMenu, RoomEvent
+from chat.tui.room import RoomsListMenu, RoomEvent, AsyncWithCallbackBuilder
+from chat.tui.stats import MetricsPopup
 from chat.tui.widget_set import WidgetSetActivator
 from support.mixin import LoggableMixin
 
 
 class SpaceSelectWidgetSet(WidgetSetActivator, LoggableMixin):
-    def __init__(self, cui: PyCUI, account: AuthenticatedAccount):
+    def __init__(self, cui: PyCUI, account: AuthenticatedAccount, archive: Optional[MessageArchive] = None,
+                 spaces: Optional[List[Space]] = None):
         LoggableMixin.__init__(self)
         WidgetSetActivator.__init__(self, cui, 6, 6, logger=self._log)
         self.account = account
+        self.sessions = SpaceSessions(account, archive)
+        self.space_widgets: Dict[str, SpaceChatWidgetSet] = dict()
+        # listed in the background on activation, unless they were prefetched
+        self.prefetched_spaces = spaces
+        self.spaces: List[Space] = list()
+        self.listing = False
         self.spaces_list = self.add_scroll_menu('spaces', 1, 1, row_span=4, column_span=4)
         self.spaces_list.add_key_command(KEY_ENTER, self.select_space)
+        self.metrics_popup = MetricsPopup(cui, dispatch=self.sessions.engine.dispatch)
+        self.add_key_command(KEY_CTRL_T, self.metrics_popup.show)
+        self.add_key_command(KEY_CTRL_E, self.metrics_popup.export)
+        self.cui.run_on_exit(self.sessions.leave_all)
 
     def on_activate(self):
         self.cui.move_focus(self.spaces_list)
+        if self.listing:
+            return
+        if self.prefetched_spaces is not None:
+            spaces, self.prefetched_spaces = self.prefetched_spaces, None
+            self.on_spaces_listed(spaces)
+        elif self.spaces:
+            self.show_spaces()
+        else:
+            self.listing = True
+            self.spaces_list.clear()
+            self.spaces_list.add_item('*** loading spaces ***')
+            self.spaces_list.set_selectable(False)
+            AsyncWithCallbackBuilder.do_async(self.list_spaces).then_with_result(self.on_spaces_listed)
+
+    def list_spaces(self) -> Optional[List[Space]]:
+        try:
+            return self.account.list_spaces()
+        except Exception as e:
+            self._log.exception('error listing spaces')
+            self.cui.show_error_popup('Error listing spaces', f'{e}')
+            return None
+
+    def on_spaces_listed(self, spaces: Optional[List[Space]]):
+        self.listing = False
+        if spaces is None:
+            # listed again on the next activation
+            self.spaces_list.clear()
+            self.spaces_list.add_item('*** listing spaces failed ***')
+            return
+        self.spaces = spaces
+        # stay connected to all spaces, so switching between them is instant
+        for session in self.sessions.connect_all(self.spaces):
+            session.on_state_changed(self.on_space_state_changed)
+        self.spaces_list.set_selectable(True)
+        self.show_spaces()
+
+    def show_spaces(self):
+        selected_index = self.spaces_list.get_selected_item_index()
         self.spaces_list.clear()
-        self.spaces_list.add_item_list(list(map(lambda s: s.name, self.account.list_spaces())))
+        self.spaces_list.add_item_list([self.space_format(space) for space in self.spaces])
+        self.spaces_list.set_selected_item_index(min(selected_index, len(self.spaces) - 1))
+
+    def space_format(self, space: Space) -> str:
+        session = self.sessions.session(space.space_id)
+        return f'{space.name} [{session.state.name.lower() if session else "-"}]'
+
+    def on_space_state_changed(self, session: SpaceSession):
+        self.show_spaces()
 
     def select_space(self):
-        selected_space_name = self.spaces_list.get()
-        selected_space = one(filter(lambda s: s.name == selected_space_name, self.account.list_spaces()))
-        joinable_space = selected_space.connect(self.account.account_secret)
-        SpaceChatWidgetSet(self.cui, joinable_space, self).activate()
+        if not self.spaces:
+            return
+        selected_space = self.spaces[self.spaces_list.get_selected_item_index()]
+        session = self.sessions.connect(selected_space)
+        space_widget = self.space_widgets.get(selected_space.space_id)
+        if space_widget is None or space_widget.session is not session:
+            session.on_state_changed(self.on_space_state_changed)
+            space_widget = SpaceChatWidgetSet(self.cui, session, self)
+            self.space_widgets[selected_space.space_id] = space_widget
+        space_widget.activate()
 
 
 class DirectChatListMenu:
@@ -43,15 +109,20 @@ class DirectChatListMenu:
 
 
 class SpaceChatWidgetSet(WidgetSetActivator, LoggableMixin):
-    def __init__(self, cui: PyCUI, joinable_space: JoinableSpace, previous_widget: Optional[WidgetSetActivator]):
+    def __init__(self, cui: PyCUI, session: SpaceSession, previous_widget: Optional[WidgetSetActivator]):
         LoggableMixin.__init__(self)
         WidgetSetActivator.__init__(self, cui, 4, 3, logger=self._log)
-        self.joinable_space = joinable_space
+        self.session = session
+        self.joinable_space = session.joinable_space
         self.previous_widget = previous_widget
 
         self.add_key_command(KEY_ESCAPE, self.return_to_select_space)
+        self.add_key_command(KEY_CTRL_F, self.command_search_chats)
+        self.metrics_popup = MetricsPopup(cui, dispatch=self.joinable_space.socket.engine.dispatch)
+        self.add_key_command(KEY_CTRL_T, self.metrics_popup.show)
+        self.add_key_command(KEY_CTRL_E, self.metrics_popup.export)
 
-        self.rooms_menu = RoomsListMenu(self.add_scroll_menu('rooms', 0, 0, row_span=2), joinable_space.join(),
+        self.rooms_menu = RoomsListMenu(self.add_scroll_menu('rooms', 0, 0, row_span=2), session.joined_space,
                                         self.cui)
         self.chats_menu = ChatsListMenu(self.add_scroll_menu('messages', 0, 1, row_span=3, column_span=2), self.cui)
         self.chat_send_box = ChatSendBox(self.add_text_box('send message', 3, 1, column_span=2), self.cui)
@@ -64,15 +135,45 @@ class SpaceChatWidgetSet(WidgetSetActivator, LoggableMixin):
 
     def on_activate(self):
         self.cui.move_focus(self.rooms_menu.rooms_list)
-        self.cui.run_on_exit(self.terminate_space)
-
-    def terminate_space(self):
-        self.info('goodbye')
-        try:
-            self.joinable_space.leave()
-        except WebSocketConnectionClosedException:
-            self.debug('connection already closed')
+        # py_cui has a single draw hook, it is owned by the space shown to refresh its age labels
+        self.cui.set_on_draw_update_func(self.chats_menu.refresh_ages)
+
+    def command_search_chats(self):
+        self.cui.show_text_box_popup('search chats [from:<author>] [since:<yyyy-mm-dd>]', self.search_chats)
+
+    def search_chats(self, query: str):
+        text, author, since = parse_search_query(query)
+        hits = self.joinable_space.search_chats(text, author, since)
+        if not hits:
+            self.cui.show_message_popup('search chats', f'nothing found for [{query}]')
+            return
+        room_names = {room.room_id: room.name for room in self.rooms_menu.joined_space.list_rooms()}
+        self.cui.show_menu_popup(f'{len(hits)} chats found for [{query}]',
+                                 [self.search_hit_format(hit, room_names) for hit in hits], lambda x: x)
+
+    @staticmethod
+    def search_hit_format(hit: SearchHit, room_names: Dict[str, str]) -> str:
+        return f'[{hit.message.created.strftime("%Y/%m/%d %H:%M")}]-[{room_names.get(hit.chat_id, hit.chat_id)}]-' \
+               f'[{hit.message.author_name}] {hit.message.message}'
 
     def return_to_select_space(self):
-        self.terminate_space()
+        # the space stays connected, it is left on exit
         self.previous_widget.activate()
+
+
+def parse_search_query(query: str) -> Tuple[str, Optional[str], Optional[datetime]]:
+    """
+    splits 'from:<author>' and 'since:<yyyy-mm-dd>' off the searched text
+    """
+    words, author, since = list(), None, None
+    for word in query.split():
+        if word.startswith('from:'):
+            author = word[len('from:'):]
+        elif word.startswith('since:'):
+            try:
+                since = get_timezone().localize(datetime.strptime(word[len('since:'):], '%Y-%m-%d'))
+            except ValueError:
+                words.append(word)
+        else:
+            words.append(word)
+    return ' '.join(words), author, since
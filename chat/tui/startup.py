@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from typing import Optional
+
+from py_cui import PyCUI
+
+from chat.tui.widget_set import WidgetSetActivator
+from support.mixin import LoggableMixin
+
+
+class StartupWidgetSet(WidgetSetActivator, LoggableMixin):
+    """
+    first screen, drawn before the account is logged in.
+
+    only py_cui is imported up front. logging in, the imports of the api, the sockets and the other widget sets as
+    well as listing the spaces and fetching the profile are done in the background. the space selection takes over
+    on the first draw after everything arrived.
+    """
+
+    def __init__(self, cui: PyCUI, account_file: str, api_url: Optional[str] = None, title: str = 'Spatial Omnichat'):
+        LoggableMixin.__init__(self)
+        WidgetSetActivator.__init__(self, cui, 6, 6, logger=self._log)
+        self.account_file = account_file
+        self.api_url = api_url
+        self.title = title
+        self.space_select = None
+        self._lock = Lock()
+        # same place as the spaces list of the space selection, so taking over does not move anything
+        self.spaces_list = self.add_scroll_menu('spaces', 1, 1, row_span=4, column_span=4)
+        self.spaces_list.add_item('*** logging in ***')
+        self.spaces_list.set_selectable(False)
+
+    def on_activate(self):
+        self.cui.set_on_draw_update_func(self.take_over)
+        Thread(target=self.prefetch, name='StartupPrefetch', daemon=True).start()
+
+    def prefetch(self):
+        try:
+            space_select = self.prefetch_space_select()
+        except Exception as e:
+            # no account, nothing to fall back to
+            self._log.exception('error starting up')
+            self.spaces_list.clear()
+            self.spaces_list.add_item('*** login failed ***')
+            self.cui.show_error_popup('Error connecting to Spatial', f'{e}')
+            return
+        with self._lock:
+            self.space_select = space_select
+
+    def prefetch_space_select(self):
+        account = self.login()
+        self.spaces_list.clear()
+        self.spaces_list.add_item('*** loading spaces ***')
+        with ThreadPoolExecutor(2, thread_name_prefix='StartupPrefetch') as executor:
+            spaces = executor.submit(account.list_spaces)
+            # cached by the api connector, the direct chats ask for it again
+            profile = executor.submit(account.sap.get_account_profile)
+            # the widget sets are imported while the requests are in flight
+            from chat.entity.archive import MessageArchive
+            from chat.tui.space import SpaceSelectWidgetSet
+            space_select = SpaceSelectWidgetSet(self.cui, account, MessageArchive.default())
+            try:
+                space_select.prefetched_spaces = spaces.result()
+            except Exception:
+                # the space selection lists the spaces on its own then, showing the error if it fails again
+                self._log.exception('error prefetching the spaces')
+            try:
+                self.cui.set_title(f'{self.title} - {profile.result().name}')
+            except Exception:
+                self._log.exception('error fetching the profile')
+        return space_select
+
+    def login(self):
+        from requests import Session
+
+        from chat.spatial.account import FileAccount
+        from chat.spatial.api import SpatialApiConnector
+        file_account = FileAccount.from_file(self.account_file)
+        if self.api_url:
+            file_account.sap = SpatialApiConnector(Session(), api_url=self.api_url)
+        return file_account.authenticate()
+
+    def take_over(self):
+        # runs on the draw thread, the widget set must not be replaced while it is drawn
+        with self._lock:
+            space_select, self.space_select = self.space_select, None
+        if space_select:
+            self.cui.set_on_draw_update_func(None)
+            space_select.activate()
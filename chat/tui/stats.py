@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from py_cui import PyCUI
+
+from chat.spatial.metrics import Metrics
+from chat.spatial.websocket.dispatch import DispatchQueue
+
+
+class MetricsPopup:
+    """
+    shows the metrics of the listener pipeline and the api, or exports them to a prometheus text file
+    """
+
+    def __init__(self, cui: PyCUI, metrics: Optional[Metrics] = None, dispatch: Optional[DispatchQueue] = None,
+                 path: str = 'metrics.prom'):
+        self.cui = cui
+        self.metrics = metrics or Metrics.shared()
+        self.dispatch = dispatch
+        self.path = path
+
+    def show(self):
+        lines = self.metrics.summary()
+        if self.dispatch:
+            stats = self.dispatch.stats
+            lines.insert(0, f'dispatch: depth {self.dispatch.depth} (max {stats.max_depth}), {stats.processed} '
+                            f'processed, {stats.coalesced} coalesced, {stats.paused} paused')
+        self.cui.show_menu_popup('metrics', lines or ['nothing measured yet'], lambda x: x)
+
+    def export(self):
+        self.metrics.write_prometheus(self.path)
+        self.cui.show_message_popup('metrics', f'written to {self.path}')
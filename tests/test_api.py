@@ -0,0 +1,203 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, current_thread
+from time import sleep
+from typing import List, Union
+from unittest import TestCase
+
+from requests import Session, Response, ConnectionError, HTTPError
+
+from chat.spatial.api import SpatialApiConnector, RetryPolicy, Endpoints
+from chat.spatial.async_api import AsyncSpatialApiConnector
+from chat.spatial.cache import TtlCache
+from chat.spatial.codec import dumps
+
+
+def response(status_code: int, body: dict) -> Response:
+    result = Response()
+    result.status_code = status_code
+    result.reason = 'test'
+    result.url = 'http://localhost'
+    result._content = dumps(body).encode()
+    return result
+
+
+class ScriptedSession(Session):
+    def __init__(self, *replies: Union[Response, Exception]):
+        super().__init__()
+        self.replies = list(replies)
+        self.calls: List[tuple] = list()
+
+    def put(self, url, data=None, **kwargs):
+        self.calls.append((url, data, kwargs['timeout']))
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+class TestSpatialApiConnector(TestCase):
+    no_backoff = RetryPolicy(attempts=3, backoff=0)
+
+    def test_endpoint_url_and_timeout(self):
+        session = ScriptedSession(response(200, {'success': {'spaces': []}}))
+        sap = SpatialApiConnector(session, api_url='http://localhost:8080/api/', retry=self.no_backoff,
+                                  timeouts={Endpoints.LIST_SPACE_VISITED: 0.5})
+        self.assertEqual([], sap.list_space_visited())
+        self.assertEqual([('http://localhost:8080/api/SpaceVisited/listSpaceVisited', '', 0.5)], session.calls)
+
+    def test_retries_idempotent_endpoint(self):
+        session = ScriptedSession(ConnectionError('reset'), response(503, {}),
+                                  response(200, {'success': {'messages': [{'id': '1'}]}}))
+        sap = SpatialApiConnector(session, retry=self.no_backoff)
+        self.assertEqual([{'id': '1'}], sap.get_direct_message_chat_page('a-1'))
+        self.assertEqual(3, len(session.calls))
+        self.assertEqual('{"accountId":"a-1"}', session.calls[0][1])
+
+    def test_gives_up_after_attempts(self):
+        session = ScriptedSession(response(503, {}))
+        with self.assertRaises(HTTPError):
+            SpatialApiConnector(session, retry=self.no_backoff).get_direct_message_chat_page('a-1')
+        self.assertEqual(3, len(session.calls))
+
+    def test_does_not_retry_posting(self):
+        session = ScriptedSession(ConnectionError('reset'), response(200, {'success': {}}))
+        with self.assertRaises(ConnectionError):
+            SpatialApiConnector(session, retry=self.no_backoff).register_account('test@t.d')
+        self.assertEqual(1, len(session.calls))
+
+    def test_jittered_backoff(self):
+        delays = list(RetryPolicy(attempts=5, backoff=0.1, max_backoff=0.3).delays())
+        self.assertEqual(4, len(delays))
+        for delay, limit in zip(delays, (0.1, 0.2, 0.3, 0.3)):
+            self.assertTrue(0 <= delay <= limit)
+
+    def test_caches_read_endpoints_per_account(self):
+        session = ScriptedSession(response(200, {'success': {'spaces': [{'id': 's-1'}]}}))
+        sap = SpatialApiConnector(session)
+        self.assertEqual([{'id': 's-1'}], sap.list_space_visited())
+        self.assertEqual([{'id': 's-1'}], sap.list_space_visited())
+        self.assertEqual(1, len(session.calls))
+        self.assertEqual((1, 1), (sap.cache_stats.hits, sap.cache_stats.misses))
+
+        session.cookies.set('authorization', 'other')
+        sap.list_space_visited()
+        self.assertEqual(2, len(session.calls))
+
+    def test_invalidate_endpoint(self):
+        session = ScriptedSession(response(200, {'success': {'messages': []}}))
+        sap = SpatialApiConnector(session)
+        sap.get_direct_message_chat_page('a-1')
+        sap.get_direct_message_chat_page('a-2')
+        sap.get_direct_message_chat_page('a-1')
+        self.assertEqual(2, len(session.calls))
+        sap.invalidate(Endpoints.GET_DIRECT_MESSAGE_CHAT_PAGE)
+        sap.get_direct_message_chat_page('a-1')
+        self.assertEqual(3, len(session.calls))
+
+    def test_invalidate_direct_messages_of_one_chat(self):
+        session = ScriptedSession(response(200, {'success': {'messages': []}}))
+        sap = SpatialApiConnector(session, direct_message_paging=True)
+        sap.get_direct_message_chat_page('a-1')
+        sap.get_direct_message_chat_page('a-1', 'm-1')
+        sap.get_direct_message_chat_page('a-2')
+        sap.invalidate_direct_messages('a-1')
+        sap.get_direct_message_chat_page('a-1')
+        sap.get_direct_message_chat_page('a-1', 'm-1')
+        sap.get_direct_message_chat_page('a-2')
+        self.assertEqual(5, len(session.calls))
+
+    def test_direct_message_paging_is_opt_in(self):
+        session = ScriptedSession(response(200, {'success': {'messages': []}}))
+        with self.assertRaises(AssertionError):
+            SpatialApiConnector(session).get_direct_message_chat_page('a-1', 'm-1')
+        SpatialApiConnector(session, direct_message_paging=True).get_direct_message_chat_page('a-1', 'm-1')
+        self.assertEqual([dumps({'accountId': 'a-1', 'before': 'm-1'})], [data for _, data, _ in session.calls])
+
+    def test_uncached_without_ttl(self):
+        session = ScriptedSession(response(200, {'success': {'spaces': []}}))
+        sap = SpatialApiConnector(session, cache_ttls={Endpoints.LIST_SPACE_VISITED: None})
+        sap.list_space_visited()
+        sap.list_space_visited()
+        self.assertEqual(2, len(session.calls))
+
+
+class TestTtlCache(TestCase):
+    def setUp(self):
+        self.time = 0
+        self.cache = TtlCache(max_size=2, clock=lambda: self.time)
+
+    def test_expires(self):
+        self.cache.put('a', 1, ttl=10)
+        self.assertEqual((True, 1), self.cache.get('a'))
+        self.time = 10
+        self.assertEqual((False, None), self.cache.get('a'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', 1, ttl=10)
+        self.cache.put('b', 2, ttl=10)
+        self.cache.get('a')
+        self.cache.put('c', 3, ttl=10)
+        self.assertEqual((False, None), self.cache.get('b'))
+        self.assertEqual((True, 1), self.cache.get('a'))
+        self.assertEqual(1, self.cache.stats.evictions)
+
+    def test_collapses_concurrent_loads(self):
+        started, release = Event(), Event()
+        loads = list()
+
+        def load():
+            loads.append(current_thread().name)
+            started.set()
+            release.wait(5)
+            return len(loads)
+
+        with ThreadPoolExecutor(5) as executor:
+            first = executor.submit(self.cache.get_or_load, 'a', 10, load)
+            self.assertTrue(started.wait(5))
+            others = [executor.submit(self.cache.get_or_load, 'a', 10, load) for _ in range(4)]
+            while self.cache.stats.collapsed < 4:
+                sleep(0.001)
+            release.set()
+            self.assertEqual([1] * 5, [future.result(5) for future in [first] + others])
+        self.assertEqual(1, len(loads))
+        self.assertEqual((True, 1), self.cache.get('a'))
+
+    def test_collapsed_loads_share_the_error(self):
+        started, release = Event(), Event()
+
+        def load():
+            started.set()
+            release.wait(5)
+            raise ConnectionError('reset')
+
+        with ThreadPoolExecutor(2) as executor:
+            first = executor.submit(self.cache.get_or_load, 'a', 10, load)
+            self.assertTrue(started.wait(5))
+            other = executor.submit(self.cache.get_or_load, 'a', 10, load)
+            while not self.cache.stats.collapsed:
+                sleep(0.001)
+            release.set()
+            for future in (first, other):
+                self.assertRaises(ConnectionError, future.result, 5)
+        self.assertEqual(1, self.cache.get_or_load('a', 10, lambda: 1))
+
+    def test_does_not_cache_load_invalidated_meanwhile(self):
+        def load():
+            # e.g. a message arrived while the page was requested
+            self.cache.invalidate()
+            return 'outdated'
+
+        self.assertEqual('outdated', self.cache.get_or_load('a', 10, load))
+        self.assertEqual((False, None), self.cache.get('a'))
+
+
+class TestAsyncSpatialApiConnector(TestCase):
+    def test_concurrent_calls(self):
+        session = ScriptedSession(response(200, {'success': {'messages': []}}))
+        async_sap = AsyncSpatialApiConnector(SpatialApiConnector(session), max_concurrency=4)
+        pages = asyncio.run(async_sap.get_direct_message_chat_pages([f'a-{i}' for i in range(10)]))
+        async_sap.terminate()
+        self.assertEqual([[]] * 10, pages)
+        self.assertEqual(10, len(session.calls))
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from random import Random
+from unittest import TestCase
+
+import pytz
+
+from chat.entity.archive import MessageArchive
+from chat.entity.messages import ChatMessage
+from chat.entity.store import MessageStore
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerBuilderAware, ChatListener
+from tests.test_listener import state_frame, chat_json
+
+
+class TestMessageArchive(TestCase):
+    def setUp(self) -> None:
+        self.berlin_tz = pytz.timezone('Europe/Berlin')
+        self.start = self.berlin_tz.localize(datetime(2022, 1, 25, 15, 10, 11))
+        self.archive = MessageArchive()
+
+    def message(self, message_id: str, minutes: int, text: str = 'text') -> ChatMessage:
+        return ChatMessage('test name', text, self.start + timedelta(minutes=minutes), self.berlin_tz, message_id)
+
+    def test_save_and_load(self):
+        room = self.archive.room('s-1', 'r-1')
+        room.save([self.message('b', 2), self.message('a', 1)])
+        self.assertEqual([self.message('a', 1), self.message('b', 2)], room.load())
+        self.assertEqual([self.message('b', 2)], room.load(limit=1))
+
+    def test_upsert_and_delete(self):
+        room = self.archive.room('s-1', 'r-1')
+        room.save([self.message('a', 1), self.message('b', 2)])
+        room.save([self.message('a', 1, 'edited')])
+        room.delete(['b'])
+        self.assertEqual([self.message('a', 1, 'edited')], room.load())
+
+    def test_chats_are_separated(self):
+        self.archive.room('s-1', 'r-1').save([self.message('a', 1)])
+        self.archive.direct('r-1').save([self.message('b', 1)])
+        self.assertEqual(['a'], [m.message_id for m in self.archive.room('s-1', 'r-1').load()])
+        self.assertEqual([], self.archive.room('s-2', 'r-1').load())
+
+
+class TestChatListenerArchive(TestCase):
+    def setUp(self) -> None:
+        self.archive = MessageArchive()
+        self.socket = ListenerBuilderAware()
+
+    def test_writes_through_and_restores(self):
+        chat_listener = ChatListener(self.socket, archive=self.archive, space_id='s-1')
+        self.socket.process_listener(None, state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z'),
+                                                       chat_json('2', 'second', '2022-01-25T14:10:12.000Z')))
+        self.assertEqual(['1', '2'], [m.message_id for m in chat_listener.room_chats('r-1')])
+
+        restored = ChatListener(ListenerBuilderAware(), archive=self.archive, space_id='s-1')
+        self.assertEqual(['first', 'second'], [m.message for m in restored.cached_room_chats('r-1')])
+
+    def test_state_merges_into_restored_chats(self):
+        archived = [KeypathView(chat_json('0', 'old', '2022-01-25T14:00:00.000Z')),
+                    KeypathView(chat_json('2', 'deleted', '2022-01-25T14:10:12.000Z'))]
+        self.archive.room('s-1', 'r-1').save(ChatMessage.from_json_list(archived))
+        chat_listener = ChatListener(self.socket, archive=self.archive, space_id='s-1')
+        self.assertEqual(['0', '2'], [m.message_id for m in chat_listener.cached_room_chats('r-1')])
+
+        self.socket.process_listener(None, state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z'),
+                                                       chat_json('3', 'third', '2022-01-25T14:10:13.000Z')))
+        self.assertEqual(['0', '1', '3'], [m.message_id for m in chat_listener.room_chats('r-1')])
+        self.assertEqual(['0', '1', '3'], [m.message_id for m in self.archive.room('s-1', 'r-1').load()])
+
+    def test_state_before_restoring(self):
+        archived = [KeypathView(chat_json('1', 'first', '2022-01-25T14:10:11.000Z')),
+                    KeypathView(chat_json('2', 'deleted', '2022-01-25T14:10:12.000Z'))]
+        self.archive.room('s-1', 'r-1').save(ChatMessage.from_json_list(archived))
+        chat_listener = ChatListener(self.socket, archive=self.archive, space_id='s-1')
+        self.socket.process_listener(None, state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z'),
+                                                       chat_json('3', 'third', '2022-01-25T14:10:13.000Z')))
+        self.assertEqual(['1', '3'], [m.message_id for m in chat_listener.cached_room_chats('r-1')])
+        self.assertEqual(['1', '3'], [m.message_id for m in self.archive.room('s-1', 'r-1').load()])
+
+    def test_state_prunes_archive_beyond_the_store(self):
+        archived = [KeypathView(chat_json(str(i), f'chat {i}', f'2022-01-25T14:10:1{i}.000Z')) for i in range(4)]
+        self.archive.room('s-1', 'r-1').save(ChatMessage.from_json_list(archived))
+        chat_listener = ChatListener(self.socket, message_store=MessageStore(max_messages=1), archive=self.archive,
+                                     space_id='s-1')
+        self.socket.process_listener(None, state_frame('r-1', chat_json('0', 'chat 0', '2022-01-25T14:10:10.000Z'),
+                                                       chat_json('3', 'chat 3', '2022-01-25T14:10:13.000Z')))
+        self.assertEqual(['3'], [m.message_id for m in chat_listener.room_chats('r-1')])
+        self.assertEqual(['0', '3'], [m.message_id for m in self.archive.room('s-1', 'r-1').load()])
+
+
+class TestMessageSearch(TestCase):
+    def setUp(self) -> None:
+        self.berlin_tz = pytz.timezone('Europe/Berlin')
+        self.start = self.berlin_tz.localize(datetime(2022, 1, 25, 15, 10, 11))
+        self.archive = MessageArchive()
+        self.archive.room('s-1', 'r-1').save([self.message('1', 1, 'Anna', 'hello world'),
+                                              self.message('2', 2, 'Bert', 'hello again'),
+                                              self.message('3', 3, 'Anna', 'goodbye wörld')])
+        self.archive.room('s-2', 'r-2').save([self.message('4', 4, 'Anna', 'hello from elsewhere')])
+
+    def message(self, message_id: str, minutes: int, author: str, text: str) -> ChatMessage:
+        return ChatMessage(author, text, self.start + timedelta(minutes=minutes), self.berlin_tz, message_id)
+
+    def ids(self, hits):
+        return [hit.message.message_id for hit in hits]
+
+    def test_prefix_search_newest_first(self):
+        self.assertEqual(['4', '2', '1'], self.ids(self.archive.search('hel')))
+        self.assertEqual(['3', '1'], self.ids(self.archive.search('world')))
+
+    def test_author_and_chats(self):
+        self.assertEqual(['3', '1'], self.ids(self.archive.search(author='ann',
+                                                                  chats=MessageArchive.space_chats('s-1'))))
+        self.assertEqual(['1'], self.ids(self.archive.search('hello', author='anna', chats='room/s-1/')))
+        self.assertEqual('r-2', self.archive.search('elsewhere')[0].chat_id)
+
+    def test_time_range(self):
+        self.assertEqual(['3', '2'], self.ids(self.archive.search(since=self.start + timedelta(minutes=2),
+                                                                  until=self.start + timedelta(minutes=4))))
+
+    def test_follows_updates_and_deletes(self):
+        room = self.archive.room('s-1', 'r-1')
+        room.save([self.message('2', 2, 'Bert', 'edited')])
+        room.delete(['1'])
+        self.assertEqual(['4'], self.ids(self.archive.search('hello')))
+        self.assertEqual(['2'], self.ids(self.archive.search('edit')))
+
+    def test_scanning_fallback(self):
+        self.archive.searchable = False
+        self.assertEqual(['4', '2', '1'], self.ids(self.archive.search('hel')))
+        self.assertEqual(['1'], self.ids(self.archive.search('hello', author='anna', chats='room/s-1/')))
+
+    def test_newest_hits_stored_out_of_order(self):
+        random = Random(3)
+        words = ['coffee', 'coffees', 'lunch', 'deploy', 'deployed', 'review']
+        messages = [self.message(f'm-{minute}', minute, random.choice(['Anna', 'Bert']),
+                                 ' '.join(random.choices(words, k=2))) for minute in range(300)]
+        shuffled = random.sample(messages, len(messages))
+        # live chats are stored oldest first, paged history newest first
+        for stored in (messages, list(reversed(messages)), messages[150:] + list(reversed(messages[:150])), shuffled):
+            archive = MessageArchive()
+            for offset in range(0, len(stored), 30):
+                archive.room('s-1', f'r-{offset % 3}').save(stored[offset:offset + 30])
+            for scan_limit, max_terms in ((1000, 32), (50, 1), (1, 0)):
+                archive.search_scan_limit = scan_limit
+                archive.search_max_terms = max_terms
+                for text, author, limit in (('coffee', None, 5), ('lunch deploy', None, 20), ('review', 'bert', 1),
+                                            ('coff', 'anna', 200), ('deploy', 'b', 10)):
+                    archive.searchable = True
+                    indexed = self.ids(archive.search(text, author=author, limit=limit))
+                    archive.searchable = False
+                    self.assertEqual(self.ids(archive.search(text, author=author, limit=limit)), indexed)
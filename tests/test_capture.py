@@ -0,0 +1,87 @@
+import gzip
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import List
+from unittest import TestCase
+
+from websocket import WebSocketApp
+
+from chat.spatial.codec import dumps
+from chat.spatial.listener import ListenerBuilderAware
+from chat.spatial.metrics import Metrics
+from chat.spatial.websocket.base import MessageHandlingWebSocketMixin
+from chat.spatial.websocket.capture import FrameCapture, FrameReplayer, read_capture, CapturedFrame
+
+
+def connected(connection_id: str) -> str:
+    return dumps({'success': {'connected': {'connectionId': connection_id}}})
+
+
+class TestFrameCapture(TestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.path = join(self.directory.name, 'frames.capture.gz')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_captures_received_frames(self):
+        capture = FrameCapture(self.path)
+        socket = MessageHandlingWebSocketMixin(WebSocketApp('ws://127.0.0.1/space'), capture=capture)
+        ids: List[str] = list()
+        socket.on('success.connected').call(lambda s, m: ids.append(m['success.connected.connectionId']))
+        for i in range(3):
+            socket._on_message(socket.socket, connected(f'c-{i}'))
+        capture.close()
+        captured = list(read_capture(self.path))
+        self.assertEqual([connected(f'c-{i}') for i in range(3)], [c.frame for c in captured])
+        self.assertEqual({'ws://127.0.0.1/space'}, {c.source for c in captured})
+        self.assertEqual(sorted(c.timestamp for c in captured), [c.timestamp for c in captured])
+        self.assertEqual(['c-0', 'c-1', 'c-2'], ids)
+        self.assertEqual(3, capture.stats.captured)
+
+    def test_reads_truncated_capture(self):
+        capture = FrameCapture(self.path)
+        for i in range(100):
+            capture.record('source', connected(f'c-{i}'))
+        capture.close()
+        with gzip.open(self.path, 'rb') as file:
+            content = file.read()
+        with gzip.open(self.path, 'wb') as file:
+            file.write(content[:-10])
+        self.assertEqual(99, len(list(read_capture(self.path))))
+
+    def test_rejects_other_files(self):
+        with gzip.open(self.path, 'wb') as file:
+            file.write(b'no capture at all')
+        with self.assertRaises(ValueError):
+            list(read_capture(self.path))
+
+
+class TestFrameReplayer(TestCase):
+    def setUp(self) -> None:
+        self.target = ListenerBuilderAware()
+        self.target.metrics = Metrics()
+        self.ids: List[str] = list()
+        self.target.on('success.connected').call(lambda s, m: self.ids.append(m['success.connected.connectionId']))
+        self.frames = [CapturedFrame(100.0 + i * 0.05, 'a' if i % 2 else 'b', connected(f'c-{i}')) for i in range(5)]
+        self.frames.insert(2, CapturedFrame(100.06, 'a', 'ping'))
+
+    def test_as_fast_as_possible(self):
+        stats = FrameReplayer(self.target, speed=None).replay(iter(self.frames))
+        self.assertEqual([f'c-{i}' for i in range(5)], self.ids)
+        self.assertEqual(5, stats.frames)
+        self.assertEqual(5, self.target.metrics.message_types['success.connected'].frames)
+
+    def test_keeps_pace(self):
+        started = perf_counter()
+        FrameReplayer(self.target, speed=1).replay(iter(self.frames))
+        self.assertGreaterEqual(perf_counter() - started, 0.2)
+        started = perf_counter()
+        FrameReplayer(self.target, speed=4).replay(iter(self.frames))
+        self.assertLess(perf_counter() - started, 0.15)
+
+    def test_only_source(self):
+        FrameReplayer(self.target, speed=None).replay(iter(self.frames), source='a')
+        self.assertEqual(['c-1', 'c-3'], self.ids)
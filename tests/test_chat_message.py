@@ -4,7 +4,9 @@ from unittest import TestCase
 import pytz
 from benedict.dicts import benedict
 
-from chat.entity.messages import to_relative_duration, ChatMessage
+from chat.entity.age import AgeLabelScheduler
+from chat.entity.messages import to_relative_duration, ChatMessage, next_relative_duration_change, to_datetime, \
+    to_datetimes, to_epoch_millis, from_epoch_millis
 
 
 class TestChatMessageDisplay(TestCase):
@@ -24,6 +26,21 @@ class TestChatMessageDisplay(TestCase):
         self.assertEqual('-24d', to_relative_duration(timedelta(days=24, hours=3)))
         self.assertEqual('>1y', to_relative_duration(timedelta(days=356, hours=3)))
 
+    def test_next_relative_duration_change(self):
+        self.assertEqual(timedelta(seconds=60), next_relative_duration_change(timedelta()))
+        self.assertEqual(timedelta(seconds=30), next_relative_duration_change(timedelta(minutes=1)))
+        self.assertEqual(timedelta(seconds=30), next_relative_duration_change(timedelta(minutes=59, seconds=30)))
+        self.assertEqual(timedelta(minutes=30), next_relative_duration_change(timedelta(hours=2)))
+        self.assertEqual(timedelta(hours=12), next_relative_duration_change(timedelta(days=3)))
+        self.assertIsNone(next_relative_duration_change(timedelta(days=400)))
+
+    def test_relative_duration_stable_until_change(self):
+        for delta in (timedelta(seconds=5), timedelta(minutes=7, seconds=3), timedelta(hours=5, minutes=20),
+                      timedelta(days=12, hours=1)):
+            until_change = next_relative_duration_change(delta)
+            self.assertEqual(to_relative_duration(delta),
+                             to_relative_duration(delta + until_change - timedelta(milliseconds=1)))
+
     def test_do_not_create_with_tz_in_constructor(self):
         self.assertEqual('LMT', datetime(2022, 1, 25, 15, 10, 11, 222000, self.berlin_tz).tzname(),
                          'we do not want this')
@@ -51,8 +68,58 @@ class TestChatMessageDisplay(TestCase):
                 'id': '123'
             })))
 
+    def test_convert_from_json_list(self):
+        chats = [benedict({'created': {'account': {'account': {'name': 'test name'}}, 'date': date},
+                           'state': {'active': {'content': 'test message'}}, 'id': message_id})
+                 for message_id, date in (('1', '2022-01-25T14:10:11.222Z'), ('2', '2022-07-25T14:10:11.222Z'))]
+        self.assertEqual([ChatMessage.from_json(chat) for chat in chats], ChatMessage.from_json_list(chats))
+
+    def test_parse_timestamps(self):
+        self.assertEqual(self.berlin_tz.localize(self.test_time), to_datetime('2022-01-25T14:10:11.222Z', self.berlin_tz))
+        self.assertEqual('CEST', to_datetime('2022-03-27T01:00:00.000Z', self.berlin_tz).tzname())
+        self.assertEqual('CET', to_datetime('2022-03-27T00:59:59.999Z', self.berlin_tz).tzname())
+        self.assertEqual(datetime(2022, 1, 25, 15, 10, 11, 222333),
+                         to_datetime('2022-01-25T14:10:11.222333Z', self.berlin_tz).replace(tzinfo=None))
+        datetime_strs = ['2022-10-30T00:59:59.000Z', '2022-10-30T01:00:00.000Z', '2022-01-25T14:10:11Z']
+        self.assertEqual([to_datetime(s, self.berlin_tz) for s in datetime_strs],
+                         to_datetimes(datetime_strs, self.berlin_tz))
+        self.assertEqual(['CEST', 'CET', 'CET'], [d.tzname() for d in to_datetimes(datetime_strs, self.berlin_tz)])
+
+    def test_epoch_millis(self):
+        self.assertEqual(1643119811222, to_epoch_millis('2022-01-25T14:10:11.222Z'))
+        self.assertEqual(1643119811000, to_epoch_millis('2022-01-25T14:10:11Z'))
+        self.assertEqual(to_datetime('2022-01-25T14:10:11.222Z', self.berlin_tz),
+                         from_epoch_millis(1643119811222, self.berlin_tz))
+
     def test_message_age(self):
         message = ChatMessage('test name', 'test message', self.berlin_tz.localize(datetime.now()), self.berlin_tz,
                               '123')
 
         self.assertEqual('now', message.age)
+
+
+class TestAgeLabelScheduler(TestCase):
+    def setUp(self) -> None:
+        self.berlin_tz = pytz.timezone('Europe/Berlin')
+        self.now = datetime(2022, 1, 25, 15, 10, 11)
+        self.scheduler = AgeLabelScheduler()
+        self.scheduler.refresh(self.now)
+        self.messages = [ChatMessage('test name', 'test message', self.berlin_tz.localize(self.now - age),
+                                     self.berlin_tz, str(i))
+                         for i, age in enumerate((timedelta(), timedelta(minutes=10), timedelta(days=2)))]
+
+    def test_labels_use_snapshot(self):
+        self.assertEqual(['now', '-10m', '-2d'], [self.scheduler.label(m) for m in self.messages])
+
+    def test_refresh_only_changed_labels(self):
+        [self.scheduler.label(m) for m in self.messages]
+        self.assertEqual([], self.scheduler.refresh(self.now + timedelta(seconds=20)))
+        self.assertEqual(['1', '0'], self.scheduler.refresh(self.now + timedelta(seconds=61)))
+        self.assertEqual(['-1m', '-11m'], [self.scheduler.label(m) for m in self.messages[:2]])
+        self.assertEqual(['0', '1'], self.scheduler.refresh(self.now + timedelta(minutes=10, seconds=31)))
+        self.assertEqual(['-11m', '-21m'], [self.scheduler.label(m) for m in self.messages[:2]])
+
+    def test_removed_messages_are_not_refreshed(self):
+        [self.scheduler.label(m) for m in self.messages]
+        self.scheduler.remove('1')
+        self.assertEqual(['0'], self.scheduler.refresh(self.now + timedelta(seconds=61)))
@@ -0,0 +1,43 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from chat.spatial import codec
+from chat.spatial.codec import KeypathView, dumps, loads
+
+
+class TestCodec(TestCase):
+    def test_dumps_compact(self):
+        self.assertEqual('{"connectionId":"c-1","roomId":"r 1"}', dumps({'connectionId': 'c-1', 'roomId': 'r 1'}))
+
+    def test_roundtrip(self):
+        payload = {'success': {'room': {'id': '1', 'chat': [{'id': 'm-1'}]}}}
+        self.assertEqual(payload, loads(dumps(payload)))
+        self.assertEqual(payload, loads(dumps(payload).encode()))
+
+    def test_stdlib_fallback(self):
+        with patch.object(codec, 'orjson', None):
+            self.assertEqual('{"a":[1,2],"b":"c d"}', dumps({'a': [1, 2], 'b': 'c d'}))
+            self.assertEqual({'a': [1, 2]}, loads(b'{"a": [1, 2]}'))
+
+
+class TestKeypathView(TestCase):
+    def setUp(self) -> None:
+        self.view = KeypathView({'success': {'room': {'id': '1', 'name': None}, 'chats': [{'id': 'm-1'}]}})
+
+    def test_resolve_keypath(self):
+        self.assertEqual('1', self.view['success.room.id'])
+        self.assertEqual([{'id': 'm-1'}], self.view['success.chats'])
+
+    def test_nested_dict_is_view(self):
+        self.assertIsInstance(self.view['success.room'], KeypathView)
+        self.assertEqual('1', self.view['success']['room.id'])
+
+    def test_contains_keypath(self):
+        self.assertIn('success.room.name', self.view)
+        self.assertNotIn('success.room.missing', self.view)
+        self.assertNotIn('success.chats.id', self.view)
+        self.assertNotIn('success.room.id.deeper', self.view)
+
+    def test_missing_keypath_raises(self):
+        with self.assertRaises(KeyError):
+            _ = self.view['success.missing.id']
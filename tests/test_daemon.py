@@ -0,0 +1,146 @@
+import json
+import subprocess
+import sys
+from io import BytesIO
+from types import SimpleNamespace
+from typing import List, Dict, Any
+from unittest import TestCase
+
+from requests import Session
+
+from benchmark.server import FakeSpatialServer
+from chat.daemon import JsonLinesWriter, ChatDaemon, RoomStream
+from chat.entity.account import AccountSecret
+from chat.entity.messages import ChatMessage
+from chat.spatial.account import AuthenticatedAccount
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import KeypathView
+from tests.test_fake_server import wait_until
+from tests.test_listener import chat_json
+
+
+class BrokenPipe(BytesIO):
+    def write(self, data: bytes) -> int:
+        raise BrokenPipeError('reader went away')
+
+
+def records(output: BytesIO) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in output.getvalue().decode().splitlines()]
+
+
+class TestJsonLinesWriter(TestCase):
+    def test_writes_lines_in_order(self):
+        output = BytesIO()
+        writer = JsonLinesWriter(output, max_pending=10, batch_size=7)
+        for i in range(100):
+            writer.write({'i': i, 'text': f'ünïcode {i}'})
+        writer.close()
+        self.assertEqual([{'i': i, 'text': f'ünïcode {i}'} for i in range(100)], records(output))
+        self.assertEqual(100, writer.stats.written)
+
+    def test_flushes_while_idle(self):
+        output = BytesIO()
+        flushed = list()
+        output.flush = lambda: flushed.append(len(output.getvalue()))
+        writer = JsonLinesWriter(output, flush_interval=0.01)
+        writer.write({'i': 1})
+        self.assertTrue(wait_until(lambda: flushed and flushed[-1] > 0, timeout=1))
+        writer.close()
+
+    def test_drops_after_output_failed(self):
+        writer = JsonLinesWriter(BrokenPipe(), max_pending=2, batch_size=1)
+        for i in range(50):
+            writer.write({'i': i})
+        writer.close()
+        self.assertIsInstance(writer.error, BrokenPipeError)
+        self.assertEqual((0, 50), (writer.stats.written, writer.stats.dropped))
+
+
+def chat(message_id: str) -> ChatMessage:
+    return ChatMessage.from_json(KeypathView(chat_json(message_id, f'message {message_id}',
+                                                       '2022-01-25T14:10:11.000Z')))
+
+
+class RacingRoom:
+    """
+    joined room receiving chats while its state is taken, one of them already part of the state
+    """
+
+    def __init__(self):
+        self.room = SimpleNamespace(room_id='r-1', name='room 1')
+        self.on_new = None
+        self.on_deleted = None
+
+    def on_new_message(self, callback):
+        self.on_new = callback
+
+    def on_deleted_message(self, callback):
+        self.on_deleted = callback
+
+    def get_chat_messages(self) -> List[ChatMessage]:
+        self.on_new(chat('m-2'))
+        self.on_new(chat('m-3'))
+        self.on_deleted('m-1')
+        return [chat('m-1'), chat('m-2')]
+
+
+class TestRoomStream(TestCase):
+    def test_streams_chats_arriving_meanwhile_once(self):
+        output = BytesIO()
+        writer = JsonLinesWriter(output)
+        room = RacingRoom()
+        stream = RoomStream(SimpleNamespace(space_id='s-1', name='space 1'), room, writer)
+        self.assertEqual(2, stream.stream_initial())
+        room.on_new(chat('m-4'))
+        writer.close()
+        self.assertEqual([('initial', 'm-1'), ('initial', 'm-2'), ('new', 'm-3'), ('deleted', 'm-1'), ('new', 'm-4')],
+                         [(record['kind'], record['message_id']) for record in records(output)])
+
+
+class TestChatDaemon(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeSpatialServer(spaces=3, rooms=3, history=20).start()
+        self.sap = SpatialApiConnector(Session(), api_url=self.server.api_url)
+        self.sap.authenticate(AccountSecret('tester@localhost', 'tester'))
+        self.account = AuthenticatedAccount(self.sap, AccountSecret('tester@localhost', 'tester'))
+        self.output = BytesIO()
+        self.writer = JsonLinesWriter(self.output, flush_interval=0.05)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        self.sap.terminate()
+
+    def test_streams_initial_and_new_chats(self):
+        daemon = ChatDaemon(self.account, self.writer, spaces=['space 0', 'space-2'], rooms=['room 1'], timeout=5)
+        streams = daemon.start()
+        self.assertEqual(['space-0-room-1', 'space-2-room-1'], [s.joined_room.room.room_id for s in streams])
+        chat = self.server.post('space-2-room-1', 'author 1', 'fresh message')
+        self.server.post('space-2-room-2', 'author 1', 'not joined')
+        self.server.delete('space-0-room-1', self.server.chats['space-0-room-1'][0]['id'])
+        self.assertTrue(wait_until(lambda: len(records(self.output)) == 42))
+        daemon.stop()
+        self.writer.close()
+
+        streamed = records(self.output)
+        initial = [record for record in streamed if record['kind'] == 'initial']
+        self.assertEqual(40, len(initial))
+        self.assertEqual({'space-0-room-1', 'space-2-room-1'}, {record['room_id'] for record in initial})
+        new = [record for record in streamed if record['kind'] == 'new']
+        self.assertEqual([{'kind': 'new', 'space_id': 'space-2', 'space': 'space 2', 'room_id': 'space-2-room-1',
+                           'room': 'room 1', 'message_id': chat['id'], 'author': 'author 1',
+                           'created': new[0]['created'], 'message': 'fresh message'}], new)
+        self.assertEqual(['space-0-room-1'], [record['room_id'] for record in streamed if record['kind'] == 'deleted'])
+
+    def test_first_room_by_default(self):
+        daemon = ChatDaemon(self.account, self.writer, timeout=5)
+        streams = daemon.start()
+        daemon.stop()
+        self.writer.close()
+        self.assertEqual(['space-0-room-0', 'space-1-room-0', 'space-2-room-0'],
+                         [s.joined_room.room.room_id for s in streams])
+        self.assertEqual(60, len(records(self.output)))
+
+    def test_does_not_import_py_cui(self):
+        imported = subprocess.run([sys.executable, '-c', 'import sys, chat.daemon; print("py_cui" in sys.modules)'],
+                                  capture_output=True, text=True, check=True)
+        self.assertEqual('False', imported.stdout.strip())
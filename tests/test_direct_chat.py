@@ -0,0 +1,70 @@
+from threading import Lock
+from time import sleep
+from typing import Optional
+from unittest import TestCase
+
+from requests import ConnectionError
+from websocket import WebSocketApp
+
+from chat.entity.account import ChatAccount
+from chat.entity.chat import DirectChat, fetch_all_messages
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.codec import KeypathView
+from chat.spatial.websocket.direct import DirectChatSocketAppWrapper
+from chat.spatial.websocket.engine import SocketEngine
+from tests.test_api import ScriptedSession, response
+from tests.test_listener import chat_json
+
+
+class CountingConnector:
+    def __init__(self, failing: str):
+        self.failing = failing
+        self.lock = Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def get_direct_message_chat_page(self, account_id: str, before: Optional[str] = None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if account_id == self.failing:
+            raise ConnectionError('reset')
+        return [chat_json(f'{account_id}-1', 'hello', '2022-01-25T14:10:11.000Z')]
+
+
+class TestFetchAllMessages(TestCase):
+    def test_isolates_errors_and_limits_concurrency(self):
+        sap = CountingConnector(failing='a-3')
+        chats = [DirectChat(ChatAccount(f'name {i}', f'a-{i}'), sap) for i in range(10)]
+        histories = {history.chat.chat_account.account_id: history for history in fetch_all_messages(chats, 3)}
+
+        self.assertEqual(10, len(histories))
+        self.assertIsInstance(histories['a-3'].error, ConnectionError)
+        self.assertEqual([], histories['a-3'].messages)
+        self.assertTrue(all(history.ok for account_id, history in histories.items() if account_id != 'a-3'))
+        self.assertEqual(['a-0-1'], [m.message_id for m in histories['a-0'].messages])
+        self.assertLessEqual(sap.max_running, 3)
+
+
+class TestDirectChatSocket(TestCase):
+    def test_new_message_invalidates_cached_pages_of_its_chat(self):
+        session = ScriptedSession(response(200, {'success': {'messages': []}}))
+        sap = SpatialApiConnector(session)
+        engine = SocketEngine()
+        try:
+            direct_chat = DirectChatSocketAppWrapper(sap, WebSocketApp('ws://localhost/'), engine=engine)
+            sap.get_direct_message_chat_page('a-1')
+            sap.get_direct_message_chat_page('a-2')
+            direct_chat.process_listener(None, KeypathView({'success': {'state': {'chats': []}}}))
+            sap.get_direct_message_chat_page('a-1')
+            self.assertEqual(2, len(session.calls))
+            direct_chat.process_listener(None, KeypathView({'success': {'chat': {
+                'account': {'account': {'accountId': 'a-1'}}, 'chatMessage': {'id': 'm-1'}}}}))
+            sap.get_direct_message_chat_page('a-1')
+            sap.get_direct_message_chat_page('a-2')
+            self.assertEqual(3, len(session.calls))
+        finally:
+            engine.shutdown()
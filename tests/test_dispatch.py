@@ -0,0 +1,130 @@
+from threading import Event, Thread, Lock
+from time import monotonic, sleep
+from typing import List, Tuple
+from unittest import TestCase
+
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerBuilderAware
+from chat.spatial.websocket.dispatch import DispatchQueue, Backpressure
+
+
+def update_frame(room_id: str, message_id: str):
+    return KeypathView({'success': {'room': {'id': room_id, 'response': {'spatial': {
+        'update': {'chatMessage': {'id': message_id}}}}}}})
+
+
+def state_frame(room_id: str, state: str):
+    return KeypathView({'success': {'room': {'id': room_id, 'response': {'spatial': {'state': {'chat': [state]}}}}}})
+
+
+class TestDispatchQueue(TestCase):
+    def setUp(self) -> None:
+        self.source = ListenerBuilderAware()
+        self.lock = Lock()
+        self.processed: List[Tuple[str, str]] = list()
+        self.release = Event()
+        self.release.set()
+        self.source.on('success.room.response.spatial.update.chatMessage').call(self.on_update)
+        self.source.on('success.room.response.spatial.state.chat').call(self.on_state)
+
+    def on_update(self, socket, message):
+        self.release.wait(5)
+        with self.lock:
+            self.processed.append((message['success.room.id'],
+                                   message['success.room.response.spatial.update.chatMessage.id']))
+
+    def on_state(self, socket, message):
+        self.release.wait(5)
+        with self.lock:
+            self.processed.append((message['success.room.id'], message['success.room.response.spatial.state.chat'][0]))
+
+    @staticmethod
+    def wait_until_taken(dispatch: DispatchQueue):
+        deadline = monotonic() + 5
+        while dispatch.depth and monotonic() < deadline:
+            sleep(0.001)
+
+    def test_keeps_order_per_room(self):
+        dispatch = DispatchQueue(workers=4)
+        for i in range(50):
+            for room_id in ('r-1', 'r-2', 'r-3'):
+                dispatch.submit(self.source, None, update_frame(room_id, str(i)))
+        dispatch.close(5)
+        for room_id in ('r-1', 'r-2', 'r-3'):
+            self.assertEqual([str(i) for i in range(50)], [m for r, m in self.processed if r == room_id])
+        self.assertEqual(150, dispatch.stats.processed)
+        self.assertEqual(0, dispatch.depth)
+
+    def test_slow_room_does_not_hold_up_others(self):
+        dispatch = DispatchQueue(workers=2)
+        slow, done = Event(), Event()
+        source = ListenerBuilderAware()
+        source.on('success.room.response.spatial.update.chatMessage').call(
+            lambda s, m: slow.wait(5) if m['success.room.id'] == 'slow' else done.set())
+        other = next(f'r-{i}' for i in range(100) if hash((id(source), f'r-{i}')) % 2 != hash((id(source), 'slow')) % 2)
+        dispatch.submit(source, None, update_frame('slow', '1'))
+        dispatch.submit(source, None, update_frame(other, '1'))
+        self.assertTrue(done.wait(1))
+        self.assertFalse(slow.is_set())
+        slow.set()
+        dispatch.close(5)
+
+    def test_coalesces_state_when_full(self):
+        self.release.clear()
+        dispatch = DispatchQueue(workers=1, max_pending=2, policy=Backpressure.COALESCE)
+        dispatch.submit(self.source, None, update_frame('r-1', 'busy'))
+        self.wait_until_taken(dispatch)
+        dispatch.submit(self.source, None, state_frame('r-1', 'old'))
+        dispatch.submit(self.source, None, update_frame('r-1', '1'))
+        dispatch.submit(self.source, None, state_frame('r-1', 'new'))
+        self.assertEqual(1, dispatch.stats.coalesced)
+        self.assertEqual(2, dispatch.depth)
+        self.release.set()
+        dispatch.close(5)
+        self.assertEqual([('r-1', 'busy'), ('r-1', 'new'), ('r-1', '1')], self.processed)
+
+    def test_pauses_socket_when_full(self):
+        self.release.clear()
+        paused, resumed = list(), Event()
+        dispatch = DispatchQueue(workers=1, max_pending=1, policy=Backpressure.PAUSE, pause=paused.append,
+                                 resume=lambda socket: resumed.set())
+        dispatch.submit(self.source, 'socket', update_frame('r-1', '1'))
+        self.wait_until_taken(dispatch)
+        dispatch.submit(self.source, 'socket', state_frame('r-1', 'state'))
+        # never blocks the receiving thread, the socket is paused instead
+        dispatch.submit(self.source, 'socket', update_frame('r-1', '2'))
+        dispatch.submit(self.source, 'socket', update_frame('r-1', '3'))
+        self.assertEqual(['socket'], paused)
+        self.assertFalse(resumed.is_set())
+        self.release.set()
+        self.assertTrue(resumed.wait(5))
+        dispatch.close(5)
+        self.assertEqual(1, dispatch.stats.paused)
+        self.assertEqual(0, dispatch.stats.coalesced)
+        self.assertEqual([('r-1', '1'), ('r-1', 'state'), ('r-1', '2'), ('r-1', '3')], self.processed)
+
+    def test_frames_without_room_keep_socket_order(self):
+        self.source.on('success.connected').call(lambda s, m: self.processed.append(('-', 'connected')))
+        slow = Event()
+        self.source.on('success.room.response.spatial.update.chatMessage').call(
+            lambda s, m: slow.wait(5) if m['success.room.id'] == 'slow' else None)
+        other = next(f'r-{i}' for i in range(100)
+                     if hash((id(self.source), f'r-{i}')) % 4 != hash((id(self.source), 'slow')) % 4)
+        dispatch = DispatchQueue(workers=4)
+        dispatch.submit(self.source, None, update_frame('slow', '1'))
+        dispatch.submit(self.source, None, update_frame(other, '1'))
+        dispatch.submit(self.source, None, KeypathView({'success': {'connected': {'connectionId': 'c-1'}}}))
+        dispatch.submit(self.source, None, update_frame('r-2', '1'))
+        sleep(0.05)
+        # the frame without a room waits for the slow room, the frames after it wait for that one
+        self.assertEqual({('slow', '1'), (other, '1')}, set(self.processed))
+        slow.set()
+        dispatch.close(5)
+        self.assertEqual([('-', 'connected'), ('r-2', '1')], self.processed[2:])
+        self.assertEqual(4, dispatch.stats.processed)
+
+    def test_drops_after_close(self):
+        dispatch = DispatchQueue(workers=1)
+        dispatch.close()
+        dispatch.submit(self.source, None, update_frame('r-1', '1'))
+        self.assertEqual(0, dispatch.stats.enqueued)
@@ -0,0 +1,142 @@
+from base64 import b64encode
+from hashlib import sha1
+from socket import create_server, socket
+from threading import Thread, Event, current_thread
+from time import monotonic, sleep
+from typing import List
+from unittest import TestCase
+
+from websocket import WebSocketApp
+
+from chat.spatial.websocket.base import EngineWebSocketAppMixin, MessageHandlingWebSocketMixin, \
+    MessageSendingWebSocketMixin
+from chat.spatial.websocket.dispatch import DispatchQueue
+from chat.spatial.websocket.engine import SocketEngine
+
+
+class FrameServer:
+    """
+    accepts websocket connections and sends every one of them the same text frames
+    """
+
+    def __init__(self, frames: List[str]):
+        self.frames = frames
+        self.received: List[bytes] = list()
+        self.server = create_server(('127.0.0.1', 0))
+        self.url = f'ws://127.0.0.1:{self.server.getsockname()[1]}/'
+        Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection: socket):
+        with connection:
+            request = b''
+            while b'\r\n\r\n' not in request:
+                request += connection.recv(4096)
+            key = [line.split(b':', 1)[1].strip() for line in request.split(b'\r\n')
+                   if line.lower().startswith(b'sec-websocket-key')][0]
+            accept = b64encode(sha1(key + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+            connection.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                               b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+            for frame in self.frames:
+                payload = frame.encode()
+                connection.sendall(bytes((0x81, len(payload))) + payload)
+            while True:
+                header = connection.recv(2)
+                if len(header) < 2:
+                    return
+                length = header[1] & 0x7f
+                mask = connection.recv(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(connection.recv(length)))
+                if header[0] & 0x0f == 0x8:
+                    connection.sendall(bytes((0x88, 0)))
+                    return
+                self.received.append(payload)
+
+    def close(self):
+        self.server.close()
+
+
+class EngineSocket(EngineWebSocketAppMixin, MessageHandlingWebSocketMixin, MessageSendingWebSocketMixin):
+    def __init__(self, url: str, engine: SocketEngine, dispatch: bool = False):
+        web_socket = WebSocketApp(url)
+        EngineWebSocketAppMixin.__init__(self, web_socket, engine)
+        MessageHandlingWebSocketMixin.__init__(self, web_socket, engine.dispatch if dispatch else None)
+        MessageSendingWebSocketMixin.__init__(self, web_socket)
+
+
+class TestSocketEngine(TestCase):
+    def setUp(self) -> None:
+        self.server = FrameServer(['{"success": {"connected": {"connectionId": "c-1"}}}', 'ping',
+                                   '{"success": {"room": {"id": "r-1"}}}'])
+        self.engine = SocketEngine()
+
+    def tearDown(self) -> None:
+        self.engine.shutdown()
+        self.server.close()
+
+    def test_multiplexes_engine_socketson_one_thread(self):
+        threads = set()
+        received = Event()
+        rooms: List[str] = list()
+        engine_sockets = [EngineSocket(self.server.url, self.engine) for _ in range(5)]
+        for engine_socket in engine_sockets:
+            engine_socket.on('success.connected').call(lambda s, m: threads.add(current_thread().name))
+
+            def on_room(s, m):
+                rooms.append(m['success.room.id'])
+                if len(rooms) == len(engine_sockets):
+                    received.set()
+
+            engine_socket.on('success.room').call(on_room)
+            engine_socket.start()
+
+        self.assertTrue(received.wait(5))
+        self.assertEqual({'SocketEngine'}, threads)
+        self.assertEqual(5, self.engine.connections)
+
+        for engine_socket in engine_sockets:
+            engine_socket.end()
+        self.assertEqual(0, self.engine.connections)
+        self.assertEqual([b'pong'] * 5, self.server.received)
+
+    def test_pauses_socket_with_slow_listeners(self):
+        frames = [f'{{"success": {{"room": {{"id": "r-{i % 3}", "n": {i}}}}}}}' for i in range(30)]
+        server = FrameServer(frames)
+        engine = SocketEngine(dispatch=DispatchQueue(workers=2, max_pending=4))
+        release, ended = Event(), Event()
+        received: List[int] = list()
+        engine_socket = EngineSocket(server.url, engine, dispatch=True)
+
+        def on_room(s, m):
+            release.wait(5)
+            received.append(m['success.room.n'])
+            if len(received) == len(frames):
+                # ending from a listener callback must not wait for the loop forever
+                engine_socket.end()
+                ended.set()
+
+        engine_socket.on('success.room').call(on_room)
+        try:
+            engine_socket.start()
+            deadline = monotonic() + 5
+            while not engine.dispatch.stats.paused and monotonic() < deadline:
+                sleep(0.01)
+            self.assertEqual(1, engine.dispatch.stats.paused)
+            # the loop is still serving while the socket is paused
+            self.assertTrue(engine.call(lambda: True))
+            release.set()
+            self.assertTrue(ended.wait(5))
+            for room in range(3):
+                self.assertEqual(list(range(room, 30, 3)), [n for n in received if n % 3 == room])
+            self.assertEqual(0, engine.connections)
+        finally:
+            release.set()
+            engine.shutdown()
+            server.close()
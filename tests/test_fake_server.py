@@ -0,0 +1,99 @@
+from threading import Event
+from time import monotonic, sleep
+from typing import List
+from unittest import TestCase
+
+from requests import Session
+
+from benchmark.server import FakeSpatialServer
+from chat.entity.account import AccountSecret
+from chat.entity.messages import ChatMessage
+from chat.spatial.account import AuthenticatedAccount, EmailAccount
+from chat.spatial.api import SpatialApiConnector
+from chat.spatial.websocket.direct import DirectChatSocketAppWrapper
+from chat.spatial.websocket.engine import SocketEngine
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = monotonic() + timeout
+    while not condition() and monotonic() < deadline:
+        sleep(0.01)
+    return condition()
+
+
+class TestFakeSpatialServer(TestCase):
+    def setUp(self) -> None:
+        self.server = FakeSpatialServer(spaces=2, rooms=3, history=40, ping_interval=0.05).start()
+        self.engine = SocketEngine()
+        self.sap = SpatialApiConnector(Session(), api_url=self.server.api_url)
+        self.sap.authenticate(AccountSecret('tester@localhost', 'tester'))
+        self.account = AuthenticatedAccount(self.sap, AccountSecret('tester@localhost', 'tester'))
+
+    def tearDown(self) -> None:
+        self.engine.shutdown()
+        self.server.stop()
+        self.sap.terminate()
+
+    def test_socket_url_follows_api_url(self):
+        self.assertEqual(self.server.api_url.replace('http://', 'ws://'), self.sap.socket_url)
+
+    def test_register_and_authenticate(self):
+        sap = SpatialApiConnector(Session(), api_url=self.server.api_url)
+        with EmailAccount('new@localhost', sap) as unauthenticated:
+            account = unauthenticated.validate_by_magic_code('123456')
+        self.assertTrue(account.account_secret.auth_code.startswith('token-'))
+
+    def test_space_room_chat(self):
+        spaces = self.account.list_spaces()
+        self.assertEqual(['space-0', 'space-1'], [space.space_id for space in spaces])
+        joinable_space = spaces[1].connect(self.account.account_secret, engine=self.engine)
+        joined_space = joinable_space.join()
+        rooms = joined_space.list_rooms(timeout=5)
+        self.assertEqual(['room 0', 'room 1', 'room 2'], [room.name for room in rooms])
+
+        joined_room = rooms[2].join()
+        chats = joined_room.get_chat_messages()
+        self.assertEqual(40, len(chats))
+        self.assertEqual('history message 39', chats[-1].message)
+
+        received: List[ChatMessage] = list()
+        deleted = Event()
+        joined_room.on_new_message(received.append)
+        joined_room.on_deleted_message(lambda message_id: deleted.set())
+        joined_room.send_chat('hello fake server')
+        self.assertTrue(wait_until(lambda: received))
+        self.assertEqual(('tester', 'hello fake server'), (received[0].author_name, received[0].message))
+        joined_room.delete_chat(received[0])
+        self.assertTrue(deleted.wait(5))
+
+        self.assertTrue(wait_until(lambda: any(c.pongs for c in self.server.space_connections())))
+        joinable_space.leave()
+
+    def test_direct_chats(self):
+        profile = self.sap.get_account_profile()
+        self.assertEqual('tester', profile.name)
+        direct_chat = DirectChatSocketAppWrapper.from_account(profile, self.account, engine=self.engine)
+        direct_chat.start()
+        chats = direct_chat.existing_direct_chats.get_chats(timeout=5)
+        self.assertEqual(5, len(chats))
+        self.assertEqual(30, len(chats[0].get_all_message()))
+        # the stand-in server honors the undocumented paging parameter
+        self.assertEqual(30, len(list(chats[0].iter_messages())))
+        self.sap.direct_message_paging = True
+        self.assertEqual(40, len(list(chats[0].iter_messages())))
+        direct_chat.end()
+
+    def test_generates_traffic(self):
+        server = FakeSpatialServer(spaces=1, rooms=2, rate=200, broadcast=True).start()
+        try:
+            sap = SpatialApiConnector(Session(), api_url=server.api_url)
+            joinable_space = AuthenticatedAccount(sap, AccountSecret('e', 'a')).list_spaces()[0].connect(
+                AccountSecret('e', 'a'), engine=self.engine)
+            updates: List[str] = list()
+            joinable_space.socket.on('success.room.response.spatial.update.chatMessage').call(
+                lambda s, m: updates.append(m['success.room.id']))
+            joinable_space.join()
+            self.assertTrue(wait_until(lambda: len(set(updates)) == 2))
+            joinable_space.leave()
+        finally:
+            server.stop()
@@ -0,0 +1,133 @@
+import asyncio
+from threading import Timer
+from unittest import TestCase
+
+from benedict.dicts import benedict
+
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerBuilderAware, ChatListener, RoomStateTimeoutError, ConnectionListener, \
+    ListenerTimeoutError
+
+
+def chat_json(message_id: str, content: str, date: str):
+    return {'id': message_id, 'created': {'account': {'account': {'name': 'test name'}}, 'date': date},
+            'state': {'active': {'content': content}}}
+
+
+def state_frame(room_id: str, *chats):
+    return KeypathView({'success': {'room': {'id': room_id, 'response': {'spatial': {'state': {'chat': list(chats)}}}}}})
+
+
+class TestListenerDispatch(TestCase):
+    def setUp(self) -> None:
+        self.socket = ListenerBuilderAware()
+        self.called = list()
+        for message_type in ('success.connected', 'pickedUp', 'success.spaceState.roomsTree',
+                             'success.room.response.spatial.state.chat', 'success.room'):
+            self.socket.on(message_type).call(lambda s, m, t=message_type: self.called.append(t))
+
+    def test_dispatch_to_matching_listener(self):
+        self.socket.process_listener(None, benedict({'success': {'connected': {'connectionId': '1'}}}))
+        self.assertEqual(['success.connected'], self.called)
+
+    def test_dispatch_without_matching_listener(self):
+        self.socket.process_listener(None, benedict({'success': {'unknown': {}}, 'other': 1}))
+        self.assertEqual([], self.called)
+
+    def test_dispatch_keeps_registration_order(self):
+        self.socket.process_listener(None, benedict(
+            {'success': {'room': {'id': '1', 'response': {'spatial': {'state': {'chat': []}}}}}}))
+        self.assertEqual(['success.room.response.spatial.state.chat', 'success.room'], self.called)
+
+    def test_dispatch_matches_linear_scan(self):
+        message = benedict({'pickedUp': {}, 'success': {'spaceState': {'roomsTree': []}, 'room': 'no mapping'}})
+        self.socket.process_listener(None, message)
+        self.assertEqual([listener.message_type for listener in self.socket.listener_index.listeners
+                          if listener.accepts(message)], self.called)
+
+
+def connected_frame(connection_id: str):
+    return benedict({'success': {'connected': {'connectionId': connection_id}}})
+
+
+class TestBlockingListenerReadiness(TestCase):
+    def setUp(self) -> None:
+        self.sockets = [ListenerBuilderAware() for _ in range(3)]
+        self.connections = [ConnectionListener(socket).connected for socket in self.sockets]
+
+    def test_ready_per_listener(self):
+        self.sockets[1].process_listener(None, connected_frame('c-1'))
+        self.assertEqual('c-1', self.connections[1].connection_id)
+        for connection in (self.connections[0], self.connections[2]):
+            self.assertFalse(connection.ready.is_set())
+            self.assertRaises(ListenerTimeoutError, connection.wait_ready, 0.01)
+
+    def test_waits_for_first_message(self):
+        Timer(0.01, self.sockets[0].process_listener, (None, connected_frame('c-0'))).start()
+        self.connections[0].wait_ready(1)
+        self.assertEqual('c-0', self.connections[0].connection_id)
+
+    def test_default_timeout(self):
+        self.connections[2].timeout = 0.01
+        with self.assertRaises(ListenerTimeoutError):
+            _ = self.connections[2].connection_id
+
+    def test_reset_waits_for_next_connection(self):
+        self.sockets[0].process_listener(None, connected_frame('c-0'))
+        self.connections[0].reset()
+        self.assertRaises(ListenerTimeoutError, self.connections[0].wait_ready, 0.01)
+        self.sockets[0].process_listener(None, connected_frame('c-1'))
+        self.assertEqual('c-1', self.connections[0].connection_id)
+
+    def test_connection_id_waits_finitely_after_reset(self):
+        self.assertEqual(30, self.connections[0].timeout)
+        self.sockets[0].process_listener(None, connected_frame('c-0'))
+        self.connections[0].reset()
+        self.connections[0].timeout = 0.01
+        with self.assertRaises(ListenerTimeoutError):
+            _ = self.connections[0].connection_id
+
+
+class TestChatListenerReadiness(TestCase):
+    def setUp(self) -> None:
+        self.socket = ListenerBuilderAware()
+        self.chat_listener = ChatListener(self.socket, state_timeout=0.05)
+
+    def test_room_chats_after_state(self):
+        self.socket.process_listener(None, state_frame('r-1', chat_json('2', 'second', '2022-01-25T14:10:12.000Z'),
+                                                       chat_json('1', 'first', '2022-01-25T14:10:11.000Z')))
+        self.assertEqual(['first', 'second'], [c.message for c in self.chat_listener.room_chats('r-1')])
+
+    def test_room_chats_waits_for_state(self):
+        Timer(0.01, self.socket.process_listener,
+              (None, state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z')))).start()
+        self.assertEqual(['first'], [c.message for c in self.chat_listener.room_chats('r-1', timeout=5)])
+
+    def test_room_chats_timeout(self):
+        with self.assertRaises(RoomStateTimeoutError):
+            self.chat_listener.room_chats('r-unknown')
+
+    def test_room_chats_async(self):
+        async def join():
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.01, self.socket.process_listener, None,
+                            state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z')))
+            with self.assertRaises(RoomStateTimeoutError):
+                await self.chat_listener.room_chats_async('r-1', timeout=0)
+            return await self.chat_listener.room_chats_async('r-1', timeout=5)
+
+        self.assertEqual(['first'], [c.message for c in asyncio.run(join())])
+
+    def test_resync_passes_on_difference(self):
+        added, removed = list(), list()
+        self.chat_listener.register_on_new_message('r-1', added.append)
+        self.chat_listener.register_on_deleted_message('r-1', removed.append)
+        self.socket.process_listener(None, state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z'),
+                                                       chat_json('2', 'second', '2022-01-25T14:10:12.000Z')))
+        self.assertEqual(([], []), (added, removed))
+
+        self.socket.process_listener(None, state_frame('r-1', chat_json('1', 'first', '2022-01-25T14:10:11.000Z'),
+                                                       chat_json('3', 'third', '2022-01-25T14:10:13.000Z')))
+        self.assertEqual(['3'], [m.message_id for m in added])
+        self.assertEqual(['2'], removed)
+        self.assertEqual(['1', '3'], [m.message_id for m in self.chat_listener.room_chats('r-1')])
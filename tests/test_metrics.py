@@ -0,0 +1,87 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from requests import ConnectionError
+
+from chat.spatial.api import SpatialApiConnector, RetryPolicy
+from chat.spatial.codec import KeypathView
+from chat.spatial.listener import ListenerBuilderAware
+from chat.spatial.metrics import Histogram, Metrics, FrameReceipt
+from tests.test_api import ScriptedSession, response
+
+
+class TestHistogram(TestCase):
+    def test_quantiles(self):
+        histogram = Histogram((0.001, 0.01, 0.1))
+        for value in [0.0005] * 90 + [0.05] * 9 + [5]:
+            histogram.observe(value)
+        self.assertEqual(100, histogram.count)
+        self.assertEqual(0.001, histogram.quantile(0.5))
+        self.assertEqual(0.1, histogram.quantile(0.99))
+        self.assertEqual(float('inf'), histogram.quantile(1))
+
+    def test_cumulative(self):
+        histogram = Histogram((0.001, 0.01))
+        for value in (0.0001, 0.001, 0.005, 1):
+            histogram.observe(value)
+        self.assertEqual([(0.001, 2), (0.01, 3), (float('inf'), 4)], histogram.cumulative())
+
+    def test_empty(self):
+        self.assertEqual(0.0, Histogram().quantile(0.5))
+
+
+class TestMetrics(TestCase):
+    def setUp(self) -> None:
+        self.metrics = Metrics()
+        self.socket = ListenerBuilderAware()
+        self.socket.metrics = self.metrics
+        self.socket.on('success.connected').call(lambda s, m: None)
+        self.socket.on('success.room').call(lambda s, m: None)
+
+    def test_records_per_message_type(self):
+        frame = KeypathView({'success': {'connected': {'connectionId': 'c-1'}}})
+        self.socket.process_listener(None, frame, FrameReceipt(40, 0.0001))
+        self.socket.process_listener(None, frame, FrameReceipt(42, 0.0001))
+        self.socket.process_listener(None, KeypathView({'other': {}}), FrameReceipt(10, 0.0001))
+        connected = self.metrics.message_types['success.connected']
+        self.assertEqual((2, 82), (connected.frames, connected.bytes))
+        self.assertEqual(2, connected.decode.count)
+        self.assertEqual(2, connected.callback.count)
+        self.assertEqual(2, connected.latency.count)
+        self.assertEqual(1, self.metrics.message_types[Metrics.unmatched].frames)
+        self.assertNotIn('success.room', self.metrics.message_types)
+
+    def test_ignores_frames_without_receipt(self):
+        self.socket.process_listener(None, KeypathView({'success': {'connected': {'connectionId': 'c-1'}}}))
+        self.assertEqual({}, self.metrics.message_types)
+
+    def test_disabled(self):
+        self.metrics.enabled = False
+        self.socket.process_listener(None, KeypathView({'success': {'room': {}}}), FrameReceipt(10, 0.0001))
+        self.assertEqual({}, self.metrics.message_types)
+
+    def test_records_http_latency(self):
+        session = ScriptedSession(ConnectionError('reset'), response(200, {'success': {'messages': []}}))
+        sap = SpatialApiConnector(session, retry=RetryPolicy(attempts=2, backoff=0), metrics=self.metrics)
+        sap.get_direct_message_chat_page('a-1')
+        endpoint = self.metrics.endpoints['DirectChat/getDirectMessageChatPage']
+        self.assertEqual((2, 1), (endpoint.requests, endpoint.errors))
+        self.assertEqual(2, endpoint.latency.count)
+
+    def test_prometheus(self):
+        self.socket.process_listener(None, KeypathView({'success': {'room': {}}}), FrameReceipt(10, 0.0001))
+        self.metrics.observe_request('Space/"quoted"', 0.2)
+        with TemporaryDirectory() as directory:
+            path = join(directory, 'metrics.prom')
+            self.metrics.write_prometheus(path)
+            with open(path) as file:
+                lines = file.read().splitlines()
+        self.assertIn('# TYPE spatial_frames_total counter', lines)
+        self.assertIn('spatial_frames_total{message_type="success.room"} 1', lines)
+        self.assertIn('spatial_frame_bytes_total{message_type="success.room"} 10', lines)
+        self.assertIn('spatial_frame_decode_seconds_bucket{message_type="success.room",le="0.0001"} 1', lines)
+        self.assertIn('spatial_frame_decode_seconds_bucket{message_type="success.room",le="+Inf"} 1', lines)
+        self.assertIn('spatial_frame_decode_seconds_count{message_type="success.room"} 1', lines)
+        self.assertIn('spatial_http_requests_total{endpoint="Space/\\"quoted\\""} 1', lines)
+        self.assertIn('spatial_http_request_seconds_bucket{endpoint="Space/\\"quoted\\"",le="+Inf"} 1', lines)
@@ -0,0 +1,70 @@
+from datetime import datetime
+from threading import Event
+from typing import List, Optional, Dict
+from unittest import TestCase
+
+import pytz
+
+from chat.entity.pager import DirectMessagePager
+from tests.test_listener import chat_json
+
+
+class PagedConnector:
+    def __init__(self, pages: Dict[Optional[str], List[dict]], direct_message_paging: bool = True):
+        self.pages = pages
+        self.direct_message_paging = direct_message_paging
+        self.requested: List[Optional[str]] = list()
+        self.second_page = Event()
+
+    def get_direct_message_chat_page(self, account_id: str, before: Optional[str] = None):
+        self.requested.append(before)
+        if len(self.requested) == 2:
+            self.second_page.set()
+        return self.pages.get(before, list())
+
+
+def messages(*minutes: int) -> List[dict]:
+    return [chat_json(f'm-{minute}', f'message {minute}', f'2022-01-25T14:{minute:02}:00.000Z') for minute in minutes]
+
+
+class TestDirectMessagePager(TestCase):
+    def test_pages_until_empty(self):
+        sap = PagedConnector({None: messages(50, 40), 'm-40': messages(30, 20), 'm-20': messages(10)})
+        pager = DirectMessagePager(sap, 'a-1')
+        self.assertEqual(['m-50', 'm-40', 'm-30', 'm-20', 'm-10'], [m.message_id for m in pager])
+        self.assertEqual([None, 'm-40', 'm-20', 'm-10'], sap.requested)
+
+    def test_only_latest_page_unless_opted_in(self):
+        sap = PagedConnector({None: messages(50, 40), 'm-40': messages(30, 20)}, direct_message_paging=False)
+        self.assertEqual(['m-50', 'm-40'], [m.message_id for m in DirectMessagePager(sap, 'a-1')])
+        self.assertEqual([None], sap.requested)
+
+    def test_stops_at_cutoff(self):
+        sap = PagedConnector({None: messages(50, 40), 'm-40': messages(30, 20), 'm-20': messages(10)})
+        cutoff = pytz.utc.localize(datetime(2022, 1, 25, 14, 25))
+        pager = DirectMessagePager(sap, 'a-1', cutoff=cutoff)
+        self.assertEqual(['m-50', 'm-40', 'm-30'], [m.message_id for m in pager])
+        self.assertEqual([None, 'm-40'], sap.requested)
+
+    def test_stops_when_cursor_is_ignored(self):
+        sap = PagedConnector({None: messages(50, 40)})
+        sap.pages['m-40'] = sap.pages[None]
+        self.assertEqual(['m-50', 'm-40'], [m.message_id for m in DirectMessagePager(sap, 'a-1')])
+        self.assertEqual([None, 'm-40'], sap.requested)
+
+    def test_stops_when_server_ignores_before(self):
+        # the server answers every page with the latest messages, which meanwhile got a new one
+        sap = PagedConnector({None: messages(50, 40), 'm-40': messages(55, 50, 40)})
+        with self.assertLogs('DirectMessagePager', 'WARNING') as logs:
+            self.assertEqual(['m-50', 'm-40'], [m.message_id for m in DirectMessagePager(sap, 'a-1')])
+        self.assertEqual([None, 'm-40'], sap.requested)
+        self.assertIn('did not advance', logs.output[0])
+
+    def test_prefetches_next_page(self):
+        sap = PagedConnector({None: messages(50, 40), 'm-40': messages(30)})
+        pages = DirectMessagePager(sap, 'a-1').pages()
+        next(pages)
+        # the first page is consumed, the second one is requested meanwhile
+        self.assertTrue(sap.second_page.wait(1))
+        self.assertEqual([None, 'm-40'], sap.requested)
+        pages.close()
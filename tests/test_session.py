@@ -0,0 +1,187 @@
+from concurrent.futures import Future
+from time import sleep
+from typing import List, Optional, Callable
+from unittest import TestCase
+
+from benedict.dicts import benedict
+
+from chat.entity.account import AccountSecret
+from chat.entity.reconnect import ReconnectSupervisor
+from chat.entity.session import SpaceSessions, SpaceState
+from chat.spatial.api import RetryPolicy
+from chat.spatial.listener import ListenerBuilderAware, ConnectionListener
+from chat.spatial.param import SpaceConnection
+
+CONNECTED = benedict({'success': {'connected': {'connectionId': 'c-2'}}})
+
+
+class FakeSocket(ListenerBuilderAware):
+    def __init__(self, *connects: bool):
+        super().__init__()
+        self.closed_callbacks: List[Callable] = list()
+        self.connection = ConnectionListener(self)
+        self.space_connection = SpaceConnection('s-1', self.connection.connected)
+        # whether each start connects, the last one is repeated
+        self.connects = list(connects) or [True]
+        self.starts = 0
+
+    def on_closed(self, callback: Callable):
+        self.closed_callbacks.append(callback)
+
+    def close(self, error: Optional[Exception]):
+        for callback in self.closed_callbacks:
+            callback(error)
+
+    def start(self) -> Future:
+        self.starts += 1
+        connects = self.connects.pop(0) if len(self.connects) > 1 else self.connects[0]
+        if connects:
+            self.process_listener(None, CONNECTED)
+        started = Future()
+        started.set_result(not connects)
+        return started
+
+    def end(self):
+        pass
+
+
+class FakeRoomJoiner:
+    def __init__(self):
+        self.rejoined = 0
+
+    def rejoin(self):
+        self.rejoined += 1
+        return 'room'
+
+
+class FakeJoinableSpace:
+    def __init__(self, socket: Optional[FakeSocket] = None):
+        self.space_id = 's-1'
+        self.socket = socket or FakeSocket()
+        self.room_joiner = FakeRoomJoiner()
+        self.joined = 0
+        self.left = 0
+
+    def join(self):
+        self.joined += 1
+        return 'joined'
+
+    def leave(self):
+        self.left += 1
+
+
+class FakeSpace:
+    def __init__(self, space_id: str):
+        self.space_id = space_id
+        self.name = f'space {space_id}'
+        self.joinable_spaces: List[FakeJoinableSpace] = list()
+
+    def connect(self, secret, archive=None, engine=None, message_store=None):
+        # reconnecting fails
+        self.joinable_spaces.append(FakeJoinableSpace(FakeSocket(False)))
+        return self.joinable_spaces[-1]
+
+
+class FakeAccount:
+    account_secret = AccountSecret('test@t.d', 'secret')
+
+    def __init__(self, *spaces: FakeSpace):
+        self.spaces = list(spaces)
+
+    def list_spaces(self):
+        return self.spaces
+
+
+def wait_recovered(supervisor: ReconnectSupervisor):
+    for _ in range(100):
+        if not supervisor.recovering:
+            return
+        sleep(0.01)
+
+
+class TestSpaceSessions(TestCase):
+    def setUp(self) -> None:
+        self.spaces = [FakeSpace('s-1'), FakeSpace('s-2')]
+        self.sessions = SpaceSessions(FakeAccount(*self.spaces), engine=object(), retry=RetryPolicy(attempts=1))
+
+    def test_connects_all_spaces(self):
+        sessions = self.sessions.connect_all()
+        self.assertEqual(['s-1', 's-2'], [session.space_id for session in sessions])
+        self.assertEqual({'s-1': SpaceState.CONNECTING, 's-2': SpaceState.CONNECTING}, self.sessions.states())
+        self.assertEqual('joined', sessions[0].joined_space)
+
+    def test_tracks_state_per_space(self):
+        first, second = self.sessions.connect_all()
+        first.joinable_space.socket.process_listener(None, benedict({'success': {'connected': {'connectionId': 'c'}}}))
+        error = ConnectionRefusedError()
+        second.joinable_space.socket.close(error)
+        self.assertEqual({'s-1': SpaceState.CONNECTED, 's-2': SpaceState.DISCONNECTED}, self.sessions.states())
+        self.assertIs(error, second.error)
+        self.assertTrue(self.sessions.wait_settled(0))
+
+    def test_switching_keeps_connection(self):
+        first, _ = self.sessions.connect_all()
+        self.assertIs(first, self.sessions.connect(self.spaces[0]))
+        self.assertEqual(1, len(self.spaces[0].joinable_spaces))
+
+        first.joinable_space.socket.close(None)
+        wait_recovered(first.supervisor)
+        reconnected = self.sessions.connect(self.spaces[0])
+        self.assertIsNot(first, reconnected)
+        self.assertEqual(2, len(self.spaces[0].joinable_spaces))
+
+    def test_leave_all(self):
+        first, second = self.sessions.connect_all()
+        self.sessions.leave_all()
+        self.assertEqual({'s-1': SpaceState.LEFT, 's-2': SpaceState.LEFT}, self.sessions.states())
+        self.assertEqual((1, 1), (first.joinable_space.left, second.joinable_space.left))
+
+
+class TestReconnectSupervisor(TestCase):
+    def test_reconnects_with_backoff_and_rejoins(self):
+        joinable_space = FakeJoinableSpace(FakeSocket(False, False, True))
+        supervisor = ReconnectSupervisor(joinable_space, RetryPolicy(attempts=5, backoff=0), connect_timeout=0)
+        joinable_space.socket.close(ConnectionResetError())
+        wait_recovered(supervisor)
+
+        self.assertEqual(3, joinable_space.socket.starts)
+        self.assertEqual(1, joinable_space.room_joiner.rejoined)
+        self.assertEqual((1, 2), (supervisor.stats.reconnects, supervisor.stats.failed_attempts))
+        self.assertIsNotNone(supervisor.stats.last_recovery_seconds)
+        self.assertEqual('c-2', joinable_space.socket.space_connection.connection_id)
+
+    def test_reconnects_after_picked_up(self):
+        joinable_space = FakeJoinableSpace()
+        supervisor = ReconnectSupervisor(joinable_space, RetryPolicy(attempts=1))
+        joinable_space.socket.process_listener(None, benedict({'pickedUp': {}}))
+        wait_recovered(supervisor)
+        self.assertEqual(1, supervisor.stats.reconnects)
+
+    def test_gives_up(self):
+        joinable_space = FakeJoinableSpace(FakeSocket(False))
+        supervisor = ReconnectSupervisor(joinable_space, RetryPolicy(attempts=3, backoff=0), connect_timeout=0)
+        joinable_space.socket.close(None)
+        wait_recovered(supervisor)
+        self.assertEqual((0, 3), (supervisor.stats.reconnects, supervisor.stats.failed_attempts))
+        self.assertEqual(1, supervisor.stats.failed_recoveries)
+        self.assertGreater(supervisor.stats.failed_recovery_seconds, 0)
+        self.assertEqual(0, joinable_space.room_joiner.rejoined)
+
+    def test_stopping_abandons_recovery(self):
+        joinable_space = FakeJoinableSpace(FakeSocket(False))
+        supervisor = ReconnectSupervisor(joinable_space, RetryPolicy(attempts=3, backoff=0), connect_timeout=0)
+        # the space is left right after it got disconnected
+        joinable_space.socket.on_closed(lambda error: supervisor.stop())
+        joinable_space.socket.close(None)
+        wait_recovered(supervisor)
+        self.assertEqual((0, 1, 0), (supervisor.stats.reconnects, supervisor.stats.abandoned_recoveries,
+                                     supervisor.stats.failed_recoveries))
+        self.assertGreater(supervisor.stats.failed_recovery_seconds, 0)
+
+    def test_stopped_supervisor_stays_disconnected(self):
+        joinable_space = FakeJoinableSpace()
+        supervisor = ReconnectSupervisor(joinable_space)
+        supervisor.stop()
+        joinable_space.socket.close(None)
+        self.assertFalse(supervisor.recovering)
+        self.assertEqual(0, joinable_space.socket.starts)
@@ -0,0 +1,67 @@
+import subprocess
+import sys
+from os import environ
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+from py_cui import PyCUI
+
+from chat.tui.startup import StartupWidgetSet
+from tests.test_fake_server import wait_until
+
+
+class FailingAccount:
+    def __init__(self):
+        self.sap = SimpleNamespace(get_account_profile=lambda: SimpleNamespace(name='tester'))
+
+    def list_spaces(self):
+        # not an OSError, e.g. a response which is no json
+        raise ValueError('Expecting value: line 1 column 1 (char 0)')
+
+
+class ScriptedStartup(StartupWidgetSet):
+    def __init__(self, cui: PyCUI, login):
+        super().__init__(cui, 'account.secret')
+        self.login = login
+
+
+class TestStartupImports(TestCase):
+    def test_defers_heavy_imports(self):
+        deferred = ['requests', 'websocket', 'cattr', 'chat.spatial.account', 'chat.tui.space']
+        script = f'import sys, chat.main; print([m for m in {deferred!r} if m in sys.modules])'
+        imported = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+        self.assertEqual('[]', imported.stdout.strip())
+
+
+class TestStartupWidgetSet(TestCase):
+    def setUp(self) -> None:
+        self.cui = PyCUI(6, 6)
+
+    def test_login_failure_shows_error(self):
+        def login():
+            raise ValueError('no account')
+
+        startup = ScriptedStartup(self.cui, login)
+        startup.prefetch()
+        self.assertEqual(['*** login failed ***'], startup.spaces_list.get_item_list())
+        self.assertIsNotNone(self.cui._popup)
+        self.assertIsNone(startup.space_select)
+
+    def test_falls_back_to_listing_spaces_after_prefetch_failed(self):
+        startup = ScriptedStartup(self.cui, FailingAccount)
+        with TemporaryDirectory() as directory, patch.dict(environ, {'XDG_CACHE_HOME': directory}):
+            startup.prefetch()
+            space_select = startup.space_select
+            self.assertIsNotNone(space_select)
+            try:
+                self.assertIsNone(space_select.prefetched_spaces)
+                self.assertEqual('Spatial Omnichat - tester', self.cui._title)
+                # the space selection lists the spaces again, failing the same way
+                space_select.activate()
+                self.assertTrue(wait_until(lambda: not space_select.listing))
+                self.assertEqual(['*** listing spaces failed ***'], space_select.spaces_list.get_item_list())
+                self.assertIsNotNone(self.cui._popup)
+            finally:
+                space_select.sessions.engine.shutdown()
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import pytz
+
+from chat.entity.messages import ChatMessage
+from chat.entity.store import RoomMessageStore
+
+
+class TestRoomMessageStore(TestCase):
+    def setUp(self) -> None:
+        self.berlin_tz = pytz.timezone('Europe/Berlin')
+        self.start = self.berlin_tz.localize(datetime(2022, 1, 25, 15, 10, 11))
+        self.store = RoomMessageStore()
+
+    def message(self, message_id: str, minutes: int, text: str = 'text') -> ChatMessage:
+        return ChatMessage('test name', text, self.start + timedelta(minutes=minutes), self.berlin_tz, message_id)
+
+    def ids(self, messages):
+        return [m.message_id for m in messages]
+
+    def test_keeps_timestamp_order(self):
+        for message_id, minutes in (('c', 3), ('a', 1), ('d', 4), ('b', 2)):
+            self.store.add(self.message(message_id, minutes))
+        self.assertEqual(['a', 'b', 'c', 'd'], self.ids(self.store.messages()))
+
+    def test_deduplicates_by_id(self):
+        self.assertTrue(self.store.add(self.message('a', 1)))
+        self.assertFalse(self.store.add(self.message('a', 1)))
+        self.assertTrue(self.store.add(self.message('a', 5, 'edited')))
+        self.store.add(self.message('b', 2))
+        self.assertEqual(['b', 'a'], self.ids(self.store.messages()))
+        self.assertEqual('edited', self.store.get('a').message)
+
+    def test_replace_and_remove(self):
+        self.store.add(self.message('x', 0))
+        self.store.replace([self.message('b', 2), self.message('a', 1)])
+        self.assertEqual(['a', 'b'], self.ids(self.store.messages()))
+        self.assertEqual('a', self.store.remove('a').message_id)
+        self.assertIsNone(self.store.remove('a'))
+        self.assertEqual(['b'], self.ids(self.store.messages()))
+
+    def test_merge_drops_messages_missing_from_state(self):
+        self.store.extend([self.message('a', 1), self.message('b', 2), self.message('c', 3)])
+        stale = self.store.merge([self.message('b', 2), self.message('d', 4)])
+        self.assertEqual(['c'], stale)
+        self.assertEqual(['a', 'b', 'd'], self.ids(self.store.messages()))
+
+    def test_slices(self):
+        self.store.extend(self.message(str(i), i) for i in range(10))
+        self.assertEqual(['7', '8', '9'], self.ids(self.store.last(3)))
+        self.assertEqual([], self.store.last(0))
+        self.assertEqual(['8', '9'], self.ids(self.store.since(self.start + timedelta(minutes=8))))
+
+    def test_materializes_equal_messages(self):
+        messages = [self.message('a', 1), ChatMessage('other name', 'text', self.start, self.berlin_tz, 'b')]
+        self.store.extend(messages)
+        self.assertEqual([messages[1], messages[0]], self.store.messages())
+        self.assertEqual(messages[0], self.store.get('a'))
+        self.assertEqual(['test name', 'other name'], self.store.authors.names)
+
+    def test_bounded_by_count(self):
+        store = RoomMessageStore(max_messages=3)
+        store.extend(self.message(str(i), i) for i in range(5))
+        self.assertEqual(['2', '3', '4'], self.ids(store.messages()))
+        self.assertFalse(store.add(self.message('old', -1)))
+        self.assertNotIn('0', store)
+
+    def test_bounded_by_age(self):
+        store = RoomMessageStore(max_age=timedelta(hours=1))
+        now = datetime.now(self.berlin_tz)
+        store.add(ChatMessage('test name', 'old', now - timedelta(hours=2), self.berlin_tz, 'old'))
+        store.add(ChatMessage('test name', 'new', now, self.berlin_tz, 'new'))
+        self.assertEqual(['new'], self.ids(store.messages()))